@@ -0,0 +1,122 @@
+"""Compara o pico de memória da redução do *changelog* por meio de uma
+máquina de estados por entidade, implementação original de
+`kernel.TasksReader`, com o da redução compacta atual.
+
+Exemplo:
+
+    $ python benchmarks/bench_changelog_memory.py --entries 2000000
+"""
+import re
+import argparse
+import json
+import time
+import tracemalloc
+
+from oaipmhserver.adapters import kernel
+
+
+class EnqueuedState:
+    task = "get"
+
+    def on_event(self, event):
+        if event == "deleted":
+            return DeletedState()
+
+        return self
+
+
+class DeletedState:
+    task = "delete"
+
+    def on_event(self, event):
+        if event == "modified":
+            return EnqueuedState()
+
+        return self
+
+
+class ChangelogStateMachine:
+    def __init__(self):
+        self.state = EnqueuedState()
+
+    def on_event(self, event):
+        self.state = self.state.on_event(event)
+
+    def task(self):
+        return self.state.task
+
+
+class Tasks:
+    def __init__(self, tasks, timestamp):
+        self.tasks = tasks
+        self.timestamp = timestamp
+
+    def docs(self):
+        return (t for t in self.tasks if re.match(r"^/documents/[\w-]+$", t["id"]))
+
+    def docs_to_get(self):
+        return (t for t in self.docs() if t.get("task") == "get")
+
+
+class StateMachineTasksReader(kernel.TasksReader):
+    """Implementação original, com uma instância de `ChangelogStateMachine`
+    por entidade e uma lista de dicionários como tarefas.
+    """
+
+    def read(self, changelog):
+        entities = {}
+        last_timestamp = None
+        for entry in changelog:
+            last_timestamp = entry["timestamp"]
+            machine = entities.setdefault(entry["id"], ChangelogStateMachine())
+            machine.on_event("deleted" if entry.get("deleted", False) else "modified")
+        tasks = [{"id": id, "task": m.task()} for id, m in entities.items()]
+        return Tasks(tasks=tasks, timestamp=last_timestamp)
+
+
+def changelog(entries):
+    """Produz registros semelhantes aos obtidos do Kernel, cujos valores são
+    novas cadeias de caracteres a cada registro, como ocorre após a
+    decodificação do JSON de cada página.
+    """
+    for i in range(entries):
+        if i % 10 == 0:
+            id = "/bundles/0034-8910-rsp-%d" % (i % 5000)
+        else:
+            # cerca de metade dos documentos aparece mais de uma vez.
+            id = "/documents/%023d" % (i % (entries // 2))
+        entry = {"timestamp": "2020-01-01T00:00:00.%06dZ" % (i % 10 ** 6), "id": id}
+        if i % 13 == 0:
+            entry["deleted"] = True
+        yield json.loads(json.dumps(entry))
+
+
+def measure(reader, entries):
+    tracemalloc.start()
+    started = time.perf_counter()
+    tasks = reader.read(changelog(entries))
+    docs_to_get = sum(1 for _ in tasks.docs_to_get())
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return docs_to_get, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=500000)
+    args = parser.parse_args()
+
+    for label, reader in [
+        ("state machine", StateMachineTasksReader()),
+        ("compact", kernel.TasksReader()),
+    ]:
+        docs_to_get, elapsed, peak = measure(reader, args.entries)
+        print(
+            "%-14s docs_to_get=%-9d %7.2fs peak=%8.1f MiB"
+            % (label, docs_to_get, elapsed, peak / 2 ** 20)
+        )
+
+
+if __name__ == "__main__":
+    main()
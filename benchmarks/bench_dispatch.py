@@ -0,0 +1,168 @@
+"""Mede o custo de CPU por requisição no caminho entre `OAIServer` e as
+coleções do MongoDB, com e sem o reuso dos *stores* e das coleções.
+
+O cliente do MongoDB é substituído por um objeto em memória que responde
+sempre com os mesmos documentos, de maneira que apenas o custo da aplicação
+seja medido.
+
+Exemplo:
+
+    $ python benchmarks/bench_dispatch.py --requests 20000
+"""
+import argparse
+import time
+from datetime import datetime
+
+from oaipmh import metadata
+
+from oaipmhserver import server
+from oaipmhserver.adapters import mongodb
+from bench_record_rendering import make_docs
+
+
+class FakeCursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def find(self, query=None, projection=None, skip=0, limit=0, **kwargs):
+        return FakeCursor(self._docs[:limit])
+
+    def find_one(self, query=None, projection=None, **kwargs):
+        return self._docs[0]
+
+
+class FakeDatabase:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __getitem__(self, colname):
+        return FakeCollection(self._docs)
+
+
+class FakeMongoClient:
+    docs = []
+
+    def __init__(self, uri, **options):
+        pass
+
+    def __getitem__(self, dbname):
+        return FakeDatabase(self.docs)
+
+
+class LegacyMongoDB(mongodb.MongoDB):
+    """Reproduz o comportamento anterior, em que as opções eram resolvidas e
+    as coleções obtidas a cada acesso.
+    """
+
+    @property
+    def _client(self):
+        options = {k: v for k, v in self._options.items() if v}
+        if not self._client_instance:
+            self._client_instance = self._MongoClient(self._uri, **options)
+        mongodb.LOGGER.debug(
+            "using MongoDB client: <%r at %s>",
+            self._client_instance,
+            id(self._client_instance),
+        )
+        return self._client_instance
+
+    def _collection(self, colname):
+        return self._db()[colname]
+
+
+class LegacySession(mongodb.Session):
+    """Reproduz o comportamento anterior, em que os *stores* eram produzidos a
+    cada acesso.
+    """
+
+    def _store(self, name, factory):
+        return factory()
+
+
+def make_server(MongoDB, Session):
+    mongo = MongoDB(
+        "mongodb://fake",
+        "oaipmh",
+        mongoclient=FakeMongoClient,
+        options={"replicaSet": "", "readPreference": "secondaryPreferred"},
+    )
+    context = {
+        "url_for_html": lambda acron, doc_id: "https://www.scielo.br/j/%s/a/%s"
+        % (acron, doc_id),
+    }
+    registry = metadata.MetadataRegistry()
+    for fmt in server.METADATA_FORMATS:
+        registry.registerWriter(fmt[0], fmt[3])
+    return server.KeysetBatchingServer(
+        server.OAIServer(
+            Session(mongo, context=context),
+            meta=server.server_identity(
+                server.parse_settings({}), earliest_datestamp=datetime(1998, 1, 1)
+            ),
+            formats=server.METADATA_FORMATS,
+        ),
+        metadata_registry=registry,
+        resumption_batch_size=1,
+    )
+
+
+def measure(oaiserver, request, requests, rounds=5):
+    """Retorna o menor custo médio entre `rounds` rodadas.
+    """
+    results = []
+    for _ in range(rounds):
+        started = time.process_time()
+        for _ in range(requests):
+            oaiserver.handleRequest(request)
+        results.append((time.process_time() - started) / requests)
+    return min(results)
+
+
+def measure_access(oaiserver, accesses=100000):
+    """Custo de obter o *store* e a coleção de documentos, que ocorre ao
+    menos uma vez por requisição.
+    """
+    session = oaiserver._resumption._server.session
+    started = time.process_time()
+    for _ in range(accesses):
+        session.documents._collection
+    return (time.process_time() - started) / accesses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    FakeMongoClient.docs = make_docs(2)
+    verbs = [
+        {"verb": "GetRecord", "metadataPrefix": "oai_dc", "identifier": "oai:x:y"},
+        {"verb": "ListIdentifiers", "metadataPrefix": "oai_dc"},
+    ]
+    for request in verbs:
+        legacy = measure(
+            make_server(LegacyMongoDB, LegacySession), request, args.requests
+        )
+        current = measure(
+            make_server(mongodb.MongoDB, mongodb.Session), request, args.requests
+        )
+        print(
+            "%-16s legacy %7.1fus  current %7.1fus CPU/request (%.2fx)"
+            % (request["verb"], legacy * 1e6, current * 1e6, legacy / current)
+        )
+
+    legacy = measure_access(make_server(LegacyMongoDB, LegacySession))
+    current = measure_access(make_server(mongodb.MongoDB, mongodb.Session))
+    print(
+        "%-16s legacy %7.2fus  current %7.2fus CPU/access (%.2fx)"
+        % ("store access", legacy * 1e6, current * 1e6, legacy / current)
+    )
+
+
+if __name__ == "__main__":
+    main()
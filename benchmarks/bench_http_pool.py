@@ -0,0 +1,58 @@
+"""Compara a vazão na obtenção do *front-matter* dos documentos a partir de
+uma instância local e falsa do Kernel, com e sem o reuso de conexões HTTP.
+
+Exemplo:
+
+    $ python benchmarks/bench_http_pool.py --docs 5000 --concurrency 8
+"""
+import argparse
+import time
+import concurrent.futures
+
+import requests
+
+from oaipmhserver.adapters import kernel
+from fakekernel import FakeKernel, doc_id
+
+
+class UnpooledDataConnector(kernel.DataConnector):
+    """Reproduz o comportamento anterior, em que cada requisição estabelece
+    uma nova conexão.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.throttle = None
+        self.fetch_xml = False
+        self._http = requests
+
+
+def measure(connector, docs, concurrency):
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        urls = ("/documents/%s" % doc_id(i) for i in range(docs))
+        for _ in executor.map(connector.doc_metadata, urls):
+            pass
+    return docs / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    with FakeKernel(size=args.docs) as host:
+        unpooled = measure(UnpooledDataConnector(host), args.docs, args.concurrency)
+        pooled = measure(
+            kernel.DataConnector(host, pool_size=args.concurrency),
+            args.docs,
+            args.concurrency,
+        )
+
+    print("unpooled %10.1f docs/s" % unpooled)
+    print("pooled   %10.1f docs/s (%.2fx)" % (pooled, pooled / unpooled))
+
+
+if __name__ == "__main__":
+    main()
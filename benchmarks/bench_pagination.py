@@ -0,0 +1,94 @@
+"""Compara o custo da paginação por deslocamento (`skip`/`limit`) com o da
+paginação por chave (`(timestamp, doc_id)`) ao percorrer por completo uma
+coleção sintética armazenada em uma instância local do MongoDB.
+
+Exemplo:
+
+    $ python benchmarks/bench_pagination.py mongodb://localhost:27017 --size 200000
+
+O banco de dados informado em `--dbname` é removido ao final da execução.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from oaipmhserver.adapters import mongodb
+
+
+def populate(mongo, size, chunk_size=5000):
+    base = datetime(2020, 1, 1)
+    docs = []
+    for i in range(size):
+        docs.append(
+            {
+                "doc_id": "doc-%09d" % i,
+                # vários documentos com o mesmo `timestamp`, como ocorre na
+                # sincronização em lote.
+                "timestamp": base + timedelta(seconds=i // 7),
+                "sets": [{"set_spec": "set-%d" % (i % 50), "set_name": "Set"}],
+                "titles": [{"lang": "en", "title": "Title of document %d" % i}],
+                "journal_acron": "set-%d" % (i % 50),
+            }
+        )
+        if len(docs) == chunk_size:
+            mongo.documents.insert_many(docs)
+            docs = []
+    if docs:
+        mongo.documents.insert_many(docs)
+    mongo.create_indexes()
+
+
+def walk(store, page_size, keyset):
+    """Percorre a coleção inteira e retorna a duração de cada página.
+    """
+    durations = []
+    offset, after = 0, None
+    while True:
+        started = time.perf_counter()
+        page = [
+            r.data for r in store.filter(offset=offset, limit=page_size, after=after)
+        ]
+        durations.append(time.perf_counter() - started)
+        if len(page) < page_size:
+            return durations
+        offset += page_size
+        if keyset:
+            after = (page[-1]["timestamp"], page[-1]["doc_id"])
+
+
+def report(label, durations, sample=10):
+    print(
+        "%-8s pages=%-6d total=%8.2fs first %d pages=%7.2fms last %d pages=%7.2fms"
+        % (
+            label,
+            len(durations),
+            sum(durations),
+            sample,
+            sum(durations[:sample]) / sample * 1000,
+            sample,
+            sum(durations[-sample:]) / sample * 1000,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mongodb_dsn")
+    parser.add_argument("--dbname", default="oaipmh_bench_pagination")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    mongo = mongodb.MongoDB(args.mongodb_dsn, args.dbname)
+    mongo._client.drop_database(args.dbname)
+    try:
+        populate(mongo, args.size)
+        store = mongodb.Session(mongo).documents
+        report("offset", walk(store, args.page_size, keyset=False))
+        report("keyset", walk(store, args.page_size, keyset=True))
+    finally:
+        mongo._client.drop_database(args.dbname)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compara o custo de CPU por requisição ListRecords com e sem o reuso das
+renderizações armazenadas dos registros.
+
+Os registros são mantidos em memória para que apenas a renderização da
+resposta seja medida.
+
+Exemplo:
+
+    $ python benchmarks/bench_record_rendering.py --batch-size 100 --requests 50
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from oaipmh import metadata
+
+from oaipmhserver import server
+from oaipmhserver.adapters import mongodb
+
+
+class InMemoryDocumentStore:
+    def __init__(self, docs, context):
+        self._docs = docs
+        self._context = context
+
+    def filter(self, offset=0, limit=10, **kwargs):
+        return (
+            mongodb.OAIRecord(doc, context=self._context, store=self)
+            for doc in self._docs[offset : offset + limit]
+        )
+
+    def store_rendered(self, doc_id, timestamp, metadata_prefix, rendered):
+        for doc in self._docs:
+            if doc["doc_id"] == doc_id and doc["timestamp"] == timestamp:
+                doc.setdefault("rendered", {})[metadata_prefix] = rendered
+
+
+def make_docs(size):
+    base = datetime(2020, 1, 1)
+    return [
+        {
+            "doc_id": "doc%020d" % i,
+            "timestamp": base + timedelta(seconds=i),
+            "sets": [{"set_spec": "rsp", "set_name": "Revista de Saúde Pública"}],
+            "journal_acron": "rsp",
+            "pub_date": base,
+            "language": "en",
+            "publisher": "Faculdade de Saúde Pública da Universidade de São Paulo",
+            "doi": "10.1590/S0034-8910.%d" % i,
+            "type": "research-article",
+            "creators": [
+                {"surname": "surname %d" % j, "given_name": "given name"}
+                for j in range(6)
+            ],
+            "titles": [{"lang": "en", "title": "Title of the document %d" % i}],
+            "descriptions": [
+                {"lang": "en", "description": "Abstract of the document. " * 40},
+                {"lang": "pt", "description": "Resumo do documento. " * 40},
+            ],
+            "keywords": [{"lang": "en", "kwd": "keyword %d" % j} for j in range(8)],
+        }
+        for i in range(size)
+    ]
+
+
+def make_server(docs, cache_rendered, batch_size):
+    context = {
+        "url_for_html": lambda acron, doc_id: "https://www.scielo.br/j/%s/a/%s"
+        % (acron, doc_id),
+        "rendered_version": server.RENDERED_VERSION,
+    }
+    session = SimpleNamespace(documents=InMemoryDocumentStore(docs, context))
+    registry = metadata.MetadataRegistry()
+    for fmt in server.METADATA_FORMATS:
+        registry.registerWriter(fmt[0], server.caching_writer(fmt[3]))
+    return server.KeysetBatchingServer(
+        server.OAIServer(
+            session,
+            meta=server.server_identity(
+                server.parse_settings({}), earliest_datestamp=datetime(1998, 1, 1)
+            ),
+            formats=server.METADATA_FORMATS,
+            cache_rendered=cache_rendered,
+        ),
+        metadata_registry=registry,
+        resumption_batch_size=batch_size,
+    )
+
+
+def measure(oaiserver, requests):
+    request = {"verb": "ListRecords", "metadataPrefix": "oai_dc"}
+    oaiserver.handleRequest(request)  # armazena as renderizações
+    started = time.process_time()
+    for _ in range(requests):
+        oaiserver.handleRequest(request)
+    return (time.process_time() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    current = measure(
+        make_server(make_docs(args.batch_size + 1), False, args.batch_size),
+        args.requests,
+    )
+    cached = measure(
+        make_server(make_docs(args.batch_size + 1), True, args.batch_size),
+        args.requests,
+    )
+    print("rendered %8.2fms CPU/request" % (current * 1000))
+    print("cached   %8.2fms CPU/request (%.2fx)" % (cached * 1000, current / cached))
+
+
+if __name__ == "__main__":
+    main()
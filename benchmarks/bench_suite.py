@@ -0,0 +1,326 @@
+"""Executa, de ponta a ponta, a sincronização de uma coleção sintética a partir
+de uma instância local e falsa do Kernel e as requisições OAI-PMH sobre a
+base resultante, e grava um relatório em JSON que permite comparar os
+resultados entre *commits*.
+
+São medidos a vazão da sincronização, a latência das páginas iniciais e
+finais de `ListIdentifiers` e `ListRecords`, a distribuição da latência de
+`GetRecord` e o pico de memória do processo ao final de cada etapa.
+
+Exemplo:
+
+    $ python benchmarks/bench_suite.py --docs 20000 --output report.json
+    $ python benchmarks/bench_suite.py --docs 20000 --baseline report.json
+
+Por padrão o MongoDB é substituído pelo `mongomock`, em memória, cujas
+latências não são representativas das de um servidor real, mas permitem
+comparar o custo da aplicação. Informe `--mongodb-dsn` para usar uma instância
+local do MongoDB; o banco de dados informado em `--dbname` é removido ao final
+da execução.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import functools
+import platform
+import resource
+import subprocess
+import tracemalloc
+from datetime import datetime
+from unittest import mock
+from urllib.parse import urlencode
+
+from lxml import etree
+from pyramid.request import Request
+
+from oaipmhserver import oaipmhctl, server
+from oaipmhserver.adapters import mongodb
+from fakekernel import FakeKernel, doc_id
+
+
+OAI_NAMESPACES = {"oai": "http://www.openarchives.org/OAI/2.0/"}
+
+
+def percentile(values, p):
+    """Percentil `p` de `values` pelo método do posto mais próximo.
+    """
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(durations):
+    return {
+        "count": len(durations),
+        "mean_ms": sum(durations) / len(durations) * 1000,
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def max_rss():
+    """Pico do uso de memória residente do processo, em *bytes*.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # o valor é informado em KiB no Linux e em *bytes* no macOS.
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Stage:
+    """Mede a duração e o uso de memória de uma etapa. Com `trace_memory` o
+    pico de memória alocada pelo Python durante a etapa também é medido, ao
+    custo de tornar a execução mais lenta.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.result = {}
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.result["elapsed_seconds"] = time.perf_counter() - self._started
+        if self.trace_memory:
+            _, self.result["traced_peak_bytes"] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.result["max_rss_bytes"] = max_rss()
+
+
+def backend(args):
+    """Obtém a função que instancia o cliente do MongoDB. Todas as instâncias
+    do `mongomock` compartilham os mesmos dados, como ocorreria com um
+    servidor.
+    """
+    if args.mongodb_dsn:
+        return mongodb.pymongo.MongoClient
+
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("mongomock is required unless --mongodb-dsn is given")
+
+    client = mongomock.MongoClient()
+    return lambda uri, **options: client
+
+
+def sync(args, host, mongoclient):
+    mongo = mongodb.MongoDB(args.dsn, args.dbname, mongoclient=mongoclient)
+    mongo.create_indexes()
+    session = mongodb.Session(mongo)
+    sync_args = argparse.Namespace(
+        source=host,
+        engine=args.engine,
+        concurrency=args.concurrency,
+        max_rate=args.max_rate,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        flush_interval=5.0,
+        formats=args.metadata_prefix,
+    )
+    synchronizer = oaipmhctl._synchronizer(sync_args, session)
+    with Stage(args.trace_memory) as stage:
+        synchronizer.sync(checkpoint=functools.partial(oaipmhctl._checkpoint, session))
+    stage.result["docs"] = session.documents._collection.count_documents({})
+    stage.result["docs_per_second"] = (
+        stage.result["docs"] / stage.result["elapsed_seconds"]
+    )
+    return stage.result
+
+
+def make_app(args, mongoclient):
+    settings = {
+        "oaipmh.mongodb.dsn": args.dsn,
+        "oaipmh.mongodb.dbname": args.dbname,
+        "oaipmh.resumptiontoken.batchsize": str(args.page_size),
+        "oaipmh.response.streaming": str(args.streaming).lower(),
+        "oaipmh.response.compressionlevel": "0",
+        "oaipmh.getrecord.cachesize": str(args.getrecord_cachesize),
+        "oaipmh.formats": args.metadata_prefix,
+    }
+    with mock.patch.object(
+        server.mongodb,
+        "MongoDB",
+        functools.partial(mongodb.MongoDB, mongoclient=mongoclient),
+    ):
+        return server.main({}, **settings)
+
+
+def request(app, **params):
+    """Obtém a resposta de `app` à requisição OAI-PMH com os parâmetros
+    `params`, bem como a sua duração, inclusive a serialização completa.
+    """
+    started = time.perf_counter()
+    response = Request.blank("/?" + urlencode(params)).get_response(app)
+    body = response.body
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise RuntimeError("unexpected response: %s" % response.status)
+    return etree.fromstring(body), elapsed
+
+
+def walk(args, app, verb):
+    """Percorre a lista completa produzida por `verb` e mede a duração das
+    `args.sample` páginas iniciais e finais.
+    """
+    durations = []
+    items = 0
+    params = {"verb": verb, "metadataPrefix": args.metadata_prefix}
+    with Stage(args.trace_memory) as stage:
+        while True:
+            tree, elapsed = request(app, **params)
+            durations.append(elapsed)
+            items += len(tree.xpath("//oai:header", namespaces=OAI_NAMESPACES))
+            token = tree.xpath(
+                "//oai:resumptionToken/text()", namespaces=OAI_NAMESPACES
+            )
+            if not token:
+                break
+            params = {"verb": verb, "resumptionToken": token[0]}
+
+    stage.result.update(
+        {
+            "pages": len(durations),
+            "items": items,
+            "shallow": summarize(durations[: args.sample]),
+            "deep": summarize(durations[-args.sample :]),
+        }
+    )
+    return stage.result
+
+
+def get_records(args, app):
+    rand = random.Random(args.seed)
+    durations = []
+    with Stage(args.trace_memory) as stage:
+        for _ in range(args.requests):
+            _, elapsed = request(
+                app,
+                verb="GetRecord",
+                metadataPrefix=args.metadata_prefix,
+                identifier="oai:scielo.org:%s" % doc_id(rand.randrange(args.docs)),
+            )
+            durations.append(elapsed)
+    stage.result.update(summarize(durations))
+    return stage.result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(report, baseline, path=()):
+    """Produz a variação relativa de cada medida de `report` em relação às de
+    `baseline`.
+    """
+    for key, value in report.items():
+        if key not in baseline:
+            continue
+        if isinstance(value, dict):
+            yield from compare(value, baseline[key], path + (key,))
+        elif isinstance(value, (int, float)) and baseline[key]:
+            yield ".".join(path + (key,)), baseline[key], value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument(
+        "-e", "--engine", choices=sorted(oaipmhctl.ENGINES), default="thread"
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--max-rate", type=float, default=1000.0)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--metadata-prefix", default="oai_dc")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--getrecord-cachesize", type=int, default=0)
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=5,
+        help="Number of shallow and deep pages whose latency is reported.",
+    )
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also measure the peak memory allocated by Python in each stage. "
+        "Stages become considerably slower.",
+    )
+    parser.add_argument("--mongodb-dsn", default="")
+    parser.add_argument("--dbname", default="oaipmh_bench_suite")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file.")
+    parser.add_argument("--baseline", help="JSON report to compare the results to.")
+    args = parser.parse_args()
+    args.dsn = args.mongodb_dsn or "mongodb://mongomock"
+
+    mongoclient = backend(args)
+    if args.mongodb_dsn:
+        mongoclient(args.dsn).drop_database(args.dbname)
+
+    try:
+        results = {}
+        with FakeKernel(size=args.docs, latency=args.latency) as host:
+            results["sync"] = sync(args, host, mongoclient)
+
+        app = make_app(args, mongoclient)
+        results["ListIdentifiers"] = walk(args, app, "ListIdentifiers")
+        results["ListRecords"] = walk(args, app, "ListRecords")
+        results["GetRecord"] = get_records(args, app)
+    finally:
+        if args.mongodb_dsn:
+            mongoclient(args.dsn).drop_database(args.dbname)
+
+    parameters = dict(vars(args))
+    for name in ("output", "baseline", "dsn", "mongodb_dsn"):
+        parameters.pop(name)
+    report = {
+        "revision": git_revision(),
+        "created": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "backend": "mongod" if args.mongodb_dsn else "mongomock",
+        "parameters": parameters,
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != parameters:
+            print(
+                "warning: the baseline was run with other parameters", file=sys.stderr
+            )
+        for name, before, after in compare(results, baseline.get("results", {})):
+            print(
+                "%-40s %12.2f %12.2f %+8.1f%%"
+                % (name, before, after, (after - before) / before * 100),
+                file=sys.stderr,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Compara os motores de sincronização `thread` e `async` do `oaipmhctl sync`
+contra uma instância local e falsa do Kernel, que simula a latência de rede
+de cada requisição.
+
+Exemplo:
+
+    $ python benchmarks/bench_sync_engines.py --docs 5000 --latency 0.05
+
+Por padrão os documentos são descartados após obtidos, de forma que apenas a
+obtenção seja medida. Informe `--mongodb-dsn` para gravá-los em um MongoDB.
+"""
+import argparse
+import time
+from unittest import mock
+
+from oaipmhserver import oaipmhctl
+from oaipmhserver.adapters import kernel, aiokernel, mongodb
+from fakekernel import FakeKernel
+
+
+def null_session():
+    session = mock.Mock()
+    session.documents.upsert_many.return_value = [], 0
+    session.retries.ids.return_value = []
+    session.retries.count.return_value = 0
+    return session
+
+
+def measure(engine, connector, session, concurrency):
+    synchronizer = engine(
+        source=connector,
+        dest=session,
+        reader=kernel.TasksReader(),
+        max_concurrency=concurrency,
+    )
+    started = time.perf_counter()
+    synchronizer.sync()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--thread-concurrency", type=int, default=4)
+    parser.add_argument("--async-concurrency", type=int, default=200)
+    parser.add_argument("--mongodb-dsn", default="")
+    parser.add_argument("--dbname", default="oaipmh_bench_sync")
+    args = parser.parse_args()
+
+    if args.mongodb_dsn:
+        mongo = mongodb.MongoDB(args.mongodb_dsn, args.dbname)
+        mongo._client.drop_database(args.dbname)
+        session = mongodb.Session(mongo)
+    else:
+        session = null_session()
+
+    with FakeKernel(size=args.docs, latency=args.latency) as host:
+        runs = [
+            (
+                "thread",
+                args.thread_concurrency,
+                measure(
+                    oaipmhctl.Synchronizer,
+                    kernel.DataConnector(host, pool_size=args.thread_concurrency),
+                    session,
+                    args.thread_concurrency,
+                ),
+            ),
+            (
+                "async",
+                args.async_concurrency,
+                measure(
+                    oaipmhctl.AsyncSynchronizer,
+                    aiokernel.DataConnector(host, pool_size=args.async_concurrency),
+                    session,
+                    args.async_concurrency,
+                ),
+            ),
+        ]
+
+    if args.mongodb_dsn:
+        mongo._client.drop_database(args.dbname)
+
+    for engine, concurrency, elapsed in runs:
+        print(
+            "%-7s concurrency=%-4d %8.2fs %10.1f docs/s"
+            % (engine, concurrency, elapsed, args.docs / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Servidor HTTP local que imita os *endpoints* do Kernel usados pela
+sincronização: `/changes?since=<timestamp>`, `/documents/<id>/front` e
+`/documents/<id>`.
+
+Os documentos são sintéticos e produzidos de maneira determinística a partir
+de sua posição no *changelog*, de forma que nenhum dado precisa ser mantido em
+memória independentemente do tamanho da coleção.
+"""
+import gzip
+import json
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+BASE_TIMESTAMP = datetime(2020, 1, 1)
+TIMESTAMP_FMT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def doc_id(index):
+    return "fake%019d" % index
+
+
+def change_timestamp(index):
+    return (BASE_TIMESTAMP + timedelta(microseconds=index)).strftime(TIMESTAMP_FMT)
+
+
+def change_index(timestamp):
+    delta = datetime.strptime(timestamp, TIMESTAMP_FMT) - BASE_TIMESTAMP
+    return delta // timedelta(microseconds=1)
+
+
+def front(index, sets=50):
+    acron = "j%d" % (index % sets)
+    return {
+        "journal_meta": [
+            {
+                "journal_publisher_id": [acron],
+                "journal_title": ["Journal %s" % acron],
+                "publisher_name": ["Publisher of %s" % acron],
+            }
+        ],
+        "pub_date": [{"text": ["01 05 2020"]}],
+        "contrib": [
+            {"contrib_surname": ["Surname%d" % i], "contrib_given_names": ["Given"]}
+            for i in range(4)
+        ],
+        "article": [{"lang": ["en"], "type": ["research-article"]}],
+        "article_meta": [
+            {
+                "article_title": ["Title of the synthetic document %d" % index],
+                "abstract": ["Abstract of the synthetic document. " * 40],
+                "article_doi": ["10.1590/fake.%d" % index],
+            }
+        ],
+        "trans_abstract": [
+            {"lang": ["pt"], "text": ["Resumo do documento sintético. " * 40]}
+        ],
+        "kwd_group": [
+            {"lang": ["en"], "kwd": ["keyword %d" % i for i in range(5)]},
+            {"lang": ["pt"], "kwd": ["palavra %d" % i for i in range(5)]},
+        ],
+    }
+
+
+ARTICLE_XML = """\
+<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE article PUBLIC "-//NLM//DTD JATS (Z39.96) Journal Publishing DTD v1.1 20151215//EN" "https://jats.nlm.nih.gov/publishing/1.1/JATS-journalpublishing1.dtd">
+<article xmlns:xlink="http://www.w3.org/1999/xlink" article-type="research-article" xml:lang="en">
+<front><article-meta><article-id pub-id-type="doi">10.1590/fake.%(index)d</article-id>
+<title-group><article-title>Title of the synthetic document %(index)d</article-title></title-group>
+</article-meta></front>
+<body><p>%(body)s</p></body>
+</article>
+"""
+
+
+def article_xml(index):
+    body = "Body of the synthetic document. " * 200
+    return (ARTICLE_XML % {"index": index, "body": body}).encode("utf-8")
+
+
+class FakeKernelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # evita que o cabeçalho e o corpo da resposta, escritos separadamente,
+        # aguardem pelo ACK do cliente em conexões persistentes.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        kernel = self.server.kernel
+        if kernel.latency:
+            time.sleep(kernel.latency)
+
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts == ["changes"]:
+            since = parse_qs(url.query).get("since", [""])[0]
+            self._reply(kernel.changes(since))
+        elif len(parts) == 3 and parts[0] == "documents" and parts[2] == "front":
+            self._reply_document(parts[1], lambda index: self._reply(front(index)))
+        elif len(parts) == 2 and parts[0] == "documents":
+            self._reply_document(
+                parts[1],
+                lambda index: self._reply_body(article_xml(index), "text/xml"),
+            )
+        else:
+            self._reply({"message": "not found"}, status=404)
+
+    def _reply_document(self, doc_id, reply):
+        try:
+            index = int(doc_id[len("fake") :])
+        except ValueError:
+            self._reply({"message": "not found"}, status=404)
+        else:
+            reply(index)
+
+    def _reply(self, data, status=200):
+        self._reply_body(json.dumps(data).encode("utf-8"), "application/json", status)
+
+    def _reply_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeKernelServer(ThreadingHTTPServer):
+    # suficiente para centenas de conexões simultâneas.
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeKernel:
+    """Instância local do Kernel com `size` documentos.
+
+    :param page_size: (opcional) número de registros por página de `/changes`.
+    :param latency: (opcional) segundos de espera antes de cada resposta.
+    :param deleted_every: (opcional) a cada `deleted_every` registros do
+    *changelog*, um documento anterior é removido.
+    """
+
+    def __init__(self, size, page_size=500, latency=0.0, deleted_every=0):
+        self.size = size
+        self.page_size = page_size
+        self.latency = latency
+        self.deleted_every = deleted_every
+        self._httpd = None
+
+    def changes(self, since=""):
+        start = change_index(since) + 1 if since else 0
+        results = []
+        for index in range(start, min(start + self.page_size, self.size)):
+            change = {
+                "timestamp": change_timestamp(index),
+                "id": "/documents/%s" % doc_id(index),
+            }
+            if self.deleted_every and index % self.deleted_every == 0 and index:
+                change["id"] = "/documents/%s" % doc_id(index - 1)
+                change["deleted"] = True
+            results.append(change)
+        return {"since": since, "limit": self.page_size, "results": results}
+
+    def start(self):
+        self._httpd = FakeKernelServer(("127.0.0.1", 0), FakeKernelHandler)
+        self._httpd.kernel = self
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:%s/" % self._httpd.server_address[1]
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,124 @@
+"""Variante assíncrona do adaptador do Kernel, usada pelo motor de
+sincronização baseado em asyncio. Depende do pacote `aiohttp`, que deve ser
+instalado à parte, p. ex., por meio de `pip install scielo-kernel-oaipmh[async]`.
+"""
+import json
+import time
+import asyncio
+import logging
+
+import aiohttp
+
+from .. import exceptions
+from . import kernel
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+@kernel.retry_gracefully()
+async def fetch_data(
+    session: aiohttp.ClientSession,
+    url: str,
+    timeout: float = kernel.HTTP_REQ_TIMEOUT,
+    throttle=None,
+) -> bytes:
+    """Obtém o conteúdo de `url`. Veja `kernel.fetch_data`.
+    """
+    if throttle is None:
+        return await _fetch_data(session, url, timeout)
+
+    await throttle.acquire_async()
+    started = time.monotonic()
+    try:
+        content = await _fetch_data(session, url, timeout)
+    except exceptions.RetryableError:
+        throttle.on_failure()
+        raise
+    except exceptions.NonRetryableError:
+        throttle.on_success(time.monotonic() - started)
+        raise
+    throttle.on_success(time.monotonic() - started)
+    return content
+
+
+async def _fetch_data(session, url, timeout):
+    try:
+        async with session.get(
+            url, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            if 400 <= response.status < 500:
+                raise exceptions.NonRetryableError(
+                    "%s Client Error for url: %s" % (response.status, url)
+                )
+            elif 500 <= response.status < 600:
+                raise exceptions.RetryableError(
+                    "%s Server Error for url: %s" % (response.status, url)
+                )
+            return await response.read()
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+        raise exceptions.RetryableError(exc) from exc
+    except aiohttp.InvalidURL as exc:
+        raise exceptions.NonRetryableError(exc) from exc
+
+
+class DataConnector(kernel.DataConnector):
+    """Conexão com uma instância do Kernel que, além da interface de
+    `kernel.DataConnector`, oferece a obtenção dos metadados dos documentos
+    por meio da corrotina `doc_metadata_async`.
+
+    A sessão HTTP assíncrona é aberta e fechada ao entrar e sair do contexto
+    assíncrono do objeto, i.e., `async with connector: ...`.
+
+    :param pool_size: (opcional) número máximo de conexões HTTP simultâneas com
+    o Kernel.
+    """
+
+    def __init__(self, host, pool_size=100, throttle=None, fetch_xml=False):
+        super().__init__(
+            host, pool_size=pool_size, throttle=throttle, fetch_xml=fetch_xml
+        )
+        self.pool_size = pool_size
+        self._aiohttp = None
+
+    async def __aenter__(self):
+        self._aiohttp = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._aiohttp.close()
+        self._aiohttp = None
+
+    async def doc_metadata_async(self, url, sets_extractors=kernel.SETS_EXTRACTORS):
+        """Equivalente assíncrono de `doc_metadata`. O *front-matter* e o XML
+        são obtidos simultaneamente.
+        """
+        requests = [
+            fetch_data(
+                self._aiohttp,
+                self._absolute_url(f"{url}/front"),
+                throttle=self.throttle,
+            )
+        ]
+        if self.fetch_xml:
+            requests.append(self._doc_xml_async(url))
+        front, *xml = await asyncio.gather(*requests)
+        xml, xml_error = xml[0] if xml else (None, None)
+        return self._front_to_metadata(
+            url, json.loads(front), sets_extractors, xml=xml, xml_error=xml_error
+        )
+
+    async def _doc_xml_async(self, url):
+        """Obtém o XML do documento. Retorna o par `(xml, erro)`, de maneira
+        que falhas recuperáveis não impeçam a gravação dos demais metadados.
+        """
+        try:
+            xml = await fetch_data(
+                self._aiohttp, self._absolute_url(url), throttle=self.throttle
+            )
+        except exceptions.RetryableError as exc:
+            return None, exc
+        return xml, None
@@ -1,15 +1,23 @@
 import os
 import re
+import sys
 import time
+import random
+import threading
+import asyncio
 import json
+import zlib
 import logging
 import functools
+import itertools
 from datetime import datetime
 from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+from lxml import etree
 
-from .. import interfaces, exceptions
+from .. import interfaces, exceptions, metrics, jats
 
 
 LOGGER = logging.getLogger(__name__)
@@ -18,84 +26,94 @@ MAX_RETRIES = int(os.environ.get("OAIPMH_MAX_RETRIES", "4"))
 BACKOFF_FACTOR = float(os.environ.get("OAIPMH_BACKOFF_FACTOR", "1.2"))
 HTTP_REQ_TIMEOUT = float(os.environ.get("OAIPMH_HTTP_REQ_TIMEOUT", 5))
 
+RETRIES = metrics.Counter(
+    "oaipmh_sync_retries_total",
+    "Retries of calls decorated with retry_gracefully.",
+    ["function"],
+)
 
-class EnqueuedState:
-    task = "get"
 
-    def on_event(self, event):
-        if event == "deleted":
-            return DeletedState()
+# Códigos dos estados de cada entidade na redução compacta do *changelog*. O
+# estado final de uma entidade depende apenas de seu último evento, i.e., se é
+# uma remoção ou não, portanto basta armazenar o código deste estado.
+TASK_GET = 0
+TASK_DELETE = 1
+TASK_NAMES = ("get", "delete")
 
-        return self
+DOCUMENT_ID_REGEX = re.compile(r"^/documents/[\w-]+$")
 
 
-class DeletedState:
-    task = "delete"
-
-    def on_event(self, event):
-        if event == "modified":
-            return EnqueuedState()
-
-        return self
-
-
-class ChangelogStateMachine:
-    def __init__(self):
-        self.state = EnqueuedState()
-
-    def on_event(self, event):
-        self.state = self.state.on_event(event)
-
-    def task(self):
-        return self.state.task
-
+class CompactTasks(interfaces.Tasks):
+    """Implementação de `interfaces.Tasks` a partir do mapeamento entre o
+    identificador de cada documento e o código de seu estado. Os dicionários
+    que representam as tarefas são produzidos apenas durante a iteração.
+    """
 
-class Tasks(interfaces.Tasks):
-    def __init__(self, tasks, timestamp):
-        self.tasks = tasks
+    def __init__(self, states, timestamp):
+        self.states = states
         self.timestamp = timestamp
 
-    def _is_document_change_task(self, task):
-        """Retorna `True` caso `task` seja referente a um documento.
-        """
-        return bool(re.match(r"^/documents/[\w-]+$", task.get("id", "")))
+    @property
+    def tasks(self):
+        return list(self.docs())
 
     def docs(self):
-        return (t for t in self.tasks if self._is_document_change_task(t))
+        # apenas documentos são admitidos no mapeamento.
+        return (
+            {"id": id, "task": TASK_NAMES[state]} for id, state in self.states.items()
+        )
 
     def docs_to_get(self):
-        return (t for t in self.docs() if t.get("task") == "get")
+        return ({"id": id, "task": "get"} for id in self._ids(TASK_GET))
 
     def docs_to_del(self):
-        return (t for t in self.docs() if t.get("task") == "delete")
+        return ({"id": id, "task": "delete"} for id in self._ids(TASK_DELETE))
+
+    def _ids(self, state):
+        return (id for id, s in self.states.items() if s == state)
 
 
 class TasksReader(interfaces.TasksReader):
     def read(self, changelog):
-        entities, timestamp = self._process_events(changelog)
-        tasks = [{"id": id, "task": state.task()} for id, state in entities.items()]
-        return Tasks(tasks=tasks, timestamp=timestamp)
+        states, timestamp = self._process_events(changelog)
+        return CompactTasks(states=states, timestamp=timestamp)
+
+    def read_chunks(self, changelog, chunk_size=10000):
+        changelog = iter(changelog)
+        while True:
+            chunk = list(itertools.islice(changelog, chunk_size))
+            if not chunk:
+                return
+            yield self.read(chunk)
 
     def _process_events(self, changelog):
-        Machine = ChangelogStateMachine
-        entities = {}
+        """Reduz `changelog` ao mapeamento entre o identificador de cada
+        documento e o código de seu último estado. Entradas que não se referem
+        a documentos são descartadas e os identificadores são internalizados,
+        de maneira que cada um seja armazenado uma única vez.
+        """
+        is_document = DOCUMENT_ID_REGEX.match
+        states = {}
         last_timestamp = None
         for entry in changelog:
             last_timestamp = entry["timestamp"]
-            id = entities.setdefault(entry["id"], Machine())
-            if entry.get("deleted", False):
-                event = "deleted"
-            else:
-                event = "modified"
-            id.on_event(event)
+            id = entry["id"]
+            if not is_document(id):
+                continue
+            states[sys.intern(id)] = (
+                TASK_DELETE if entry.get("deleted", False) else TASK_GET
+            )
 
-        return entities, last_timestamp
+        return states, last_timestamp
 
 
 class retry_gracefully:
     """Produz decorador que torna o objeto decorado resiliente às exceções dos
     tipos informados em `exc_list`. Tenta no máximo `max_retries` vezes com
     intervalo exponencial entre as tentativas.
+
+    Funções de corrotina são decoradas de maneira que a espera entre as
+    tentativas não bloqueie o *event loop*.
     """
 
     def __init__(
@@ -111,7 +129,31 @@ class retry_gracefully:
     def _sleep(self, seconds):
         time.sleep(seconds)
 
+    async def _async_sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    def _wait_seconds(self, func, args, kwargs, retry, exc):
+        # o intervalo é variado aleatoriamente para que as tentativas
+        # simultâneas de diferentes *threads* não ocorram em sincronia.
+        wait_seconds = self.backoff_factor ** retry * random.uniform(0.5, 1.5)
+        RETRIES.inc(function=func.__qualname__)
+        LOGGER.info(
+            'could not get the result for "%s" with *args "%s" '
+            'and **kwargs "%s". retrying in %s seconds '
+            "(retry #%s): %s",
+            func.__qualname__,
+            args,
+            kwargs,
+            str(wait_seconds),
+            retry,
+            exc,
+        )
+        return wait_seconds
+
     def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            return self._decorate_coroutine_function(func)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             retry = 1
@@ -120,19 +162,25 @@ class retry_gracefully:
                     return func(*args, **kwargs)
                 except self.exc_list as exc:
                     if retry <= self.max_retries:
-                        wait_seconds = self.backoff_factor ** retry
-                        LOGGER.info(
-                            'could not get the result for "%s" with *args "%s" '
-                            'and **kwargs "%s". retrying in %s seconds '
-                            "(retry #%s): %s",
-                            func.__qualname__,
-                            args,
-                            kwargs,
-                            str(wait_seconds),
-                            retry,
-                            exc,
+                        self._sleep(self._wait_seconds(func, args, kwargs, retry, exc))
+                        retry += 1
+                    else:
+                        raise
+
+        return wrapper
+
+    def _decorate_coroutine_function(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            retry = 1
+            while True:
+                try:
+                    return await func(*args, **kwargs)
+                except self.exc_list as exc:
+                    if retry <= self.max_retries:
+                        await self._async_sleep(
+                            self._wait_seconds(func, args, kwargs, retry, exc)
                         )
-                        self._sleep(wait_seconds)
                         retry += 1
                     else:
                         raise
@@ -140,10 +188,166 @@ class retry_gracefully:
         return wrapper
 
 
+class AdaptiveThrottle:
+    """Limita a taxa de requisições ao Kernel, compartilhada por todas as
+    *threads* ou corrotinas de uma sincronização.
+
+    A taxa, em requisições por segundo, é controlada por meio de um *token
+    bucket* e ajustada pelo algoritmo AIMD: aumenta em `increase` a cada
+    resposta obtida em até `latency_threshold` segundos e é multiplicada por
+    `decrease`, no máximo uma vez por segundo, a cada falha recuperável ou
+    resposta lenta.
+
+    Após `failure_threshold` falhas consecutivas o circuito é aberto e nenhuma
+    requisição é realizada por `reset_timeout` segundos. Então as requisições
+    são retomadas à taxa mínima.
+    """
+
+    def __init__(
+        self,
+        rate=50.0,
+        min_rate=1.0,
+        max_rate=1000.0,
+        increase=1.0,
+        decrease=0.5,
+        latency_threshold=2.0,
+        failure_threshold=10,
+        reset_timeout=30.0,
+        clock=time.monotonic,
+    ):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.rate = min(float(rate), self.max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_threshold = latency_threshold
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._tokens = 1.0
+        self._refilled_at = clock()
+        self._decreased_at = None
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Aguarda até que uma requisição possa ser realizada.
+        """
+        while True:
+            wait_seconds = self._reserve()
+            if wait_seconds <= 0:
+                return
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self):
+        """Equivalente assíncrono de `acquire`.
+        """
+        while True:
+            wait_seconds = self._reserve()
+            if wait_seconds <= 0:
+                return
+            await asyncio.sleep(wait_seconds)
+
+    def _reserve(self):
+        """Consome um *token*, caso exista. Do contrário, retorna o número de
+        segundos até que um esteja disponível.
+        """
+        with self._lock:
+            now = self._clock()
+            if self._opened_at is not None:
+                remaining = self._opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    return remaining
+                LOGGER.info("resuming requests at %.1f req/s", self.min_rate)
+                self._opened_at = None
+                self._failures = 0
+                self.rate = self.min_rate
+
+            self._tokens = min(
+                max(self.rate, 1.0),
+                self._tokens + (now - self._refilled_at) * self.rate,
+            )
+            self._refilled_at = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0
+            return (1.0 - self._tokens) / self.rate
+
+    def on_success(self, latency):
+        with self._lock:
+            self._failures = 0
+            if latency > self.latency_threshold:
+                self._decrease()
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._decrease()
+            if self._failures >= self.failure_threshold and self._opened_at is None:
+                LOGGER.warning(
+                    "%d consecutive failures. pausing requests for %s seconds",
+                    self._failures,
+                    self.reset_timeout,
+                )
+                self._opened_at = self._clock()
+
+    def _decrease(self):
+        now = self._clock()
+        if self._decreased_at is None or now - self._decreased_at >= 1.0:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._decreased_at = now
+
+
+def http_session(pool_size=10):
+    """Produz uma instância de `requests.Session` cujas conexões são mantidas
+    abertas e reutilizadas entre as requisições.
+
+    :param pool_size: (opcional) número máximo de conexões mantidas por *host*.
+    Deve ser igual ao número de *threads* que compartilham a sessão.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+
 @retry_gracefully()
-def fetch_data(url: str, timeout: float = HTTP_REQ_TIMEOUT) -> bytes:
+def fetch_data(
+    url: str, timeout: float = HTTP_REQ_TIMEOUT, session=requests, throttle=None
+) -> bytes:
+    """Obtém o conteúdo de `url`.
+
+    :param session: (opcional) objeto com a interface de `requests.Session`.
+    Por padrão uma nova conexão é estabelecida a cada requisição.
+
+    :param throttle: (opcional) instância de `AdaptiveThrottle` que regula
+    cada tentativa.
+    """
+    if throttle is None:
+        return _fetch_data(url, timeout, session)
+
+    throttle.acquire()
+    started = time.monotonic()
     try:
-        response = requests.get(url, timeout=timeout)
+        content = _fetch_data(url, timeout, session)
+    except exceptions.RetryableError:
+        throttle.on_failure()
+        raise
+    except exceptions.NonRetryableError:
+        throttle.on_success(time.monotonic() - started)
+        raise
+    throttle.on_success(time.monotonic() - started)
+    return content
+
+
+def _fetch_data(url, timeout, session):
+    try:
+        response = session.get(url, timeout=timeout)
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
         raise exceptions.RetryableError(exc) from exc
     except (
@@ -186,6 +390,53 @@ def extract_acronym(front):
 SETS_EXTRACTORS = [extract_acronym]
 
 
+def compress_xml(content, namespace=jats.NAMESPACE):
+    """Prepara o XML de um documento para que seja armazenado e inserido sem
+    modificações nas respostas OAI-PMH: a declaração XML e o DOCTYPE são
+    removidos, as entidades são expandidas, os elementos sem *namespace* são
+    movidos para `namespace` e o elemento raiz é serializado e comprimido com
+    zlib.
+
+    Lança `ValueError` caso o documento dependa de entidades externas, que não
+    são obtidas.
+    """
+    root = etree.fromstring(
+        content, etree.XMLParser(resolve_entities=False, no_network=True)
+    )
+    if next(root.iter(etree.Entity), None) is not None:
+        root = _resolve_internal_entities(content, root)
+
+    nsmap = dict(root.nsmap)
+    nsmap[None] = namespace
+    new_root = etree.Element(
+        "{%s}%s" % (namespace, root.tag), attrib=dict(root.attrib), nsmap=nsmap
+    )
+    new_root.text = root.text
+    for element in root.iter(etree.Element):
+        if not element.tag.startswith("{"):
+            element.tag = "{%s}%s" % (namespace, element.tag)
+    new_root.extend(root)
+    etree.cleanup_namespaces(new_root)
+    return zlib.compress(
+        etree.tostring(new_root, encoding="utf-8", xml_declaration=False)
+    )
+
+
+def _resolve_internal_entities(content, root):
+    """Interpreta novamente o documento, expandindo as entidades declaradas
+    no próprio DOCTYPE. Entidades externas, inclusive as de parâmetro, não são
+    expandidas, pois permitiriam a leitura de arquivos locais.
+    """
+    dtd = root.getroottree().docinfo.internalDTD
+    entities = list(dtd.entities()) if dtd is not None else []
+    if any(entity.content is None for entity in entities):
+        raise ValueError("external entities are not supported")
+
+    # entidades não declaradas, p. ex., as definidas no DTD externo, produzem
+    # `XMLSyntaxError`.
+    return etree.fromstring(content, etree.XMLParser(no_network=True))
+
+
 def _parse_date(date):
     for fmt in ["%d %m %Y", "%d%m%Y", "%m %Y", "%Y"]:
         try:
@@ -197,8 +448,23 @@ def _parse_date(date):
 
 
 class DataConnector(interfaces.DataConnector):
-    def __init__(self, host):
+    """Conexão com uma instância do Kernel.
+
+    :param pool_size: (opcional) número de conexões HTTP mantidas abertas com o
+    Kernel. Deve corresponder à concorrência da sincronização.
+
+    :param throttle: (opcional) instância de `AdaptiveThrottle` que regula as
+    requisições ao Kernel.
+
+    :param fetch_xml: (opcional) se o XML dos documentos deve ser obtido, o que
+    é necessário apenas para servir o formato `jats`.
+    """
+
+    def __init__(self, host, pool_size=10, throttle=None, fetch_xml=False):
         self.host = host
+        self.throttle = throttle
+        self.fetch_xml = fetch_xml
+        self._http = http_session(pool_size)
 
     def changes(self, since=""):
         """Obtém os registros de mudança ocorridos desde `since`.
@@ -219,7 +485,13 @@ class DataConnector(interfaces.DataConnector):
                 since = last_yielded["timestamp"]
 
     def _fetch_changes(self, since):
-        return json.loads(fetch_data(urljoin(self.host, f"changes?since={since}")))
+        return json.loads(
+            fetch_data(
+                urljoin(self.host, f"changes?since={since}"),
+                session=self._http,
+                throttle=self.throttle,
+            )
+        )
 
     def _absolute_url(self, url):
         return urljoin(self.host, url) if not url.startswith(self.host) else url
@@ -230,15 +502,53 @@ class DataConnector(interfaces.DataConnector):
         :param url: URL relativa para o documento, por exemplo 
         `/documents/rgTRVDFHk5GyfDgwNjKbQCJ`.
         """
-        return json.loads(fetch_data(self._absolute_url(f"{url}/front")))
+        return json.loads(
+            fetch_data(
+                self._absolute_url(f"{url}/front"),
+                session=self._http,
+                throttle=self.throttle,
+            )
+        )
+
+    def _doc_xml(self, url):
+        """Obtém o XML do documento identificado por `url`.
+        """
+        return fetch_data(
+            self._absolute_url(url), session=self._http, throttle=self.throttle
+        )
 
     def doc_metadata(self, url, sets_extractors=SETS_EXTRACTORS):
-        """Obtém metadados do documento identificado por `url`. 
+        """Obtém metadados do documento identificado por `url` e, com
+        `fetch_xml`, seu XML, comprimido por `compress_xml`.
 
         :param url: URL relativa para o documento, por exemplo
         `/documents/rgTRVDFHk5GyfDgwNjKbQCJ`.
         """
         front = self._doc_front(url)
+        xml, xml_error = None, None
+        if self.fetch_xml:
+            try:
+                xml = self._doc_xml(url)
+            except exceptions.RetryableError as exc:
+                xml_error = exc
+        return self._front_to_metadata(
+            url, front, sets_extractors, xml=xml, xml_error=xml_error
+        )
+
+    def _front_to_metadata(
+        self, url, front, sets_extractors=SETS_EXTRACTORS, xml=None, xml_error=None
+    ):
+        """Produz os metadados do documento identificado por `url` a partir de
+        seu *front-matter* e, caso informado, de seu XML. O XML é comprimido
+        aqui, de maneira que os documentos aguardando gravação ocupem pouca
+        memória. Documentos cujo XML não pode ser interpretado são gravados sem
+        ele.
+
+        Caso a obtenção do XML tenha falhado de forma recuperável, `xml_error`,
+        o documento é gravado sem ele e a falha é informada no campo
+        `xml_error`, que não é armazenado, de maneira que o documento seja
+        novamente obtido na próxima sincronização.
+        """
         sets = [extractor(front) for extractor in sets_extractors]
         doc_id = url.rsplit("/", 1)[-1]
         pub_date = _parse_date(_nestget(front, "pub_date", 0, "text", 0))
@@ -279,7 +589,7 @@ class DataConnector(interfaces.DataConnector):
             for kwd in kwd_group.get("kwd", []):
                 keywords.append({"lang": lang, "kwd": kwd})
 
-        return {
+        doc = {
             "xml_url": self._absolute_url(url),
             "doc_id": doc_id,
             "sets": sets,
@@ -298,3 +608,12 @@ class DataConnector(interfaces.DataConnector):
             ),
             # TODO: add permissions
         }
+        if xml:
+            try:
+                doc["xml"] = compress_xml(xml)
+            except (etree.XMLSyntaxError, ValueError) as exc:
+                LOGGER.warning('could not parse the XML of "%s": %s', url, exc)
+        elif xml_error is not None:
+            LOGGER.warning('could not fetch the XML of "%s": %s', url, xml_error)
+            doc["xml_error"] = str(xml_error)
+        return doc
@@ -1,6 +1,11 @@
+import json
+import zlib
 import logging
+import hashlib
+from datetime import datetime, timedelta
 
 import pymongo
+from pymongo.write_concern import WriteConcern
 from oaipmh import common
 
 from .. import exceptions
@@ -18,55 +23,167 @@ class MongoDB:
     :param options: (opcional) dicionário com opções que serão passadas diretamente
     na instanciação de `pymongo.MongoClient`. Veja as opções em:
     https://api.mongodb.com/python/current/api/pymongo/mongo_client.html
+
+    :param documents_collection: (opcional) nome da coleção que armazena os
+    documentos, p. ex., uma coleção provisória durante a reconstrução da base.
     """
 
-    def __init__(self, uri, dbname, mongoclient=pymongo.MongoClient, options=None):
+    def __init__(
+        self,
+        uri,
+        dbname,
+        mongoclient=pymongo.MongoClient,
+        options=None,
+        documents_collection="documents",
+    ):
+        self._documents_collection = documents_collection
         self._dbname = dbname
         self._uri = uri
         self._MongoClient = mongoclient
         self._client_instance = None
-        self._options = options or {}
+        self._collections = {}
+        self._options = {k: v for k, v in (options or {}).items() if v}
 
     @property
     def _client(self):
         """Posterga a instanciação de `pymongo.MongoClient` até o seu primeiro
         uso.
         """
-        options = {k: v for k, v in self._options.items() if v}
-
-        if not self._client_instance:
-            self._client_instance = self._MongoClient(self._uri, **options)
+        if self._client_instance is None:
+            self._client_instance = self._MongoClient(self._uri, **self._options)
             LOGGER.debug(
                 "new MongoDB client created: <%r at %s>",
                 self._client_instance,
                 id(self._client_instance),
             )
 
-        LOGGER.debug(
-            "using MongoDB client: <%r at %s>",
-            self._client_instance,
-            id(self._client_instance),
-        )
         return self._client_instance
 
     def _db(self):
         return self._client[self._dbname]
 
     def _collection(self, colname):
-        return self._db()[colname]
+        try:
+            return self._collections[colname]
+        except KeyError:
+            collection = self._collections[colname] = self._db()[colname]
+            return collection
 
     @property
     def documents(self):
-        return self._collection("documents")
+        return self._collection(self._documents_collection)
 
     @property
     def variables(self):
         return self._collection("variables")
 
+    @property
+    def sets(self):
+        return self._collection("sets")
+
+    @property
+    def retries(self):
+        return self._collection("retries")
+
     def create_indexes(self):
-        self.documents.create_index(
-            [("timestamp", pymongo.ASCENDING)], unique=False, background=True
-        )
+        for keys, options in DOCUMENTS_INDEXES:
+            self.documents.create_index(keys, background=True, **options)
+
+    def replace_documents(self, colname):
+        """Substitui atomicamente a coleção de documentos pela coleção
+        `colname`, que deixa de existir.
+        """
+        self._collection(colname).rename(self._documents_collection, dropTarget=True)
+
+
+# Ordenação estável dos registros. O `doc_id` desempata registros com o mesmo
+# `timestamp`, o que permite a paginação por meio do par `(timestamp, doc_id)`
+# do último registro visto.
+DOCUMENTS_SORT = [("timestamp", pymongo.ASCENDING), ("doc_id", pymongo.ASCENDING)]
+
+# Plano de índices da coleção `documents`, composto por pares `(chaves,
+# opções)`. Cada consulta produzida por `DocumentStore` deve ser atendida por
+# um destes índices (veja `DocumentStore.query_shapes`):
+#
+# - `doc_id`: GetRecord e as escritas da sincronização;
+# - `(sets.set_spec, timestamp, doc_id)`: listas restritas a um *set*;
+# - `(timestamp, doc_id)`: listas sem *set* e `earliest_datestamp`.
+DOCUMENTS_INDEXES = [
+    ([("doc_id", pymongo.ASCENDING)], {"unique": True}),
+    ([("sets.set_spec", pymongo.ASCENDING)] + DOCUMENTS_SORT, {}),
+    (DOCUMENTS_SORT, {}),
+]
+
+
+def winning_plan_stages(explain):
+    """Obtém os estágios do plano de execução escolhido, a partir do
+    resultado de `pymongo.cursor.Cursor.explain`.
+    """
+    stages = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "stage" in node:
+                stages.append(node["stage"])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(explain.get("queryPlanner", {}).get("winningPlan", {}))
+    return stages
+
+
+def date_range(from_=None, until=None):
+    """Produz a faixa de `timestamp` equivalente aos argumentos `from` e
+    `until` do protocolo OAI-PMH, cuja granularidade é de segundos.
+
+    Os argumentos são `datetime` e ambos são inclusivos na granularidade de
+    segundos: `until` abrange todo o segundo informado, ainda que os
+    `timestamp` gravados tenham precisão de milissegundos. Por isso a faixa
+    produzida é `$gte from` e `$lt until + 1s`, i.e., o limite superior é
+    exclusivo e corresponde ao segundo seguinte a `until`.
+    """
+    timestamp_range = {}
+    if from_:
+        timestamp_range["$gte"] = from_.replace(microsecond=0)
+    if until:
+        timestamp_range["$lt"] = until.replace(microsecond=0) + timedelta(seconds=1)
+    return timestamp_range
+
+
+# Campos necessários à produção do cabeçalho dos registros (veja
+# `OAIRecord.header`). Não há índice que cubra esta projeção, já que `sets` é
+# um *array*, mas os metadados descritivos deixam de ser transferidos.
+HEADER_PROJECTION = {
+    "_id": False,
+    "doc_id": True,
+    "timestamp": True,
+    "sets.set_spec": True,
+    "deleted": True,
+}
+
+# Campos necessários aos formatos produzidos a partir dos metadados
+# descritivos. O XML do documento, armazenado comprimido no campo `xml`, é
+# obtido apenas pelos formatos que o servem (veja `OAIRecord.xml`).
+DESCRIPTIVE_PROJECTION = {"xml": False}
+XML_PROJECTION = dict(HEADER_PROJECTION, xml=True)
+
+
+# Campos que não fazem parte do conteúdo dos documentos, desconsiderados por
+# `content_hash`.
+NON_CONTENT_FIELDS = {"_id", "timestamp", "rendered", "deleted", "content_hash"}
+
+
+def content_hash(doc):
+    """Produz o resumo criptográfico do conteúdo de `doc`, independente da
+    ordem de suas chaves e dos campos em `NON_CONTENT_FIELDS`.
+    """
+    content = {k: v for k, v in doc.items() if k not in NON_CONTENT_FIELDS}
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
 
 
 class Session:
@@ -80,14 +197,40 @@ class Session:
         """
         self._mongodb_client = mongodb_client
         self._context = context or {}
+        self._stores = {}
+
+    def _store(self, name, factory):
+        """Obtém o *store* `name`, produzido por `factory` no primeiro acesso.
+        Os *stores* não possuem estado próprio e podem ser compartilhados.
+        """
+        try:
+            return self._stores[name]
+        except KeyError:
+            store = self._stores[name] = factory()
+            return store
 
     @property
     def documents(self):
-        return DocumentStore(self._mongodb_client.documents, context=self._context)
+        return self._store(
+            "documents",
+            lambda: DocumentStore(
+                self._mongodb_client.documents, context=self._context
+            ),
+        )
 
     @property
     def variables(self):
-        return VariableStore(self._mongodb_client.variables)
+        return self._store(
+            "variables", lambda: VariableStore(self._mongodb_client.variables)
+        )
+
+    @property
+    def sets(self):
+        return self._store("sets", lambda: SetStore(self._mongodb_client.sets))
+
+    @property
+    def retries(self):
+        return self._store("retries", lambda: RetryStore(self._mongodb_client.retries))
 
 
 def _parse_date(date):
@@ -118,7 +261,159 @@ class DocumentStore:
             ) from None
 
     def upsert(self, doc: dict):
-        self._collection.update({"doc_id": doc["doc_id"]}, doc, upsert=True)
+        self._collection.replace_one({"doc_id": doc["doc_id"]}, doc, upsert=True)
+
+    def upsert_many(self, docs: list, keep_xml=()):
+        """Grava `docs` por meio de uma única operação em lote. Os documentos
+        cujo conteúdo não mudou são mantidos como estão, inclusive seu
+        `timestamp`, de maneira que não sejam coletados novamente.
+
+        Os documentos cujos `doc_id` constam em `keep_xml` mantêm o XML
+        gravado, p. ex., quando o XML não pôde ser obtido da fonte.
+
+        Retorna o par `(falhas, inalterados)`, em que `falhas` é a lista de pares
+        `(doc, mensagem de erro)` dos documentos que não puderam ser gravados e
+        `inalterados` é o número de documentos mantidos como estão. Os demais
+        documentos do lote são gravados independentemente das falhas.
+        """
+        if keep_xml:
+            self._restore_xml(docs, keep_xml)
+        changed = self._changed(docs)
+        unchanged = len(docs) - len(changed)
+        if not changed:
+            return [], unchanged
+
+        try:
+            self._collection.bulk_write(
+                [
+                    pymongo.ReplaceOne({"doc_id": doc["doc_id"]}, doc, upsert=True)
+                    for doc in changed
+                ],
+                ordered=False,
+            )
+        except pymongo.errors.BulkWriteError as exc:
+            failures = [
+                (changed[error["index"]], error.get("errmsg", ""))
+                for error in exc.details.get("writeErrors", [])
+            ]
+            return failures, unchanged
+        else:
+            return [], unchanged
+
+    def _restore_xml(self, docs, doc_ids):
+        """Atribui aos documentos de `docs` identificados por `doc_ids` o XML
+        gravado, caso exista.
+        """
+        stored = {
+            r["doc_id"]: r["xml"]
+            for r in self._collection.find(
+                {"doc_id": {"$in": list(doc_ids)}, "xml": {"$exists": True}},
+                {"_id": False, "doc_id": True, "xml": True},
+            )
+        }
+        for doc in docs:
+            if doc["doc_id"] in stored:
+                doc["xml"] = stored[doc["doc_id"]]
+
+    def _changed(self, docs):
+        """Atribui `content_hash` a cada documento de `docs` e retorna apenas
+        os que diferem da versão gravada ou que estão marcados como removidos.
+        """
+        for doc in docs:
+            doc["content_hash"] = content_hash(doc)
+
+        stored = {
+            r["doc_id"]: r.get("content_hash")
+            for r in self._collection.find(
+                {
+                    "doc_id": {"$in": [doc["doc_id"] for doc in docs]},
+                    "deleted": {"$ne": True},
+                },
+                {"_id": False, "doc_id": True, "content_hash": True},
+            )
+        }
+        changed = [
+            doc for doc in docs if stored.get(doc["doc_id"]) != doc["content_hash"]
+        ]
+        if len(changed) < len(docs):
+            LOGGER.debug("skipping %d unchanged documents", len(docs) - len(changed))
+        return changed
+
+    def mark_deleted_many(self, doc_ids: list, timestamp=None):
+        """Marca os documentos identificados por `doc_ids` como removidos por
+        meio de uma única operação em lote. Os registros são mantidos, com seus
+        *sets*, e têm seu `timestamp` atualizado, de maneira que a remoção seja
+        percebida na coleta incremental.
+
+        Retorna a lista de pares `(doc_id, mensagem de erro)` dos documentos que
+        não puderam ser marcados.
+        """
+        if not doc_ids:
+            return []
+
+        timestamp = timestamp or datetime.utcnow()
+        try:
+            self._collection.bulk_write(
+                [
+                    pymongo.UpdateOne(
+                        {"doc_id": doc_id, "deleted": {"$ne": True}},
+                        {
+                            "$set": {"deleted": True, "timestamp": timestamp},
+                            "$unset": {"xml": ""},
+                        },
+                    )
+                    for doc_id in doc_ids
+                ],
+                ordered=False,
+            )
+        except pymongo.errors.BulkWriteError as exc:
+            return [
+                (doc_ids[error["index"]], error.get("errmsg", ""))
+                for error in exc.details.get("writeErrors", [])
+            ]
+        else:
+            return []
+
+    def tombstones(self, doc_ids, timestamp=None):
+        """Produz os registros de remoção dos documentos, dentre os
+        identificados por `doc_ids`, que existem na coleção. Os já marcados como
+        removidos são mantidos como estão; os demais são marcados como
+        removidos em `timestamp`, como em `mark_deleted_many`.
+        """
+        timestamp = timestamp or datetime.utcnow()
+        for doc in self._collection.find(
+            {"doc_id": {"$in": list(doc_ids)}}, {"_id": False, "rendered": False}
+        ):
+            if not doc.get("deleted"):
+                doc.pop("xml", None)
+                doc.update(deleted=True, timestamp=timestamp)
+            yield doc
+
+    def carry_over_timestamps(self, previous, batch_size=1000):
+        """Atribui aos documentos cujo conteúdo não mudou em relação à versão
+        gravada em `previous`, outra instância de `DocumentStore`, o
+        `timestamp` desta versão, de maneira que não sejam coletados novamente.
+        """
+        requests = []
+        for doc in previous._collection.find(
+            {"deleted": {"$ne": True}, "content_hash": {"$exists": True}},
+            {"_id": False, "doc_id": True, "content_hash": True, "timestamp": True},
+        ):
+            requests.append(
+                pymongo.UpdateOne(
+                    {
+                        "doc_id": doc["doc_id"],
+                        "content_hash": doc["content_hash"],
+                        "deleted": {"$ne": True},
+                    },
+                    {"$set": {"timestamp": doc["timestamp"]}},
+                )
+            )
+            if len(requests) == batch_size:
+                self._collection.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            self._collection.bulk_write(requests, ordered=False)
 
     def sets(self):
         pipeline = [
@@ -132,43 +427,214 @@ class DocumentStore:
             key=lambda x: x["set_spec"],
         )
 
-    def filter(self, set=None, from_=None, until=None, offset=0, limit=10):
-        query_params = {}
-        if set:
-            query_params["sets.set_spec"] = set
-        if from_:
-            query_params["timestamp"] = {"$gte": from_}
-        if until:
-            query_params["timestamp"] = {"$lte": until}
+    def filter(
+        self,
+        set=None,
+        from_=None,
+        until=None,
+        offset=0,
+        limit=10,
+        after=None,
+        include_deleted=True,
+        projection=None,
+        require_xml=False,
+    ):
+        """Obtém os registros ordenados por `(timestamp, doc_id)`.
+
+        :param after: (opcional) par `(timestamp, doc_id)` do último registro
+        obtido na página anterior. Quando informado, a consulta continua a
+        partir deste ponto por meio de uma faixa no índice composto
+        `(timestamp, doc_id)` e `offset` é ignorado. Desta forma o custo de
+        cada página independe de sua profundidade.
+
+        :param include_deleted: (opcional) se os registros marcados como
+        removidos devem ser obtidos.
+
+        :param projection: (opcional) campos dos documentos que devem ser
+        obtidos, p. ex., `HEADER_PROJECTION`. Por padrão todos são obtidos.
+
+        :param require_xml: (opcional) se os registros sem XML armazenado devem
+        ser omitidos. Os marcados como removidos, que não possuem XML, são
+        mantidos.
+        """
+        if after:
+            offset = 0
 
         return (
-            OAIRecord(r, context=self._context)
-            for r in self._collection.find(query_params, skip=offset, limit=limit).sort(
-                "timestamp", pymongo.ASCENDING
-            )
+            OAIRecord(r, context=self._context, store=self)
+            for r in self._collection.find(
+                self._filter_query(
+                    set, from_, until, after, include_deleted, require_xml
+                ),
+                projection,
+                skip=offset,
+                limit=limit,
+            ).sort(DOCUMENTS_SORT)
         )
 
-    def fetch(self, doc_id):
-        raw_record = self._collection.find_one({"doc_id": doc_id})
+    def _filter_query(
+        self, set, from_, until, after, include_deleted, require_xml=False
+    ):
+        query_params = {}
+        if not include_deleted:
+            query_params["deleted"] = {"$ne": True}
+        if require_xml:
+            # os registros removidos não possuem XML e continuam sendo
+            # listados. Como a de `deleted`, esta condição não restringe a
+            # faixa do índice e é verificada em cada documento examinado.
+            query_params["$nor"] = [
+                {"deleted": {"$ne": True}, "xml": {"$exists": False}}
+            ]
+        if set:
+            query_params["sets.set_spec"] = set
+        timestamp_range = date_range(from_, until)
+        if after:
+            # o registro `after` pertence ao intervalo, portanto o limite
+            # inferior é substituído pela chave de busca. O limite superior é
+            # repetido no ramo do `$or`, de maneira que ambos os ramos sejam
+            # faixas limitadas no índice.
+            last_timestamp, last_doc_id = after
+            timestamp_range.pop("$gte", None)
+            query_params["$or"] = [
+                {"timestamp": dict(timestamp_range, **{"$gt": last_timestamp})},
+                {"timestamp": last_timestamp, "doc_id": {"$gt": last_doc_id}},
+            ]
+        elif timestamp_range:
+            query_params["timestamp"] = timestamp_range
+        return query_params
+
+    def fetch(self, doc_id, include_deleted=True, projection=None):
+        query_params = {"doc_id": doc_id}
+        if not include_deleted:
+            query_params["deleted"] = {"$ne": True}
+        raw_record = self._collection.find_one(query_params, projection)
         if raw_record:
-            return OAIRecord(raw_record, context=self._context)
+            return OAIRecord(raw_record, context=self._context, store=self)
         else:
             return None
 
+    def store_rendered(self, doc_id, timestamp, metadata_prefix, rendered):
+        """Armazena a renderização de um registro no formato `metadata_prefix`.
+
+        A escrita não aguarda a confirmação do servidor e é descartada caso o
+        documento tenha sido modificado, i.e., seu `timestamp` mudou, desde a
+        leitura. Como a sincronização substitui os documentos por inteiro, as
+        renderizações armazenadas são invalidadas a cada modificação.
+        """
+        self._collection.with_options(write_concern=WriteConcern(w=0)).update_one(
+            {"doc_id": doc_id, "timestamp": timestamp},
+            {"$set": {"rendered." + metadata_prefix: rendered}},
+        )
+
+    def query_shapes(self):
+        """Produz os pares `(descrição, cursor)` com um exemplar de cada
+        formato de consulta realizado por esta classe, de maneira que seus
+        planos de execução possam ser verificados por meio de `explain()`.
+        """
+        timestamp, doc_id, set = datetime.utcnow(), "doc_id", "set_spec"
+        filters = [
+            ("filter", None, None, None, None),
+            ("filter by set", set, None, None, None),
+            ("filter by date", None, timestamp, None, None),
+            ("filter by set and date", set, timestamp, None, None),
+            ("filter by date range", None, timestamp, timestamp, None),
+            ("filter by set and date range", set, timestamp, timestamp, None),
+            ("filter after key", None, None, None, (timestamp, doc_id)),
+            ("filter by set after key", set, None, None, (timestamp, doc_id)),
+        ]
+        for description, set, from_, until, after in filters:
+            query = self._filter_query(set, from_, until, after, False)
+            yield description, self._collection.find(query).sort(DOCUMENTS_SORT)
+
+        query = self._filter_query(None, None, None, None, True, require_xml=True)
+        yield "filter with xml", self._collection.find(query).sort(DOCUMENTS_SORT)
+
+        yield "fetch, upsert and delete", self._collection.find({"doc_id": doc_id})
+        yield "store rendered", self._collection.find(
+            {"doc_id": doc_id, "timestamp": timestamp}
+        )
+        yield "earliest datestamp", self._collection.find(
+            {}, sort=[("timestamp", pymongo.ASCENDING)], limit=1
+        )
+
     def earliest_datestamp(self):
-        cursor = self._collection.find(
+        raw_record = self._collection.find_one(
             {},
             sort=[("timestamp", pymongo.ASCENDING)],
             projection={"timestamp": True, "_id": False},
-        ).limit(1)
-
-        if cursor.count() < 1:
+        )
+        if raw_record is None:
             return None
-
-        raw_record = next(cursor)
         return raw_record.get("timestamp")
 
 
+class SetStore:
+    """Catálogo dos *sets* dos documentos, mantido incrementalmente durante a
+    sincronização. Cada *set* é armazenado com `set_spec` como `_id`, de
+    maneira que a listagem paginada é uma leitura no índice da chave primária.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def upsert(self, set_spec, set_name):
+        self._collection.replace_one(
+            {"_id": set_spec}, {"_id": set_spec, "set_name": set_name}, upsert=True
+        )
+
+    def filter(self, offset=0, limit=10, after=None):
+        """Obtém os *sets* ordenados por `set_spec`.
+
+        :param after: (opcional) `set_spec` do último *set* obtido na página
+        anterior. Quando informado, `offset` é ignorado.
+        """
+        query_params = {}
+        if after:
+            query_params["_id"] = {"$gt": after}
+            offset = 0
+
+        return (
+            {"set_spec": r["_id"], "set_name": r["set_name"]}
+            for r in self._collection.find(query_params, skip=offset, limit=limit).sort(
+                "_id", pymongo.ASCENDING
+            )
+        )
+
+
+class RetryStore:
+    """Fila dos documentos cuja sincronização falhou, para que sejam obtidos
+    novamente na próxima execução. Cada documento é armazenado com seu
+    identificador como `_id`.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def add(self, id, error):
+        self._collection.update_one(
+            {"_id": id},
+            {
+                "$set": {"error": error, "failed_at": datetime.utcnow()},
+                "$inc": {"attempts": 1},
+            },
+            upsert=True,
+        )
+
+    def ids(self):
+        return (r["_id"] for r in self._collection.find({}, {"_id": True}))
+
+    def count(self):
+        return self._collection.count_documents({})
+
+    def remove_many(self, ids, failed_before):
+        """Remove da fila os documentos identificados por `ids` que não
+        voltaram a falhar desde `failed_before`.
+        """
+        self._collection.delete_many(
+            {"_id": {"$in": list(ids)}, "failed_at": {"$lt": failed_before}}
+        )
+
+
 class VariableStore:
     """Armazena variáveis da aplicação.
     """
@@ -185,6 +651,17 @@ class VariableStore:
         raw_record = self._collection.find_one({"_id": name}) or {}
         return raw_record.get("value", default)
 
+    def increment(self, name):
+        """Incrementa atomicamente o contador `name` e retorna o novo valor.
+        """
+        raw_record = self._collection.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        return raw_record["value"]
+
 
 # Mapeamento definido pela equipe do OpenAIRE
 ARTICLETYPE_TO_VOCABULARY_MAP = {
@@ -211,9 +688,15 @@ def fetch_pubtype_from_vocabulary(typ):
 
 
 class OAIRecord:
-    def __init__(self, data, context):
+    """
+    :param store: (opcional) instância de `DocumentStore` na qual as
+    renderizações do registro são armazenadas.
+    """
+
+    def __init__(self, data, context, store=None):
         self.data = data
         self._context = context
+        self._store = store
 
     def header(self):
         return common.Header(
@@ -221,15 +704,54 @@ class OAIRecord:
             identifier=self._identifier(),
             datestamp=self.data["timestamp"],
             setspec=self._sets_specs(),
-            deleted=False,  # TODO: armazenar o campo `deleted`?
+            deleted=self.deleted,
         )
 
+    @property
+    def deleted(self):
+        return self.data.get("deleted", False)
+
     def _identifier(self):
         return "oai:scielo.org:" + self.data["doc_id"]
 
     def _sets_specs(self):
         return [s["set_spec"] for s in self.data.get("sets", []) if s.get("set_spec")]
 
+    def rendered(self, metadata_prefix):
+        """Obtém a renderização armazenada do registro no formato
+        `metadata_prefix`, ou `None`. Renderizações produzidas por versões
+        diferentes da indicada em `context["rendered_version"]` são ignoradas.
+        """
+        rendered = self.data.get("rendered", {}).get(metadata_prefix, {})
+        if rendered.get("version") == self._context.get("rendered_version"):
+            return rendered.get("xml")
+        return None
+
+    def store_rendered(self, metadata_prefix, xml):
+        if self._store is None:
+            return
+        self._store.store_rendered(
+            self.data["doc_id"],
+            self.data["timestamp"],
+            metadata_prefix,
+            {"version": self._context.get("rendered_version"), "xml": xml},
+        )
+
+    def xml(self):
+        """Obtém o XML do documento, armazenado comprimido pela sincronização,
+        ou `None`.
+        """
+        xml = self.compressed_xml()
+        if xml is None:
+            return None
+        return zlib.decompress(xml)
+
+    def compressed_xml(self):
+        """Obtém o XML do documento comprimido com zlib, como armazenado, ou
+        `None`.
+        """
+        return self.data.get("xml")
+
     def metadata(self):
         return common.Metadata(
             None,
@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+import collections
+
+
+LOGGER = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Cache em memória com no máximo `maxsize` itens, descartados por ordem
+    de uso. Os itens expiram após `ttl` segundos.
+
+    Todos os itens são descartados quando a geração dos dados muda. A geração
+    é obtida por meio de `generation`, consultada no máximo uma vez a cada
+    `poll_interval` segundos, de maneira que a invalidação seja barata e
+    compartilhada por todos os processos que consultam a mesma fonte.
+
+    :param generation: (opcional) função sem argumentos que retorna a geração
+    corrente dos dados, p. ex., o contador `sync_generation` de
+    `VariableStore`.
+    """
+
+    def __init__(
+        self,
+        maxsize=1000,
+        ttl=300.0,
+        generation=None,
+        poll_interval=5.0,
+        clock=time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+        self._generation = generation
+        self._current_generation = None
+        self._polled_at = None
+        self._clock = clock
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = self._clock()
+        self._poll_generation(now)
+        with self._lock:
+            expires_at, value = self._items.get(key, (None, _MISSING))
+            if value is _MISSING or expires_at <= now:
+                self._items.pop(key, None)
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        self._poll_generation(self._clock())
+        with self._lock:
+            self._items[key] = (self._clock() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        """Métricas de uso do cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+        }
+
+    def _poll_generation(self, now):
+        if self._generation is None:
+            return
+        if self._polled_at is not None and now - self._polled_at < self.poll_interval:
+            return
+
+        self._polled_at = now
+        try:
+            generation = self._generation()
+        except Exception as exc:
+            LOGGER.warning("could not get the cache generation: %s", exc)
+            return
+
+        if generation != self._current_generation:
+            if self._current_generation is not None:
+                LOGGER.debug("generation changed to %s. clearing cache", generation)
+            self._current_generation = generation
+            self.clear()
+
+
+class PeriodicRefresh:
+    """Executa `func` em segundo plano, no máximo uma vez a cada `interval`
+    segundos, sempre que o objeto é chamado. Apenas a primeira chamada aguarda
+    a execução de `func`, por no máximo `timeout` segundos, de maneira que o
+    valor atualizado possa ser usado já na primeira resposta.
+
+    Nenhuma *thread* é mantida entre as execuções, de maneira que o objeto pode
+    ser criado antes que o processo seja bifurcado pelo servidor de aplicação.
+    """
+
+    def __init__(self, func, interval=60.0, timeout=0.0, clock=time.monotonic):
+        self.func = func
+        self.interval = interval
+        self.timeout = timeout
+        self._clock = clock
+        self._last_run = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        now = self._clock()
+        with self._lock:
+            if self._running or (
+                self._last_run is not None and now - self._last_run < self.interval
+            ):
+                return
+            first_run = self._last_run is None
+            self._running = True
+            self._last_run = now
+
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        if first_run and self.timeout > 0:
+            thread.join(self.timeout)
+
+    def _run(self):
+        try:
+            self.func()
+        except Exception as exc:
+            LOGGER.warning('could not refresh "%s": %s', self.func.__qualname__, exc)
+        finally:
+            self._running = False
@@ -0,0 +1,47 @@
+import zlib
+
+
+# Codificações de conteúdo suportadas, em ordem de preferência, e os
+# respectivos valores de `wbits` de `zlib.compressobj`. A codificação
+# `deflate` do HTTP corresponde ao formato zlib (RFC 1950), e não ao fluxo
+# deflate puro.
+ENCODINGS = [
+    ("gzip", 16 + zlib.MAX_WBITS),
+    ("deflate", zlib.MAX_WBITS),
+]
+
+
+def supported_encodings(level):
+    """Codificações que devem ser anunciadas pelo verbo `Identify`. Nenhuma é
+    anunciada quando a compressão está desabilitada, i.e., `level` é 0.
+    """
+    if level <= 0:
+        return []
+    return [name for name, _ in ENCODINGS]
+
+
+def negotiate(request, level):
+    """Escolhe a codificação da resposta a partir do cabeçalho
+    `Accept-Encoding` da requisição. Retorna `None` quando a resposta não deve
+    ser comprimida.
+    """
+    if "Accept-Encoding" not in request.headers:
+        return None
+
+    offers = request.accept_encoding.acceptable_offers(supported_encodings(level))
+    if offers:
+        return offers[0][0]
+    return None
+
+
+def compress(chunks, encoding, level):
+    """Comprime os *bytes* produzidos por `chunks` de forma incremental, de
+    maneira que respostas produzidas sob demanda continuem sendo transmitidas
+    sem que sejam mantidas por inteiro em memória.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, dict(ENCODINGS)[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
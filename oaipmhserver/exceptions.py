@@ -14,3 +14,9 @@ class NonRetryableError(Exception):
 class AlreadyExists(NonRetryableError):
     """O objeto ou registro já existe e não pode ser criado novamente.
     """
+
+
+class IncompleteRebuildError(Exception):
+    """A reconstrução da base de dados não obteve todos os documentos e a
+    coleção provisória não pode substituir a coleção de documentos.
+    """
@@ -35,6 +35,16 @@ class TasksReader:
         mudança da fonte de dados remota.
         """
 
+    def read_chunks(
+        self, changelog: Iterable[Dict], chunk_size: int
+    ) -> Iterable[Tasks]:
+        """Produz sequências de tarefas a partir de janelas consecutivas de até
+        `chunk_size` registros de `changelog`, à medida que são lidas.
+
+        A redução dos eventos ocorre apenas dentro de cada janela, portanto as
+        tarefas devem ser desempenhadas na ordem em que são produzidas.
+        """
+
 
 class DataConnector:
     """Representa a conexão com o banco de dados remoto a ser replicado.
@@ -0,0 +1,31 @@
+"""*Namespace* e *schema* do formato de metadados `jats`, que corresponde ao XML
+SciELO PS de cada documento.
+
+Os metadados inseridos nas respostas OAI-PMH devem pertencer a um *namespace*
+próprio, mas os elementos do JATS não possuem *namespace* e o seu *schema* não
+declara `targetNamespace`. Por isso os elementos do XML armazenado são movidos
+para `NAMESPACE` (veja `oaipmhserver.adapters.kernel.compress_xml`) e o formato
+anuncia como *schema* o `SCHEMA`, servido pela própria aplicação, que inclui o
+*schema* do JATS por meio de `xs:include`. O *schema* incluído, por não declarar
+`targetNamespace`, assume o *namespace* do que o inclui, de maneira que os
+registros são válidos segundo o *schema* anunciado.
+"""
+
+NAMESPACE = "http://jats.nlm.nih.gov"
+
+# *Schema* do JATS Journal Publishing, versão adotada pelo SciELO PS.
+JATS_SCHEMA_LOCATION = (
+    "https://jats.nlm.nih.gov/publishing/1.1/xsd/JATS-journalpublishing1.xsd"
+)
+
+# Caminho em que `SCHEMA` é servido, relativo à URL base do repositório.
+SCHEMA_PATH = "schemas/jats.xsd"
+
+SCHEMA = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           xmlns="{namespace}"
+           targetNamespace="{namespace}">
+  <xs:include schemaLocation="{location}"/>
+</xs:schema>
+""".format(namespace=NAMESPACE, location=JATS_SCHEMA_LOCATION)
@@ -0,0 +1,261 @@
+"""Métricas da aplicação e da sincronização no formato de exposição textual do
+Prometheus (https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+As métricas são mantidas em memória, por processo, e registradas em `REGISTRY`
+no momento em que são declaradas, normalmente no módulo que as atualiza.
+"""
+import os
+import math
+import time
+import tempfile
+import threading
+import contextlib
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Limites, em segundos, das faixas dos histogramas de duração.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Conjunto de métricas exportadas em conjunto.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Registra `metric`, substituindo a métrica de mesmo nome, caso
+        exista.
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, metric):
+        with self._lock:
+            self._metrics.pop(metric.name, None)
+
+    def render(self):
+        """Produz a representação textual de todas as métricas.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return "".join(metric.render() for metric in metrics)
+
+    def snapshot(self):
+        """Obtém os valores de todos os contadores, de maneira que possam ser
+        somados aos de outro processo por meio de `merge`.
+        """
+        with self._lock:
+            counters = [m for m in self._metrics.values() if isinstance(m, Counter)]
+        return {counter.name: counter.values() for counter in counters}
+
+    def merge(self, snapshot):
+        for name, values in snapshot.items():
+            counter = self._metrics.get(name)
+            if counter is None:
+                continue
+            for key, value in values.items():
+                counter.inc(value, **dict(zip(counter.labelnames, key)))
+
+
+REGISTRY = Registry()
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n")
+
+
+def _escape_label(value):
+    return _escape(value).replace('"', r"\"")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape_label(v)) for k, v in labels)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                'metric "%s" expects the labels %s, got %s'
+                % (self.name, self.labelnames, sorted(labels))
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [
+            "# HELP %s %s\n" % (self.name, _escape(self.documentation)),
+            "# TYPE %s %s\n" % (self.name, self.type),
+        ]
+        for name, labels, value in self._samples():
+            lines.append(
+                "%s%s %s\n" % (name, _format_labels(labels), _format_value(value))
+            )
+        return "".join(lines)
+
+    def _samples(self):
+        for key, value in sorted(self.values().items()):
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        registry=REGISTRY,
+        buckets=DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def values(self):
+        with self._lock:
+            return {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+
+    def _samples(self):
+        for key, (counts, total) in sorted(self.values().items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    self.name + "_bucket",
+                    labels + [("le", _format_value(bound))],
+                    cumulative,
+                )
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+
+class Callback(_Metric):
+    """Métrica cujo valor é obtido por meio de `func` no momento da
+    exportação, p. ex., a partir de `cache.LRUCache.stats`.
+
+    A métrica é declarada uma única vez e `func` pode ser substituída por meio
+    de `bind`, p. ex., a cada instanciação do objeto observado. Enquanto
+    `func` for `None` a métrica não possui amostras.
+    """
+
+    def __init__(self, name, documentation, func=None, type="gauge", registry=REGISTRY):
+        self.type = type
+        self._func = func
+        super().__init__(name, documentation, (), registry)
+
+    def bind(self, func):
+        self._func = func
+
+    def values(self):
+        func = self._func
+        if func is None:
+            return {}
+        return {(): func()}
+
+
+def write_textfile(path, registry=REGISTRY):
+    """Grava as métricas de `registry` em `path` de maneira atômica, p. ex.,
+    para que sejam coletadas pelo *textfile collector* do `node_exporter`.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(registry.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def push(url, job, registry=REGISTRY, session=None):
+    """Envia as métricas de `registry` a um *Pushgateway* do Prometheus,
+    substituindo as enviadas anteriormente por `job`.
+    """
+    if session is None:
+        import requests as session
+
+    response = session.put(
+        "%s/metrics/job/%s" % (url.rstrip("/"), job),
+        data=registry.render().encode("utf-8"),
+        headers={"Content-Type": CONTENT_TYPE},
+        timeout=10,
+    )
+    response.raise_for_status()
+
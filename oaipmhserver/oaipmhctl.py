@@ -1,9 +1,19 @@
+import os
 import sys
+import time
+import zlib
+import queue
+import threading
 import argparse
+import functools
 import logging
+import asyncio
+import itertools
+import multiprocessing
 import concurrent.futures
+from datetime import datetime
 
-from oaipmhserver import interfaces
+from oaipmhserver import interfaces, exceptions, metrics
 
 
 LOGGER = logging.getLogger(__name__)
@@ -16,6 +26,33 @@ code for more information.
 
 LOGGER_FMT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 
+DOCUMENTS = metrics.Counter(
+    "oaipmh_sync_documents_total",
+    "Documents processed by the sync, by result: fetched, failed (could not be "
+    "fetched), retried, upserted, unchanged, not_stored and deleted.",
+    ["result"],
+)
+PENDING_DOCUMENTS = metrics.Gauge(
+    "oaipmh_sync_pending_documents",
+    "Documents whose fetch was requested and is not yet complete.",
+)
+WINDOW_TASKS = metrics.Gauge(
+    "oaipmh_sync_window_remaining_tasks",
+    "Tasks of the current changelog window, fetches and deletions, not yet started.",
+)
+RETRY_QUEUE = metrics.Gauge(
+    "oaipmh_sync_retry_queue_documents",
+    "Documents queued in the retries collection to be fetched again.",
+)
+CHECKPOINT_TIME = metrics.Gauge(
+    "oaipmh_sync_checkpoint_time_seconds",
+    "Unix time at which the last changelog window was completely synced.",
+)
+REQUEST_RATE = metrics.Callback(
+    "oaipmh_sync_request_rate",
+    "Current rate, in requests per second, allowed by the adaptive throttle.",
+)
+
 
 class PoisonPill:
     """Sinaliza para as threads que a execução da rotina deve ser abortada. 
@@ -25,6 +62,83 @@ class PoisonPill:
         self.poisoned = False
 
 
+def prefetch(iterable, size=1):
+    """Consome `iterable` em uma *thread* à parte, mantendo até `size` itens
+    prontos à frente do consumidor. Exceções são propagadas ao consumidor.
+    """
+    items = queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except Exception as exc:
+            items.put((done, exc))
+        else:
+            items.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item, exc = items.get()
+        if item is done:
+            if exc:
+                raise exc
+            return
+        yield item
+
+
+def counting_down(iterable, gauge):
+    """Produz os itens de `iterable`, decrementando `gauge` à medida que são
+    consumidos.
+    """
+    for item in iterable:
+        gauge.dec()
+        yield item
+
+
+class WriteBuffer:
+    """Acumula documentos para que sejam gravados em lote por `write`. O lote
+    é descarregado quando atinge `batch_size` documentos ou quando
+    `flush_interval` segundos se passaram desde a última descarga. Neste caso,
+    quem aguarda por novos documentos deve limitar a espera a `timeout()` e
+    chamar `flush_if_due` em seguida.
+    """
+
+    def __init__(self, write, batch_size, flush_interval, clock=time.monotonic):
+        self._write = write
+        self._docs = []
+        self._clock = clock
+        self._last_flush = clock()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def add(self, doc):
+        self._docs.append(doc)
+        if len(self._docs) >= self.batch_size:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def timeout(self):
+        """Segundos que restam até que o lote deva ser descarregado, ou `None`
+        caso não haja documentos pendentes.
+        """
+        if not self._docs:
+            return None
+        return max(0, self.flush_interval - (self._clock() - self._last_flush))
+
+    def flush_if_due(self):
+        if self.timeout() == 0:
+            self.flush()
+
+    def flush(self):
+        docs, self._docs = self._docs, []
+        self._last_flush = self._clock()
+        if docs:
+            self._write(docs)
+
+
 class Synchronizer:
     def __init__(
         self,
@@ -32,11 +146,23 @@ class Synchronizer:
         dest,  # interfaces.Session
         reader: interfaces.TasksReader,
         max_concurrency: int = 4,
+        batch_size: int = 500,
+        flush_interval: float = 5.0,
+        max_pending: int = None,
+        chunk_size: int = 10000,
     ):
         self.source = source
         self.dest = dest
         self.reader = reader
         self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # mantém as *threads* ocupadas enquanto os resultados são consumidos.
+        self.max_pending = max_pending or max_concurrency * 2
+        self.chunk_size = chunk_size
+        self._known_sets = {}
+        # identificadores das tarefas cujos documentos não foram gravados.
+        self.failed_ids = set()
 
     def _record_metadata(self, task, poison_pill=None):
         if poison_pill and poison_pill.poisoned:
@@ -45,74 +171,514 @@ class Synchronizer:
         return self.source.doc_metadata(task["id"])
 
     def get_docs(self, tasks):
+        """Obtém e grava os documentos referenciados por `tasks`.
+
+        No máximo `max_pending` tarefas são submetidas ao *pool* de *threads*
+        sem que seus resultados tenham sido consumidos, de maneira que o uso de
+        memória independe do número de tarefas.
+        """
         ppill = PoisonPill()
-        session = self.dest
+        buffer = WriteBuffer(self._write_docs, self.batch_size, self.flush_interval)
+        tasks = iter(tasks)
         with concurrent.futures.ThreadPoolExecutor(
             max_workers=self.max_concurrency
         ) as executor:
             try:
-                future_to_task = {
-                    executor.submit(self._record_metadata, task, ppill): task
-                    for task in tasks
-                }
-                for future in concurrent.futures.as_completed(future_to_task):
-                    task = future_to_task[future]
-                    try:
-                        result = future.result()
-                    except Exception as exc:
-                        LOGGER.exception('could not sync "%r": %s', task, exc)
-                    else:
-                        session.documents.upsert(result)
+                future_to_task = {}
+                while True:
+                    for task in itertools.islice(
+                        tasks, self.max_pending - len(future_to_task)
+                    ):
+                        future = executor.submit(self._record_metadata, task, ppill)
+                        future_to_task[future] = task
+
+                    PENDING_DOCUMENTS.set(len(future_to_task))
+                    if not future_to_task:
+                        break
+
+                    done, _ = concurrent.futures.wait(
+                        future_to_task,
+                        timeout=buffer.timeout(),
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                    for future in done:
+                        task = future_to_task.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as exc:
+                            self._failed(task, exc)
+                        else:
+                            DOCUMENTS.inc(result="fetched")
+                            buffer.add(result)
+                    buffer.flush_if_due()
 
             except KeyboardInterrupt:
                 ppill.poisoned = True
+                buffer.flush()
                 raise
 
-    def sync(self, since=""):
+        buffer.flush()
+
+    def _failed(self, task, exc):
+        """Registra a falha na obtenção do documento referenciado por `task`.
+        Falhas recuperáveis são enfileiradas para que o documento seja obtido
+        novamente na próxima execução.
+        """
+        LOGGER.exception('could not sync "%r": %s', task, exc)
+        DOCUMENTS.inc(result="failed")
+        self.failed_ids.add(task["id"])
+        if isinstance(exc, exceptions.RetryableError):
+            self.dest.retries.add(task["id"], str(exc))
+
+    def retry_failed(self):
+        """Obtém novamente os documentos cuja sincronização falhou em
+        execuções anteriores. Os que voltarem a falhar permanecem na fila.
+        """
+        started_at = datetime.utcnow()
+        ids = list(self.dest.retries.ids())
+        RETRY_QUEUE.set(len(ids))
+        if not ids:
+            return
+
+        LOGGER.info("retrying %d documents that failed to sync", len(ids))
+        DOCUMENTS.inc(len(ids), result="retried")
+        self.get_docs({"id": id, "task": "get"} for id in ids)
+        self.dest.retries.remove_many(ids, failed_before=started_at)
+        RETRY_QUEUE.set(self.dest.retries.count())
+        self.invalidate_caches()
+
+    def invalidate_caches(self):
+        """Invalida os caches dos processos que servem os registros, o que deve
+        ocorrer após cada gravação, independentemente do ponto de retomada.
+        """
+        self.dest.variables.increment("sync_generation")
+
+    def _write_docs(self, docs):
+        # documentos cujo XML não pôde ser obtido mantêm o XML gravado, caso
+        # exista, e são obtidos novamente na próxima execução.
+        keep_xml = []
+        for doc in docs:
+            xml_error = doc.pop("xml_error", None)
+            if xml_error is not None:
+                keep_xml.append(doc["doc_id"])
+                self.dest.retries.add("/documents/%s" % doc["doc_id"], xml_error)
+
+        # documentos que não puderam ser gravados são obtidos novamente na
+        # próxima execução.
+        failures, unchanged = self.dest.documents.upsert_many(docs, keep_xml=keep_xml)
+        for doc, error in failures:
+            LOGGER.error('could not store "%s": %s', doc.get("doc_id"), error)
+            task_id = "/documents/%s" % doc.get("doc_id")
+            self.failed_ids.add(task_id)
+            self.dest.retries.add(task_id, error)
+
+        failed_ids = {doc.get("doc_id") for doc, _ in failures}
+        DOCUMENTS.inc(len(docs) - unchanged - len(failures), result="upserted")
+        DOCUMENTS.inc(unchanged, result="unchanged")
+        DOCUMENTS.inc(len(failures), result="not_stored")
+        for doc in docs:
+            if doc.get("doc_id") not in failed_ids:
+                self._update_sets(doc)
+
+    def del_docs(self, tasks):
+        """Marca como removidos, em lotes de `batch_size`, os documentos
+        referenciados por `tasks`.
+
+        Retorna o número de documentos que não puderam ser marcados.
+        """
+        tasks = iter(tasks)
+        failed = 0
+        while True:
+            doc_ids = [
+                task["id"].rsplit("/", 1)[-1]
+                for task in itertools.islice(tasks, self.batch_size)
+            ]
+            if not doc_ids:
+                return failed
+
+            failures = self.dest.documents.mark_deleted_many(doc_ids)
+            for doc_id, error in failures:
+                LOGGER.error('could not delete "%s": %s', doc_id, error)
+            DOCUMENTS.inc(len(doc_ids) - len(failures), result="deleted")
+            failed += len(failures)
+
+    def _update_sets(self, doc):
+        """Mantém o catálogo de *sets* atualizado. Apenas *sets* desconhecidos
+        ou cujo nome mudou durante a execução são gravados.
+        """
+        for set in doc.get("sets", []):
+            set_spec, set_name = set.get("set_spec"), set.get("set_name", "")
+            if not set_spec or self._known_sets.get(set_spec) == set_name:
+                continue
+            self.dest.sets.upsert(set_spec, set_name)
+            self._known_sets[set_spec] = set_name
+
+    def sync(self, since="", checkpoint=None):
         """Baixa e armazena localmente todos os registros mais novos do que
         `since`.
         
         Retorna a o timestamp do último registro baixado.
+
+        O *changelog* é reduzido em janelas de `chunk_size` registros. As
+        tarefas de cada janela são desempenhadas enquanto a próxima é obtida da
+        fonte remota. As remoções de cada janela são aplicadas após a gravação
+        de seus documentos, após as quais os caches da aplicação são
+        invalidados.
+
+        :param checkpoint: (opcional) função chamada com o *timestamp* do
+        último registro de cada janela assim que todas as suas tarefas são
+        concluídas, de maneira que uma sincronização interrompida possa ser
+        retomada a partir deste ponto. Os documentos que não puderam ser obtidos
+        ou gravados são enfileirados em `retries`, mas as remoções que falharem
+        não podem ser enfileiradas; a partir da primeira janela em que isto
+        ocorrer a função deixa de ser chamada, de maneira que estas remoções
+        sejam aplicadas novamente na próxima execução.
         """
         LOGGER.info(
             'starting to sync records from remote since "%s"',
             since or "the very beginning",
         )
-        tasks = self.reader.read(self.source.changes(since=since))
-        self.get_docs(tasks.docs_to_get())
-        return tasks.timestamp
-
+        self.retry_failed()
+        timestamp = None
+        held_at = None
+        chunks = self.reader.read_chunks(
+            self.source.changes(since=since), self.chunk_size
+        )
+        for tasks in prefetch(chunks):
+            WINDOW_TASKS.set(
+                sum(1 for _ in tasks.docs_to_get())
+                + sum(1 for _ in tasks.docs_to_del())
+            )
+            self.get_docs(counting_down(tasks.docs_to_get(), WINDOW_TASKS))
+            failed_deletions = self.del_docs(
+                counting_down(tasks.docs_to_del(), WINDOW_TASKS)
+            )
+            if failed_deletions and held_at is None:
+                held_at = timestamp or since
+                LOGGER.error(
+                    'documents could not be deleted. checkpoint held at "%s"',
+                    held_at,
+                )
+            self.invalidate_caches()
+            RETRY_QUEUE.set(self.dest.retries.count())
+            timestamp = tasks.timestamp
+            if held_at is None:
+                CHECKPOINT_TIME.set(time.time())
+                if checkpoint is not None:
+                    checkpoint(timestamp)
+            LOGGER.info("synced changes up to %s", timestamp)
+        return timestamp
+
+
+class AsyncSynchronizer(Synchronizer):
+    """Variante de `Synchronizer` baseada em asyncio, capaz de manter centenas
+    de requisições simultâneas ao Kernel com uma única *thread*. A gravação dos
+    lotes no banco de dados é delegada a uma *thread* dedicada, de maneira que
+    não bloqueie o *event loop*.
+
+    Além da interface de `interfaces.DataConnector`, `source` deve oferecer a
+    corrotina `doc_metadata_async` e ser um gerenciador de contexto assíncrono,
+    como `adapters.aiokernel.DataConnector`.
+    """
 
-def sync(args):
-    from oaipmhserver.adapters import kernel, mongodb
+    def get_docs(self, tasks):
+        asyncio.run(self._get_docs(tasks))
+
+    async def _record_metadata_async(self, task, semaphore):
+        async with semaphore:
+            return await self.source.doc_metadata_async(task["id"])
+
+    async def _get_docs(self, tasks):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        writes = []
+        tasks = iter(tasks)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as writer:
+            buffer = WriteBuffer(
+                lambda docs: writes.append(
+                    loop.run_in_executor(writer, self._write_docs, docs)
+                ),
+                self.batch_size,
+                self.flush_interval,
+            )
+            async with self.source:
+                future_to_task = {}
+                try:
+                    while True:
+                        for task in itertools.islice(
+                            tasks, self.max_pending - len(future_to_task)
+                        ):
+                            future = asyncio.ensure_future(
+                                self._record_metadata_async(task, semaphore)
+                            )
+                            future_to_task[future] = task
+
+                        PENDING_DOCUMENTS.set(len(future_to_task))
+                        if not future_to_task:
+                            break
+
+                        done, _ = await asyncio.wait(
+                            future_to_task,
+                            timeout=buffer.timeout(),
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                        for future in done:
+                            task = future_to_task.pop(future)
+                            try:
+                                result = future.result()
+                            except Exception as exc:
+                                self._failed(task, exc)
+                            else:
+                                DOCUMENTS.inc(result="fetched")
+                                buffer.add(result)
+                        buffer.flush_if_due()
+
+                        # no máximo um lote aguarda enquanto outro é gravado.
+                        while len(writes) > 1:
+                            await writes.pop(0)
+                finally:
+                    # os documentos já obtidos são gravados mesmo que a
+                    # execução seja cancelada, como em `Synchronizer`.
+                    for future in future_to_task:
+                        future.cancel()
+                    buffer.flush()
+                    await asyncio.gather(*writes)
+
+
+ENGINES = {"thread": Synchronizer, "async": AsyncSynchronizer}
+
+
+def _mongodb(args, **kwargs):
+    from oaipmhserver.adapters import mongodb
 
-    mongo = mongodb.MongoDB(
+    return mongodb.MongoDB(
         [dsn.strip() for dsn in args.mongodb_dsn.split() if dsn],
         args.dbname,
         options={"replicaSet": args.replicaset},
+        **kwargs
     )
-    session = mongodb.Session(mongo)
 
-    sync = Synchronizer(
-        source=kernel.DataConnector(args.source),
-        dest=session,
+
+def _synchronizer(args, dest, max_rate=None):
+    """Produz o sincronizador configurado por `args`. A taxa máxima de
+    requisições ao Kernel é `args.max_rate`, salvo quando `max_rate` é
+    informado.
+    """
+    from oaipmhserver.adapters import kernel
+
+    if max_rate is None:
+        max_rate = args.max_rate
+    throttle = kernel.AdaptiveThrottle(max_rate=max_rate)
+    # o XML dos documentos é necessário apenas para servir o formato `jats`.
+    fetch_xml = "jats" in args.formats.split()
+    REQUEST_RATE.bind(lambda: throttle.rate)
+    if args.engine == "async":
+        from oaipmhserver.adapters import aiokernel
+
+        source = aiokernel.DataConnector(
+            args.source,
+            pool_size=args.concurrency,
+            throttle=throttle,
+            fetch_xml=fetch_xml,
+        )
+    else:
+        source = kernel.DataConnector(
+            args.source,
+            pool_size=args.concurrency,
+            throttle=throttle,
+            fetch_xml=fetch_xml,
+        )
+
+    return ENGINES[args.engine](
+        source=source,
+        dest=dest,
         reader=kernel.TasksReader(),
         max_concurrency=args.concurrency,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
     )
-    if args.since:
-        since = args.since
+
+
+def _checkpoint(session, last_synced_timestamp, args=None):
+    session.variables.upsert("last_synced_timestamp", last_synced_timestamp)
+    if args is not None:
+        export_metrics(args)
+
+
+def export_metrics(args):
+    """Grava as métricas da sincronização no arquivo informado por
+    `--metrics-file` e as envia ao *Pushgateway* informado por
+    `--metrics-pushgateway`. Falhas são registradas sem interromper a
+    sincronização.
+    """
+    if args.metrics_file:
+        try:
+            metrics.write_textfile(args.metrics_file)
+        except OSError as exc:
+            LOGGER.warning(
+                'could not write metrics to "%s": %s', args.metrics_file, exc
+            )
+    if args.metrics_pushgateway:
+        try:
+            metrics.push(args.metrics_pushgateway, "oaipmhctl_sync")
+        except Exception as exc:
+            LOGGER.warning(
+                'could not push metrics to "%s": %s', args.metrics_pushgateway, exc
+            )
+
+
+def sync(args):
+    from oaipmhserver.adapters import mongodb
+
+    mongo = _mongodb(args)
+    session = mongodb.Session(mongo)
+
+    if args.rebuild:
+        last_synced_timestamp = rebuild(args, mongo)
+        if last_synced_timestamp:
+            # invalida os caches dos processos que servem os registros.
+            session.variables.increment("sync_generation")
+            _checkpoint(session, last_synced_timestamp, args)
     else:
-        LOGGER.info(
-            'param "since" was not given. looking up for it in the local database'
+        if args.since:
+            since = args.since
+        else:
+            LOGGER.info(
+                'param "since" was not given. looking up for it in the local database'
+            )
+            since = session.variables.fetch("last_synced_timestamp")
+
+        last_synced_timestamp = _synchronizer(args, session).sync(
+            since=since, checkpoint=functools.partial(_checkpoint, session, args=args)
         )
-        since = session.variables.fetch("last_synced_timestamp")
 
-    last_synced_timestamp = sync.sync(since=since)
     if last_synced_timestamp:
-        session.variables.upsert("last_synced_timestamp", last_synced_timestamp)
+        session.variables.upsert(
+            "earliest_datestamp", session.documents.earliest_datestamp()
+        )
         LOGGER.info("timestamp of the last synced record: %s", last_synced_timestamp)
     else:
         LOGGER.info("the databases are already synced")
+    export_metrics(args)
+
+
+# Coleção na qual os documentos são gravados durante a reconstrução da base.
+REBUILD_COLLECTION = "documents_rebuild"
+
+# Número de vezes que cada processo da reconstrução tenta novamente obter os
+# documentos que falharam.
+REBUILD_RETRIES = 3
+
+
+def partition(doc_id, partitions):
+    """Obtém a partição de `doc_id`, estável entre processos e execuções.
+    """
+    return zlib.crc32(doc_id.encode("utf-8")) % partitions
+
+
+def rebuild(args, mongo):
+    """Reconstrói a coleção de documentos a partir de todo o *changelog*.
+
+    Os documentos são divididos em `args.workers` partições, sincronizadas
+    cada uma por um processo com suas próprias conexões com o Kernel e com o
+    MongoDB, e gravados em uma coleção provisória. Ao final, a coleção
+    provisória substitui atomicamente a coleção de documentos, de maneira que
+    uma base parcialmente construída nunca é servida. Se algum documento não
+    puder ser gravado, a substituição é abortada e a coleção provisória é
+    mantida.
+
+    Os documentos cujo conteúdo não mudou mantêm o `timestamp` da coleção
+    atual e os removidos no *changelog* que nela existem são mantidos como
+    registros de remoção, de maneira que a coleta incremental não seja afetada.
+
+    Retorna o *timestamp* do último registro do *changelog*.
+    """
+    from oaipmhserver.adapters import kernel, mongodb
+
+    staging_mongo = _mongodb(args, documents_collection=REBUILD_COLLECTION)
+    staging_mongo.documents.drop()
+    staging_mongo.create_indexes()
+
+    LOGGER.info("reading the whole changelog")
+    tasks = kernel.TasksReader().read(kernel.DataConnector(args.source).changes())
+    if tasks.timestamp is None:
+        return None
+
+    partitions = [[] for _ in range(args.workers)]
+    for task in tasks.docs_to_get():
+        partitions[partition(task["id"], args.workers)].append(task["id"])
+
+    LOGGER.info(
+        "rebuilding %d documents with %d workers",
+        sum(len(p) for p in partitions),
+        args.workers,
+    )
+    # os processos são iniciados do zero, sem herdar as conexões e *threads*
+    # deste processo.
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        failures = 0
+        for count, failed, snapshot in executor.map(
+            _rebuild_partition, itertools.repeat(args), partitions
+        ):
+            # cada processo mantém suas próprias métricas.
+            metrics.REGISTRY.merge(snapshot)
+            failures += failed
+            LOGGER.info(
+                "partition of %d documents rebuilt with %d failures", count, failed
+            )
+
+    documents = mongodb.Session(mongo).documents
+    staging = mongodb.Session(staging_mongo).documents
+    staging.carry_over_timestamps(documents, batch_size=args.batch_size)
+
+    # os documentos removidos são mantidos como registros de remoção, de
+    # maneira que continuem sendo informados aos coletores.
+    doc_ids = (task["id"].rsplit("/", 1)[-1] for task in tasks.docs_to_del())
+    while True:
+        batch = list(itertools.islice(doc_ids, args.batch_size))
+        if not batch:
+            break
+        failed, _ = staging.upsert_many(list(documents.tombstones(batch)))
+        for doc, error in failed:
+            LOGGER.error('could not store "%s": %s', doc.get("doc_id"), error)
+            failures += 1
+
+    if failures:
+        raise exceptions.IncompleteRebuildError(
+            "%d documents could not be rebuilt. the documents collection was "
+            'kept and the partial rebuild is available at "%s"'
+            % (failures, REBUILD_COLLECTION)
+        )
+
+    mongo.replace_documents(REBUILD_COLLECTION)
+    LOGGER.info("the documents collection was replaced")
+    return tasks.timestamp
+
+
+def _rebuild_partition(args, doc_ids):
+    """Sincroniza, em um processo dedicado, os documentos de uma partição.
+    Os documentos que falharam são obtidos novamente até `REBUILD_RETRIES`
+    vezes. A taxa máxima de requisições ao Kernel é dividida entre os
+    processos, de maneira que, somadas, não excedam `args.max_rate`.
+
+    Retorna o número de documentos, o número dos que não puderam ser gravados
+    e os contadores das métricas do processo.
+    """
+    from oaipmhserver.adapters import mongodb
+
+    staging = mongodb.Session(_mongodb(args, documents_collection=REBUILD_COLLECTION))
+    synchronizer = _synchronizer(args, staging, max_rate=args.max_rate / args.workers)
+    synchronizer.get_docs({"id": id, "task": "get"} for id in doc_ids)
+    for _ in range(REBUILD_RETRIES):
+        if not synchronizer.failed_ids:
+            break
+        ids, synchronizer.failed_ids = sorted(synchronizer.failed_ids), set()
+        LOGGER.info("retrying %d documents that failed to rebuild", len(ids))
+        synchronizer.get_docs({"id": id, "task": "get"} for id in ids)
+    return len(doc_ids), len(synchronizer.failed_ids), metrics.REGISTRY.snapshot()
 
 
 def create_indexes(args):
@@ -121,9 +687,38 @@ def create_indexes(args):
     mongo = mongodb.MongoDB(
         [dsn.strip() for dsn in args.mongodb_dsn.split() if dsn], args.dbname
     )
+    if args.check:
+        return check_indexes(mongo)
     mongo.create_indexes()
 
 
+def check_indexes(mongo):
+    from oaipmhserver.adapters import mongodb
+
+    session = mongodb.Session(mongo)
+    collscans = []
+    for description, cursor in session.documents.query_shapes():
+        stages = mongodb.winning_plan_stages(cursor.explain())
+        print("%-28s %s" % (description, " <- ".join(stages)))
+        if "COLLSCAN" in stages:
+            collscans.append(description)
+
+    if collscans:
+        return "collection scans found: %s" % ", ".join(collscans)
+
+
+def update_sets(args):
+    from oaipmhserver.adapters import mongodb
+
+    mongo = mongodb.MongoDB(
+        [dsn.strip() for dsn in args.mongodb_dsn.split() if dsn], args.dbname
+    )
+    session = mongodb.Session(mongo)
+    for set in session.documents.sets():
+        if set["set_spec"]:
+            session.sets.upsert(set["set_spec"], set["set_name"])
+
+
 def cli(argv=None):
     if argv is None:
         argv = sys.argv[1:]
@@ -135,6 +730,75 @@ def cli(argv=None):
 
     parser_sync = subparsers.add_parser("sync", help="Sync data with a remote source.")
     parser_sync.add_argument("-c", "--concurrency", type=int, default=4)
+    parser_sync.add_argument(
+        "-e",
+        "--engine",
+        choices=sorted(ENGINES),
+        default="thread",
+        help="Concurrency model used to fetch documents. "
+        'The "async" engine requires aiohttp and supports hundreds of '
+        "concurrent fetches.",
+    )
+    parser_sync.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Number of changelog entries reduced and synced at a time.",
+    )
+    parser_sync.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Maximum number of documents written to the database at once.",
+    )
+    parser_sync.add_argument(
+        "--flush-interval",
+        type=float,
+        default=5.0,
+        help="Maximum number of seconds a fetched document waits to be written.",
+    )
+    parser_sync.add_argument(
+        "--max-rate",
+        type=float,
+        default=1000.0,
+        help="Maximum number of requests per second to the data source. "
+        "The actual rate adapts to the latency and errors of the source. "
+        "With --rebuild it is shared among the workers.",
+    )
+    parser_sync.add_argument(
+        "--formats",
+        default=os.environ.get("OAIPMH_FORMATS", "oai_dc oai_dc_openaire"),
+        help="Metadata formats served by the application, as in the "
+        "oaipmh.formats setting. The XML of each document is fetched only "
+        'if "jats" is among them.',
+    )
+    parser_sync.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Rebuild the documents collection from the whole changelog. "
+        "Documents are fetched by parallel workers into a staging collection, "
+        "which then atomically replaces the current one.",
+    )
+    parser_sync.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes used by --rebuild.",
+    )
+    parser_sync.add_argument(
+        "--metrics-file",
+        default="",
+        help="Write Prometheus metrics to this file at each checkpoint, "
+        "e.g. for the node_exporter textfile collector.",
+    )
+    parser_sync.add_argument(
+        "--metrics-pushgateway",
+        default="",
+        help="URL of a Prometheus Pushgateway to which metrics are pushed "
+        "at each checkpoint.",
+    )
     parser_sync.add_argument("-r", "--replicaset", default="")
     parser_sync.add_argument("-s", "--since", default="")
     parser_sync.add_argument("source", help="URI of the data source.")
@@ -153,8 +817,24 @@ def cli(argv=None):
         "mongodb_dsn", help="DSN for MongoDB node where indexes will be created."
     )
     parser_create_indexes.add_argument("dbname", help="Database name.")
+    parser_create_indexes.add_argument(
+        "--check",
+        action="store_true",
+        help="Do not create indexes. Instead, explain each query performed by "
+        "the application and fail if any of them requires a collection scan.",
+    )
     parser_create_indexes.set_defaults(func=create_indexes)
 
+    parser_update_sets = subparsers.add_parser(
+        "update-sets",
+        help="Rebuild the sets catalog from the stored documents",
+        description="The catalog is kept up to date by the sync command. "
+        "This operation is only needed on databases populated by older versions.",
+    )
+    parser_update_sets.add_argument("mongodb_dsn", help="DSN of the data destination.")
+    parser_update_sets.add_argument("dbname", help="Database name.")
+    parser_update_sets.set_defaults(func=update_sets)
+
     args = parser.parse_args(argv)
     # todas as mensagens serão omitidas se level > 50
     logging.basicConfig(
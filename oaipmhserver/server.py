@@ -1,50 +1,239 @@
 import os
+import time
+import zlib
+import logging
+import functools
+import itertools
+import collections
 from datetime import datetime
-from urllib.parse import urljoin
+from urllib.parse import urljoin, unquote, parse_qs
 
 from pyramid.config import Configurator
 from pyramid.view import view_config
 from pyramid.response import Response
 from pyramid.httpexceptions import HTTPMethodNotAllowed
+from pyramid.settings import asbool
 from oaipmh import common, server, metadata, error
+from oaipmh.datestamp import datestamp_to_datetime
+from lxml import etree
 from lxml.etree import SubElement
 
+from oaipmhserver import cache, compression, metrics, jats
 from oaipmhserver.adapters import mongodb
 
 
+LOGGER = logging.getLogger(__name__)
+
+VERBS = [
+    "GetRecord",
+    "Identify",
+    "ListIdentifiers",
+    "ListMetadataFormats",
+    "ListRecords",
+    "ListSets",
+]
+
+REQUEST_DURATION = metrics.Histogram(
+    "oaipmh_request_duration_seconds",
+    "Time to produce and send each response, including its serialization.",
+    ["verb", "metadata_prefix"],
+)
+DATABASE_DURATION = metrics.Histogram(
+    "oaipmh_database_duration_seconds",
+    "Time spent fetching the items of each response from the database.",
+    ["verb", "metadata_prefix"],
+)
+ITEMS = metrics.Counter(
+    "oaipmh_items_total",
+    "Records, headers or sets fetched from the database.",
+    ["verb", "metadata_prefix"],
+)
+RESPONSE_BYTES = metrics.Counter(
+    "oaipmh_response_bytes_total",
+    "Bytes written in response bodies, after compression.",
+    ["verb"],
+)
+RENDERED_CACHE = metrics.Counter(
+    "oaipmh_rendered_cache_total",
+    "Lookups of stored metadata renderings.",
+    ["result"],
+)
+# métricas do *cache* de GetRecord, associadas ao *cache* criado por `main`.
+GETRECORD_CACHE = {
+    name: metrics.Callback(metric, "GetRecord results cache %s." % name, type=type)
+    for name, metric, type in [
+        ("hits", "oaipmh_getrecord_cache_hits_total", "counter"),
+        ("misses", "oaipmh_getrecord_cache_misses_total", "counter"),
+        ("size", "oaipmh_getrecord_cache_size", "gauge"),
+    ]
+}
+
+
+def instrumented(verb):
+    """Decora o método de `OAIServer` que atende a `verb` de maneira que o
+    tempo gasto na obtenção dos itens do banco de dados, inclusive durante o
+    consumo do iterador retornado, e o número de itens sejam medidos.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            labels = {
+                "verb": verb,
+                "metadata_prefix": self._metadata_prefix_label(
+                    kwargs.get("metadataPrefix")
+                ),
+            }
+            started = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            elapsed = time.perf_counter() - started
+            if isinstance(result, tuple):
+                DATABASE_DURATION.observe(elapsed, **labels)
+                ITEMS.inc(**labels)
+                return result
+            return _measured_items(result, elapsed, labels)
+
+        return wrapper
+
+    return decorator
+
+
+def _measured_items(items, elapsed, labels):
+    count = 0
+    items = iter(items)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            count += 1
+            yield item
+    finally:
+        DATABASE_DURATION.observe(elapsed, **labels)
+        ITEMS.inc(count, **labels)
+
+
 class OAIServer:
-    def __init__(self, session, meta, formats):
+    """
+    :param cache_rendered: (opcional) se as renderizações dos registros devem
+    ser armazenadas e reutilizadas. Veja `CachedMetadata`.
+
+    :param records_cache: (opcional) instância de `cache.LRUCache` na qual os
+    resultados de `getRecord` são mantidos, indexados pelo par
+    `(identifier, metadataPrefix)`.
+
+    :param refresh_meta: (opcional) função chamada a cada acesso à
+    identificação do repositório, p. ex., uma instância de
+    `cache.PeriodicRefresh` que atualiza `meta`.
+    """
+
+    def __init__(
+        self,
+        session,
+        meta,
+        formats,
+        cache_rendered=False,
+        records_cache=None,
+        refresh_meta=None,
+    ):
         self.session = session
         self.meta = meta
         self.formats = formats
+        self._formats = {fmt.prefix: fmt for fmt in formats}
+        self.cache_rendered = cache_rendered
+        self.records_cache = records_cache
+        self.refresh_meta = refresh_meta
 
     def identify(self):
+        if self.refresh_meta is not None:
+            self.refresh_meta()
         return self.meta
 
-    def listSets(self, cursor=0, batch_size=10):
-        return [
-            (s["set_spec"], s["set_name"], "") for s in self.session.documents.sets()
-        ][cursor : cursor + batch_size]
+    def update_earliest_datestamp(self):
+        """Atualiza `meta` com o valor de `earliestDatestamp` mantido pela
+        sincronização. Bases sincronizadas antes que a variável existisse têm
+        o valor obtido diretamente dos documentos.
+        """
+        earliest_datestamp = self.session.variables.fetch("earliest_datestamp", None)
+        if not earliest_datestamp:
+            earliest_datestamp = self.session.documents.earliest_datestamp()
+        if earliest_datestamp and earliest_datestamp != self.meta.earliestDatestamp():
+            self.meta = common.Identify(
+                repositoryName=self.meta.repositoryName(),
+                baseURL=self.meta.baseURL(),
+                protocolVersion=self.meta.protocolVersion(),
+                adminEmails=self.meta.adminEmails(),
+                earliestDatestamp=earliest_datestamp,
+                deletedRecord=self.meta.deletedRecord(),
+                granularity=self.meta.granularity(),
+                compression=self.meta.compression(),
+                toolkit_description=False,
+            )
 
+    @instrumented("ListSets")
+    def listSets(self, cursor=0, batch_size=10, after=None):
+        return (
+            (s["set_spec"], s["set_name"], "")
+            for s in self.session.sets.filter(
+                offset=cursor, limit=batch_size, after=after
+            )
+        )
+
+    @instrumented("ListIdentifiers")
     def listIdentifiers(
-        self, metadataPrefix, set=None, from_=None, until=None, cursor=0, batch_size=10
+        self,
+        metadataPrefix,
+        set=None,
+        from_=None,
+        until=None,
+        cursor=0,
+        batch_size=10,
+        after=None,
     ):
         self._check_metadata_prefix(metadataPrefix)
         return (
             r.header()
             for r in self.session.documents.filter(
-                set=set, from_=from_, until=until, offset=cursor, limit=batch_size
+                set=set,
+                from_=from_,
+                until=until,
+                offset=cursor,
+                limit=batch_size,
+                after=parse_seek_key(after) if after else None,
+                include_deleted=self._include_deleted(),
+                require_xml=self._formats[metadataPrefix].requires_xml,
+                projection=mongodb.HEADER_PROJECTION,
             )
         )
 
+    @instrumented("ListRecords")
     def listRecords(
-        self, metadataPrefix, set=None, from_=None, until=None, cursor=0, batch_size=10
+        self,
+        metadataPrefix,
+        set=None,
+        from_=None,
+        until=None,
+        cursor=0,
+        batch_size=10,
+        after=None,
     ):
         self._check_metadata_prefix(metadataPrefix)
         return (
-            (r.header(), r.metadata(), None)
+            (r.header(), self._metadata(r, metadataPrefix), None)
             for r in self.session.documents.filter(
-                set=set, from_=from_, until=until, offset=cursor, limit=batch_size
+                set=set,
+                from_=from_,
+                until=until,
+                offset=cursor,
+                limit=batch_size,
+                after=parse_seek_key(after) if after else None,
+                include_deleted=self._include_deleted(),
+                require_xml=self._formats[metadataPrefix].requires_xml,
+                projection=self._formats[metadataPrefix].projection,
             )
         )
 
@@ -58,14 +247,54 @@ class OAIServer:
 
         return result
 
+    @instrumented("GetRecord")
     def getRecord(self, metadataPrefix, identifier):
         self._check_metadata_prefix(metadataPrefix)
+        if self.records_cache is None:
+            return self._get_record(metadataPrefix, identifier)
+
+        key = (identifier, metadataPrefix)
+        result = self.records_cache.get(key)
+        if result is None:
+            result = self._get_record(metadataPrefix, identifier)
+            # a renderização produzida na primeira resposta é preservada em
+            # `CachedMetadata.xml` e reutilizada nas seguintes.
+            self.records_cache.set(key, result)
+        return result
+
+    def _get_record(self, metadataPrefix, identifier):
         doc_id = identifier.rsplit(":")[-1]
-        record = self.session.documents.fetch(doc_id=doc_id)
+        record = self.session.documents.fetch(
+            doc_id=doc_id,
+            include_deleted=self._include_deleted(),
+            projection=self._formats[metadataPrefix].projection,
+        )
         if not record:
             raise error.IdDoesNotExistError()
 
-        return record.header(), record.metadata(), None
+        return record.header(), self._metadata(record, metadataPrefix), None
+
+    def _metadata(self, record, metadata_prefix):
+        fmt = self._formats[metadata_prefix]
+        if record.deleted:
+            return None
+        elif self.cache_rendered and fmt.cache_rendered:
+            return CachedMetadata(record, metadata_prefix, fmt.metadata)
+        else:
+            return fmt.metadata(record)
+
+    def _metadata_prefix_label(self, metadata_prefix):
+        if metadata_prefix is None:
+            return ""
+        elif metadata_prefix in self._formats:
+            return metadata_prefix
+        return "unknown"
+
+    def _include_deleted(self):
+        """Os registros removidos são omitidos caso o repositório declare não
+        manter informações sobre remoções, i.e., `deletedRecord` igual a `no`.
+        """
+        return self.meta.deletedRecord() != "no"
 
     def _check_metadata_prefix(self, identifier):
         try:
@@ -74,6 +303,329 @@ class OAIServer:
             raise error.CannotDisseminateFormatError from None
 
 
+class CachedMetadata(common.Metadata):
+    """Metadados de `record` no formato `metadata_prefix`, acompanhados de sua
+    renderização armazenada, caso exista, no atributo `xml`. O dicionário de
+    metadados é produzido apenas quando for necessário renderizá-los, por meio
+    de `metadata(record)` ou, por padrão, de `record.metadata()`.
+
+    Deve ser usado em conjunto com escritores decorados por `caching_writer`.
+    """
+
+    def __init__(self, record, metadata_prefix, metadata=None):
+        self._element = None
+        self._record = record
+        self._metadata_prefix = metadata_prefix
+        self._metadata = metadata
+        self._metadata_map = None
+        self.xml = record.rendered(metadata_prefix)
+        RENDERED_CACHE.inc(result="miss" if self.xml is None else "hit")
+
+    @property
+    def _map(self):
+        if self._metadata_map is None:
+            if self._metadata is None:
+                metadata = self._record.metadata()
+            else:
+                metadata = self._metadata(self._record)
+            self._metadata_map = metadata.getMap()
+        return self._metadata_map
+
+    def store(self, xml):
+        self.xml = xml
+        self._record.store_rendered(self._metadata_prefix, xml)
+
+
+def caching_writer(writer):
+    """Decora o escritor de metadados `writer` de maneira que a renderização
+    armazenada em `CachedMetadata` seja inserida na resposta em vez de
+    produzida novamente, e que a renderização produzida na sua ausência seja
+    armazenada.
+    """
+
+    @functools.wraps(writer)
+    def write(element, metadata):
+        xml = getattr(metadata, "xml", None)
+        if xml is not None:
+            element.append(etree.fromstring(xml))
+            return
+
+        writer(element, metadata)
+        if isinstance(metadata, CachedMetadata):
+            metadata.store(etree.tostring(element[-1]))
+
+    return write
+
+
+SEEK_KEY_TIMESTAMP_FMT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def seek_key(header):
+    """Produz a chave de continuação, serializada, a partir do cabeçalho do
+    último registro de uma página. A chave é formada pelo par
+    `(timestamp, doc_id)`, que é a ordenação dos registros no banco de dados.
+    """
+    return "%s,%s" % (
+        header.datestamp().strftime(SEEK_KEY_TIMESTAMP_FMT),
+        header.identifier().rsplit(":")[-1],
+    )
+
+
+def parse_seek_key(value):
+    """Operação inversa à de `seek_key`. Retorna o par `(timestamp, doc_id)`.
+    """
+    try:
+        timestamp, doc_id = value.split(",", 1)
+        return datetime.strptime(timestamp, SEEK_KEY_TIMESTAMP_FMT), doc_id
+    except ValueError:
+        raise error.BadResumptionTokenError(
+            "Unable to decode resumption token (bad key): %s" % value
+        ) from None
+
+
+def decode_resumption_token(token):
+    """Operação inversa à de `oaipmh.server.encodeResumptionToken`, equivalente
+    a `oaipmh.server.decodeResumptionToken`, que depende de `cgi.parse_qs`,
+    removida no Python 3.8.
+
+    Retorna o par `(kw, cursor)`. Lança `BadResumptionTokenError` caso o
+    *token* não possa ser decodificado.
+    """
+    token = unquote(token)
+    try:
+        kw = parse_qs(token, keep_blank_values=True, strict_parsing=True)
+    except ValueError:
+        raise error.BadResumptionTokenError(
+            "Unable to decode resumption token: %s" % token
+        )
+
+    result = {}
+    for key, value in kw.items():
+        value = value[0]
+        if key in ("from_", "until"):
+            try:
+                value = datestamp_to_datetime(value)
+            except error.DatestampError:
+                raise error.BadResumptionTokenError(
+                    "Unable to decode resumption token (bad %s): %s" % (key, token)
+                )
+        result[key] = value
+
+    try:
+        cursor = int(result.pop("cursor"))
+    except (KeyError, ValueError):
+        raise error.BadResumptionTokenError(
+            "Unable to decode resumption token (bad cursor): %s" % token
+        )
+    return result, cursor
+
+
+class KeysetBatchingResumption(server.BatchingResumption):
+    """Variante de `oaipmh.server.BatchingResumption` na qual o
+    *resumptionToken* das listas carrega a chave do último item entregue, de
+    maneira que a página seguinte seja obtida por meio de uma consulta de faixa
+    em vez de descartar `cursor` itens.
+
+    O `cursor` continua sendo codificado no *token*, como nos produzidos por
+    `oaipmh.server.encodeResumptionToken`, e é usado como deslocamento caso o
+    *token* não possua a chave.
+    """
+
+    SEEKABLE_VERBS = ["ListSets", "ListIdentifiers", "ListRecords"]
+
+    def handleVerb(self, verb, kw):
+        if verb not in self.SEEKABLE_VERBS:
+            return super().handleVerb(verb, kw)
+
+        kw, cursor, items = self.query(verb, kw)
+        result = list(items)
+        if len(result) > self._batch_size:
+            result.pop()
+            resumptionToken = self.resumption_token(verb, kw, cursor, result[-1])
+        else:
+            resumptionToken = None
+        return result, resumptionToken
+
+    def query(self, verb, kw):
+        """Executa a consulta referente à página solicitada em `kw`.
+
+        Retorna a tupla `(kw, cursor, items)`, em que `kw` são os argumentos da
+        consulta, decodificados do *resumptionToken* caso exista, e `items` é o
+        iterador de até `batch_size + 1` itens. O item excedente indica que há
+        uma próxima página.
+        """
+        if "resumptionToken" in kw:
+            kw, cursor = decode_resumption_token(kw["resumptionToken"])
+            # *tokens* emitidos por `oaipmh.server.BatchingResumption`
+            kw.pop("batch_size", None)
+        else:
+            kw, cursor = kw.copy(), 0
+
+        method = common.getMethodForVerb(self._server, verb)
+        return kw, cursor, method(cursor=cursor, batch_size=self._batch_size + 1, **kw)
+
+    def resumption_token(self, verb, kw, cursor, last_item):
+        """Produz o *resumptionToken* da página que sucede `last_item`.
+        """
+        return server.encodeResumptionToken(
+            dict(kw, after=self._seek_key(verb, last_item)), cursor + self._batch_size
+        )
+
+    def _seek_key(self, verb, item):
+        if verb == "ListSets":
+            set_spec, set_name, set_description = item
+            return set_spec
+        elif verb == "ListRecords":
+            header, metadata, about = item
+            return seek_key(header)
+        else:
+            return seek_key(item)
+
+
+# texto provisório usado para dividir as respostas serializadas nos pontos em
+# que o conteúdo variável é inserido.
+PLACEHOLDER = "__placeholder__"
+
+
+class XMLTreeServer(server.XMLTreeServer):
+    """Equivalente a `oaipmh.server.XMLTreeServer` cujos *resumptionTokens* são
+    decodificados por `decode_resumption_token`.
+    """
+
+    def _outputResuming(self, element, input_func, output_func, kw):
+        if "resumptionToken" not in kw:
+            return super()._outputResuming(element, input_func, output_func, kw)
+
+        result, token = input_func(resumptionToken=kw["resumptionToken"])
+        token_kw, _ = decode_resumption_token(kw["resumptionToken"])
+        output_func(element, result, token_kw)
+        if token is not None:
+            SubElement(element, server.nsoai("resumptionToken")).text = token
+
+
+class KeysetBatchingServer(server.ServerBase):
+    """Equivalente a `oaipmh.server.BatchingServer`, mas que usa
+    `KeysetBatchingResumption` para a paginação.
+    """
+
+    def __init__(
+        self, server, metadata_registry=None, nsmap=None, resumption_batch_size=10
+    ):
+        self._resumption = KeysetBatchingResumption(server, resumption_batch_size)
+        self._tree_server = XMLTreeServer(self._resumption, metadata_registry, nsmap)
+        self._identify_meta = None
+        self._identify_response = None
+
+    def handleVerb(self, verb, kw):
+        if verb == "Identify":
+            return self._identify()
+        return super().handleVerb(verb, kw)
+
+    def _identify(self):
+        """A resposta ao verbo Identify é serializada apenas quando a
+        identificação do repositório muda. A cada requisição somente
+        `responseDate` é produzido.
+        """
+        identify = self._resumption.identify()
+        if identify is not self._identify_meta:
+            envelope = self._tree_server.identify()
+            envelope.getroot().find(server.nsoai("responseDate")).text = PLACEHOLDER
+            head, tail = etree.tostring(
+                envelope.getroot(),
+                encoding="UTF-8",
+                xml_declaration=True,
+                pretty_print=True,
+            ).split(PLACEHOLDER.encode())
+            self._identify_meta, self._identify_response = identify, (head, tail)
+
+        head, tail = self._identify_response
+        response_date = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        return head + response_date.encode() + tail
+
+
+class StreamingServer(KeysetBatchingServer):
+    """Variante de `KeysetBatchingServer` cujas respostas aos verbos
+    ListIdentifiers e ListRecords são produzidas incrementalmente: o envelope,
+    cada registro à medida que é obtido do banco de dados e, por fim, o
+    *resumptionToken*. Desta forma o uso de memória por requisição independe do
+    tamanho do lote.
+
+    Para estes verbos `handleRequest` retorna um iterador de `bytes` em vez de
+    `bytes`. Os erros detectados antes do envio do primeiro registro produzem
+    as mesmas respostas que em `KeysetBatchingServer`; os demais interrompem a
+    resposta.
+    """
+
+    STREAMING_VERBS = ["ListIdentifiers", "ListRecords"]
+
+    def handleVerb(self, verb, kw):
+        if verb not in self.STREAMING_VERBS:
+            return super().handleVerb(verb, kw)
+
+        query_kw, cursor, items = self._resumption.query(verb, kw)
+        items = iter(items)
+        first_item = next(items, None)
+        if first_item is None:
+            if "resumptionToken" not in kw:
+                raise error.NoRecordsMatchError("No records match for request.")
+        else:
+            items = itertools.chain([first_item], items)
+
+        return self._stream(verb, kw, query_kw, cursor, items)
+
+    def _stream(self, verb, kw, query_kw, cursor, items):
+        envelope, e_verb = self._tree_server._outputEnvelope(verb=verb, **kw)
+        e_verb.text = PLACEHOLDER
+        head, tail = etree.tostring(
+            envelope.getroot(), encoding="UTF-8", xml_declaration=True
+        ).split(PLACEHOLDER.encode())
+
+        yield head
+        last_item = None
+        for count, item in enumerate(items):
+            if count == self._resumption._batch_size:
+                e_token = self._element("resumptionToken")
+                e_token.text = self._resumption.resumption_token(
+                    verb, query_kw, cursor, last_item
+                )
+                yield self._tostring(e_token)
+                break
+
+            if verb == "ListRecords":
+                yield self._record(query_kw["metadataPrefix"], *item)
+            else:
+                yield self._header(item)
+            last_item = item
+        yield tail
+
+    def _element(self, name):
+        return etree.Element(server.nsoai(name), nsmap=self._tree_server._nsmap)
+
+    def _tostring(self, element):
+        return etree.tostring(element, encoding="UTF-8", xml_declaration=False)
+
+    def _header(self, header):
+        e_parent = self._element("record")
+        self._tree_server._outputHeader(e_parent, header)
+        return self._tostring(e_parent[0])
+
+    def _record(self, metadata_prefix, header, metadata, about):
+        """Serializa o registro. A renderização armazenada dos metadados, caso
+        exista, é inserida sem ser interpretada.
+        """
+        parts = [b"<record>", self._header(header)]
+        if not header.isDeleted():
+            xml = getattr(metadata, "xml", None)
+            if xml is None:
+                e_parent = self._element("record")
+                self._tree_server._outputMetadata(e_parent, metadata_prefix, metadata)
+                parts.append(self._tostring(e_parent[0]))
+            else:
+                parts.extend([b"<metadata>", xml, b"</metadata>"])
+        parts.append(b"</record>")
+        return b"".join(parts)
+
+
 def lang_aware_oai_dc_writer(element, metadata):
     e_dc = SubElement(
         element,
@@ -112,6 +664,105 @@ def lang_aware_oai_dc_writer(element, metadata):
                 e.text = value
 
 
+def dublin_core_metadata(record):
+    return record.metadata()
+
+
+def openaire_metadata(record):
+    """Metadados Dublin Core de `record` conforme as diretrizes do OpenAIRE
+    para repositórios de literatura, que acrescentam a versão da publicação e
+    qualificam o DOI.
+    """
+    metadata = dublin_core_metadata(record)
+    map = metadata.getMap()
+    map["type"] = map["type"] + ["info:eu-repo/semantics/publishedVersion"]
+    if record.data.get("doi"):
+        map["relation"] = [
+            "info:eu-repo/semantics/altIdentifier/doi/" + record.data["doi"]
+        ]
+    return metadata
+
+
+class StoredXMLMetadata(common.Metadata):
+    """Metadados cuja renderização é o XML do documento, obtido e armazenado
+    pela sincronização, disponível no atributo `xml`.
+
+    O XML é mantido comprimido e descomprimido a cada acesso, de maneira que
+    os resultados mantidos no *cache* de `GetRecord` ocupem pouca memória.
+
+    Lança `CannotDisseminateFormatError` caso o XML do documento não esteja
+    armazenado, p. ex., em registros sincronizados por versões anteriores.
+    """
+
+    def __init__(self, record):
+        super().__init__(None, {})
+        self.compressed_xml = record.compressed_xml()
+        if self.compressed_xml is None:
+            raise error.CannotDisseminateFormatError(
+                "The XML of this record is not available."
+            )
+
+    @property
+    def xml(self):
+        return zlib.decompress(self.compressed_xml)
+
+
+def stored_xml_writer(element, metadata):
+    """O XML armazenado é inserido na resposta por `caching_writer` ou por
+    `StreamingServer`, portanto este escritor não produz conteúdo.
+    """
+
+
+def request_labels(args, formats):
+    """Rótulos das métricas da requisição cujos argumentos são `args`. Apenas
+    verbos e formatos conhecidos são usados como rótulos, de maneira que
+    requisições arbitrárias não produzam novas séries.
+    """
+    verb = args.get("verb")
+    if verb not in VERBS:
+        verb = "invalid"
+
+    metadata_prefix = args.get("metadataPrefix")
+    if metadata_prefix is None and "resumptionToken" in args:
+        token = parse_qs(unquote(args["resumptionToken"]))
+        metadata_prefix = token.get("metadataPrefix", [None])[0]
+
+    if metadata_prefix is None:
+        metadata_prefix = ""
+    elif metadata_prefix not in formats:
+        metadata_prefix = "unknown"
+    return {"verb": verb, "metadata_prefix": metadata_prefix}
+
+
+def _measured_body(body, started, labels):
+    """Mede as respostas transmitidas à medida que são produzidas.
+    """
+    size = 0
+    try:
+        for chunk in body:
+            size += len(chunk)
+            yield chunk
+    finally:
+        RESPONSE_BYTES.inc(size, verb=labels["verb"])
+        REQUEST_DURATION.observe(time.perf_counter() - started, **labels)
+
+
+def jats_schema_view(request):
+    return Response(
+        body=jats.SCHEMA.encode("utf-8"),
+        content_type="application/xml",
+        charset="utf-8",
+    )
+
+
+def metrics_view(request):
+    return Response(
+        body=metrics.REGISTRY.render().encode("utf-8"),
+        content_type=metrics.CONTENT_TYPE.split(";")[0],
+        charset="utf-8",
+    )
+
+
 @view_config(route_name="root")
 def root(request):
     if request.method == "GET":
@@ -121,11 +772,25 @@ def root(request):
     else:
         raise HTTPMethodNotAllowed()
 
-    return Response(
-        body=request.oaiserver.handleRequest(args),
-        charset="utf-8",
-        content_type="text/xml",
-    )
+    started = time.perf_counter()
+    labels = request_labels(args, request.registry.settings["oaipmh.formats"])
+    body = request.oaiserver.handleRequest(args)
+    level = request.registry.settings["oaipmh.response.compressionlevel"]
+    encoding = compression.negotiate(request, level)
+    if isinstance(body, bytes):
+        if encoding:
+            body = b"".join(compression.compress([body], encoding, level))
+        RESPONSE_BYTES.inc(len(body), verb=labels["verb"])
+        REQUEST_DURATION.observe(time.perf_counter() - started, **labels)
+        response = Response(body=body, charset="utf-8", content_type="text/xml")
+    else:
+        if encoding:
+            body = compression.compress(body, encoding, level)
+        body = _measured_body(body, started, labels)
+        response = Response(app_iter=body, charset="utf-8", content_type="text/xml")
+    response.vary = ("Accept-Encoding",)
+    response.content_encoding = encoding
+    return response
 
 
 def parse_date(datestamp):
@@ -171,13 +836,19 @@ DEFAULT_SETTINGS = [
     ),
     ("oaipmh.repo.deletedrecord", "OAIPMH_REPO_DELETEDRECORD", str, "no"),
     ("oaipmh.repo.granularity", "OAIPMH_REPO_GRANULARITY", str, "YYYY-MM-DDThh:mm:ssZ"),
+    ("oaipmh.repo.refreshinterval", "OAIPMH_REPO_REFRESHINTERVAL", float, 60.0),
+    ("oaipmh.repo.refreshtimeout", "OAIPMH_REPO_REFRESHTIMEOUT", float, 1.0),
+    ("oaipmh.resumptiontoken.batchsize", "OAIPMH_RESUMPTIONTOKEN_BATCHSIZE", int, 100),
+    ("oaipmh.records.cacherendered", "OAIPMH_RECORDS_CACHERENDERED", asbool, True),
+    ("oaipmh.response.streaming", "OAIPMH_RESPONSE_STREAMING", asbool, False),
     (
-        "oaipmh.repo.compression",
-        "OAIPMH_REPO_COMPRESSION",
-        lambda x: str(x).split(),
-        "identity",
+        "oaipmh.response.compressionlevel",
+        "OAIPMH_RESPONSE_COMPRESSIONLEVEL",
+        int,
+        6,
     ),
-    ("oaipmh.resumptiontoken.batchsize", "OAIPMH_RESUMPTIONTOKEN_BATCHSIZE", int, 100),
+    ("oaipmh.getrecord.cachesize", "OAIPMH_GETRECORD_CACHESIZE", int, 1000),
+    ("oaipmh.getrecord.cachettl", "OAIPMH_GETRECORD_CACHETTL", float, 300.0),
     ("oaipmh.mongodb.dsn", "OAIPMH_MONGODB_DSN", split_dsn, "mongodb://db:27017",),
     ("oaipmh.mongodb.dbname", "OAIPMH_MONGODB_DBNAME", str, "oaipmh",),
     ("oaipmh.mongodb.replicaset", "OAIPMH_MONGODB_REPLICASET", str, ""),
@@ -188,6 +859,13 @@ DEFAULT_SETTINGS = [
         "secondaryPreferred",
     ),
     ("oaipmh.site.baseurl", "OAIPMH_SITE_BASEURL", str, "https://www.scielo.br",),
+    ("oaipmh.metrics.enabled", "OAIPMH_METRICS_ENABLED", asbool, True),
+    (
+        "oaipmh.formats",
+        "OAIPMH_FORMATS",
+        lambda x: str(x).split(),
+        "oai_dc oai_dc_openaire",
+    ),
 ]
 
 
@@ -217,18 +895,86 @@ def server_identity(settings, earliest_datestamp):
         earliestDatestamp=earliest_datestamp,
         deletedRecord=settings["oaipmh.repo.deletedrecord"],
         granularity=settings["oaipmh.repo.granularity"],
-        compression=settings["oaipmh.repo.compression"],
+        compression=compression.supported_encodings(
+            settings["oaipmh.response.compressionlevel"]
+        ),
         toolkit_description=False,
     )
 
 
+# Deve ser incrementada sempre que a renderização dos metadados for modificada,
+# de maneira que as renderizações armazenadas sejam invalidadas.
+RENDERED_VERSION = "1"
+
+
+class MetadataFormat(
+    collections.namedtuple(
+        "MetadataFormat",
+        [
+            "prefix",
+            "schema",
+            "namespace",
+            "writer",
+            "metadata",
+            "projection",
+            "cache_rendered",
+            "requires_xml",
+        ],
+    )
+):
+    """Formato de metadados servido pelo repositório. Os três primeiros campos
+    são os informados pelo verbo `ListMetadataFormats`. O `schema` pode ser
+    relativo à URL base do repositório, quando servido pela própria aplicação.
+
+    :param writer: escritor de metadados do pyoai, decorado por
+    `caching_writer` no registro dos escritores.
+
+    :param metadata: função que produz os metadados, i.e., uma instância de
+    `oaipmh.common.Metadata`, a partir de uma instância de `mongodb.OAIRecord`.
+
+    :param projection: campos dos documentos que devem ser obtidos do banco de
+    dados.
+
+    :param cache_rendered: se as renderizações devem ser armazenadas. Veja
+    `CachedMetadata`.
+
+    :param requires_xml: se os metadados são o XML armazenado do documento. Os
+    registros sem XML armazenado são omitidos das listas neste formato.
+    """
+
+    __slots__ = ()
+
+
 METADATA_FORMATS = [
-    # Tupla com os campos: (metadataPrefix, schema, metadataNamespace, writer)
-    (
+    MetadataFormat(
         "oai_dc",
         "http://www.openarchives.org/OAI/2.0/oai_dc.xsd",
         "http://www.openarchives.org/OAI/2.0/oai_dc/",
         lang_aware_oai_dc_writer,
+        dublin_core_metadata,
+        mongodb.DESCRIPTIVE_PROJECTION,
+        True,
+        False,
+    ),
+    MetadataFormat(
+        "oai_dc_openaire",
+        "http://www.openarchives.org/OAI/2.0/oai_dc.xsd",
+        "http://www.openarchives.org/OAI/2.0/oai_dc/",
+        lang_aware_oai_dc_writer,
+        openaire_metadata,
+        mongodb.DESCRIPTIVE_PROJECTION,
+        True,
+        False,
+    ),
+    MetadataFormat(
+        "jats",
+        jats.SCHEMA_PATH,
+        jats.NAMESPACE,
+        stored_xml_writer,
+        StoredXMLMetadata,
+        mongodb.XML_PROJECTION,
+        False,
+        True,
     ),
 ]
 
@@ -237,7 +983,14 @@ def main(global_config, **settings):
     settings.update(parse_settings(settings))
     config = Configurator(settings=settings)
     config.add_route("root", "/")
-    config.scan()
+    config.add_route("jats_schema", "/" + jats.SCHEMA_PATH)
+    config.add_view(jats_schema_view, route_name="jats_schema")
+    if settings["oaipmh.metrics.enabled"]:
+        config.add_route("metrics", "/metrics")
+        config.add_view(metrics_view, route_name="metrics")
+    # apenas este módulo é varrido, de maneira que as métricas da
+    # sincronização não sejam importadas e expostas pela aplicação.
+    config.scan(__name__)
 
     mongo = mongodb.MongoDB(
         settings["oaipmh.mongodb.dsn"],
@@ -251,24 +1004,62 @@ def main(global_config, **settings):
         "url_for_html": lambda acron, doc_id: urljoin(
             settings["oaipmh.site.baseurl"], f"/j/{acron}/a/{doc_id}"
         ),
+        # as renderizações dependem da URL do site.
+        "rendered_version": "%s %s"
+        % (RENDERED_VERSION, settings["oaipmh.site.baseurl"]),
     }
     session = mongodb.Session(mongo, context=context)
 
     metadata_registry = metadata.MetadataRegistry()
 
-    for fmt in METADATA_FORMATS:
-        metadata_registry.registerWriter(fmt[0], fmt[3])
+    # os *schemas* servidos pela aplicação são anunciados a partir da URL
+    # base do repositório, que corresponde à rota `root`.
+    repo_baseurl = settings["oaipmh.repo.baseurl"].rstrip("/") + "/"
+    formats = [
+        fmt._replace(schema=urljoin(repo_baseurl, fmt.schema))
+        for fmt in METADATA_FORMATS
+        if fmt.prefix in settings["oaipmh.formats"]
+    ]
+    for fmt in formats:
+        metadata_registry.registerWriter(fmt.prefix, caching_writer(fmt.writer))
 
-    earliest_datestamp = session.documents.earliest_datestamp() or parse_date(
-        "1998-01-01"
+    if settings["oaipmh.getrecord.cachesize"] > 0:
+        records_cache = cache.LRUCache(
+            maxsize=settings["oaipmh.getrecord.cachesize"],
+            ttl=settings["oaipmh.getrecord.cachettl"],
+            generation=lambda: session.variables.fetch("sync_generation", 0),
+        )
+        for name, metric in GETRECORD_CACHE.items():
+            metric.bind(
+                functools.partial(lambda name: records_cache.stats()[name], name)
+            )
+    else:
+        records_cache = None
+        for metric in GETRECORD_CACHE.values():
+            metric.bind(None)
+
+    if settings["oaipmh.response.streaming"]:
+        Server = StreamingServer
+    else:
+        Server = KeysetBatchingServer
+
+    # o valor definitivo de `earliestDatestamp` é obtido em segundo plano, de
+    # maneira que a inicialização não dependa do banco de dados.
+    oaiserver = OAIServer(
+        session,
+        meta=server_identity(settings, earliest_datestamp=parse_date("1998-01-01")),
+        formats=formats,
+        cache_rendered=settings["oaipmh.records.cacherendered"],
+        records_cache=records_cache,
+    )
+    oaiserver.refresh_meta = cache.PeriodicRefresh(
+        oaiserver.update_earliest_datestamp,
+        interval=settings["oaipmh.repo.refreshinterval"],
+        timeout=settings["oaipmh.repo.refreshtimeout"],
     )
 
-    oaiserver = server.BatchingServer(
-        OAIServer(
-            session,
-            meta=server_identity(settings, earliest_datestamp=earliest_datestamp),
-            formats=METADATA_FORMATS,
-        ),
+    oaiserver = Server(
+        oaiserver,
         metadata_registry=metadata_registry,
         resumption_batch_size=settings["oaipmh.resumptiontoken.batchsize"],
     )
@@ -21,6 +21,7 @@ setuptools.setup(
     include_package_data=False,
     python_requires=">=3.7",
     install_requires=["requests", "pymongo", "pyoai"],
+    extras_require={"async": ["aiohttp"], "benchmarks": ["mongomock"]},
     test_suite="tests",
     classifiers=(
         "Development Status :: 2 - Pre-Alpha",
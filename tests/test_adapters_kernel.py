@@ -1,29 +1,11 @@
+import json
+import asyncio
 import unittest
+from unittest import mock
 
 from oaipmhserver.adapters import kernel
 
 
-class KernelChangelogStateMachineTests(unittest.TestCase):
-    def setUp(self):
-        self.state_machine = kernel.ChangelogStateMachine()
-
-    def test_initial_state_is_get(self):
-        self.assertEqual(self.state_machine.task(), "get")
-
-    def test_get_then_modified_remains_get(self):
-        self.state_machine.on_event("modified")
-        self.assertEqual(self.state_machine.task(), "get")
-
-    def test_get_then_deleted_turns_delete(self):
-        self.state_machine.on_event("deleted")
-        self.assertEqual(self.state_machine.task(), "delete")
-
-    def test_deleted_then_deleted_remains_deleted(self):
-        self.state_machine.on_event("deleted")
-        self.state_machine.on_event("deleted")
-        self.assertEqual(self.state_machine.task(), "delete")
-
-
 class KernelTasksReaderTests(unittest.TestCase):
     def setUp(self):
         self.reader = kernel.TasksReader()
@@ -82,3 +64,244 @@ class KernelTasksReaderTests(unittest.TestCase):
                 {"id": "/documents/0034-8910-rsp-48-2-0347", "task": "delete"},
             ],
         )
+
+
+class FetchDataTests(unittest.TestCase):
+    def test_uses_the_given_session(self):
+        session = mock.Mock()
+        session.get.return_value.content = b"{}"
+        self.assertEqual(
+            kernel.fetch_data("http://kernel/changes", session=session), b"{}"
+        )
+        session.get.assert_called_once_with(
+            "http://kernel/changes", timeout=kernel.HTTP_REQ_TIMEOUT
+        )
+
+
+class DataConnectorTests(unittest.TestCase):
+    def test_http_pool_is_sized_to_the_given_concurrency(self):
+        connector = kernel.DataConnector("http://kernel/", pool_size=16)
+        adapter = connector._http.get_adapter("http://kernel/changes")
+        self.assertEqual(adapter._pool_maxsize, 16)
+
+    def test_changes_are_fetched_through_the_connector_session(self):
+        connector = kernel.DataConnector("http://kernel/")
+        with mock.patch.object(
+            kernel, "fetch_data", return_value=b'{"results": []}'
+        ) as fetch:
+            self.assertEqual(list(connector.changes()), [])
+        fetch.assert_called_once_with(
+            "http://kernel/changes?since=", session=connector._http, throttle=None
+        )
+
+
+class DocumentXMLTests(unittest.TestCase):
+    xml = (
+        b'<?xml version="1.0" encoding="utf-8"?>\n'
+        b'<!DOCTYPE article PUBLIC "-//NLM//DTD JATS (Z39.96) Journal Publishing '
+        b'DTD v1.1 20151215//EN" "JATS-journalpublishing1.dtd">\n'
+        b'<article xml:lang="pt"><front>T\xc3\xadtulo</front></article>'
+    )
+    front = {"pub_date": [{"text": ["2020"]}]}
+
+    def test_declaration_and_doctype_are_removed(self):
+        self.assertEqual(
+            kernel.zlib.decompress(kernel.compress_xml(self.xml)),
+            b'<article xmlns="http://jats.nlm.nih.gov" xml:lang="pt">'
+            b"<front>T\xc3\xadtulo</front></article>",
+        )
+
+    def test_internal_entities_are_expanded(self):
+        xml = b'<!DOCTYPE article [<!ENTITY foo "bar">]><article>&foo;</article>'
+        self.assertEqual(
+            kernel.zlib.decompress(kernel.compress_xml(xml)),
+            b'<article xmlns="http://jats.nlm.nih.gov">bar</article>',
+        )
+
+    def test_external_entities_are_rejected(self):
+        xml = (
+            b'<!DOCTYPE article [<!ENTITY foo SYSTEM "file:///etc/passwd">]>'
+            b"<article>&foo;</article>"
+        )
+        self.assertRaises(ValueError, kernel.compress_xml, xml)
+
+    def test_undefined_entities_are_rejected(self):
+        xml = b'<!DOCTYPE article SYSTEM "article.dtd"><article>&nbsp;</article>'
+        self.assertRaises(kernel.etree.XMLSyntaxError, kernel.compress_xml, xml)
+
+    def test_xml_is_fetched_along_with_the_front_matter(self):
+        connector = kernel.DataConnector("http://kernel/", fetch_xml=True)
+        responses = [json.dumps(self.front).encode(), self.xml]
+        with mock.patch.object(kernel, "fetch_data", side_effect=responses) as fetch:
+            doc = connector.doc_metadata("/documents/abc")
+        self.assertEqual(
+            [c.args[0] for c in fetch.call_args_list],
+            ["http://kernel/documents/abc/front", "http://kernel/documents/abc"],
+        )
+        self.assertEqual(doc["xml"], kernel.compress_xml(self.xml))
+
+    def test_xml_is_fetched_only_on_demand(self):
+        connector = kernel.DataConnector("http://kernel/")
+        with mock.patch.object(
+            kernel, "fetch_data", return_value=json.dumps(self.front).encode()
+        ) as fetch:
+            doc = connector.doc_metadata("/documents/abc")
+        fetch.assert_called_once()
+        self.assertNotIn("xml", doc)
+
+    def test_front_matter_is_kept_when_the_xml_cannot_be_fetched(self):
+        connector = kernel.DataConnector("http://kernel/", fetch_xml=True)
+        responses = [
+            json.dumps(self.front).encode(),
+            kernel.exceptions.RetryableError("503"),
+        ]
+        with mock.patch.object(kernel, "fetch_data", side_effect=responses):
+            with self.assertLogs(kernel.LOGGER, level="WARNING"):
+                doc = connector.doc_metadata("/documents/abc")
+        self.assertEqual(doc["doc_id"], "abc")
+        self.assertEqual(doc["xml_error"], "503")
+        self.assertNotIn("xml", doc)
+
+    def test_documents_are_kept_without_malformed_xml(self):
+        connector = kernel.DataConnector("http://kernel/")
+        doc = connector._front_to_metadata(
+            "/documents/abc", self.front, xml=b"<article>"
+        )
+        self.assertNotIn("xml", doc)
+
+
+class RetryGracefullyTests(unittest.TestCase):
+    def test_coroutine_functions_are_retried_without_blocking(self):
+        calls = []
+
+        @kernel.retry_gracefully(max_retries=2, backoff_factor=0)
+        async def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise kernel.exceptions.RetryableError()
+            return "ok"
+
+        with mock.patch.object(kernel.time, "sleep") as sleep:
+            self.assertEqual(asyncio.run(flaky()), "ok")
+        sleep.assert_not_called()
+        self.assertEqual(len(calls), 3)
+
+    def test_coroutine_functions_give_up_after_max_retries(self):
+        @kernel.retry_gracefully(max_retries=1, backoff_factor=0)
+        async def broken():
+            raise kernel.exceptions.RetryableError()
+
+        self.assertRaises(kernel.exceptions.RetryableError, asyncio.run, broken())
+
+
+class KernelTasksReaderReadChunksTests(unittest.TestCase):
+    def setUp(self):
+        self.reader = kernel.TasksReader()
+
+    def test_events_are_reduced_within_each_chunk(self):
+        changelog = [
+            {"timestamp": "1", "id": "/documents/a"},
+            {"timestamp": "2", "id": "/documents/a"},
+            {"timestamp": "3", "id": "/documents/a", "deleted": True},
+        ]
+        chunks = list(self.reader.read_chunks(changelog, chunk_size=2))
+        self.assertEqual(
+            [(c.tasks, c.timestamp) for c in chunks],
+            [
+                ([{"id": "/documents/a", "task": "get"}], "2"),
+                ([{"id": "/documents/a", "task": "delete"}], "3"),
+            ],
+        )
+
+    def test_changelog_is_consumed_lazily(self):
+        def changelog():
+            yield {"timestamp": "1", "id": "/documents/a"}
+            raise AssertionError("the changelog was read beyond the first chunk")
+
+        chunks = self.reader.read_chunks(changelog(), chunk_size=1)
+        self.assertEqual(next(chunks).tasks, [{"id": "/documents/a", "task": "get"}])
+
+
+class KernelCompactTasksTests(unittest.TestCase):
+    def setUp(self):
+        changelog = [
+            {"timestamp": "1", "id": "/documents/a"},
+            {"timestamp": "2", "id": "/documents/b"},
+            {"timestamp": "3", "id": "/bundles/0034-8910-rsp-48-2"},
+            {"timestamp": "4", "id": "/documents/b", "deleted": True},
+        ]
+        self.tasks = kernel.TasksReader().read(changelog)
+
+    def test_non_document_entries_are_discarded_on_read(self):
+        self.assertEqual(list(self.tasks.states), ["/documents/a", "/documents/b"])
+
+    def test_timestamp_of_the_last_entry_is_kept(self):
+        self.assertEqual(self.tasks.timestamp, "4")
+
+    def test_docs_to_get(self):
+        self.assertEqual(
+            list(self.tasks.docs_to_get()), [{"id": "/documents/a", "task": "get"}]
+        )
+
+    def test_docs_to_del(self):
+        self.assertEqual(
+            list(self.tasks.docs_to_del()), [{"id": "/documents/b", "task": "delete"}]
+        )
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class AdaptiveThrottleTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.throttle = kernel.AdaptiveThrottle(
+            rate=10, min_rate=1, max_rate=20, failure_threshold=3, clock=self.clock
+        )
+
+    def test_tokens_are_refilled_at_the_current_rate(self):
+        self.assertEqual(self.throttle._reserve(), 0)
+        self.assertAlmostEqual(self.throttle._reserve(), 0.1)
+        self.clock.now = 0.1
+        self.assertEqual(self.throttle._reserve(), 0)
+
+    def test_rate_increases_additively_on_fast_responses(self):
+        self.throttle.on_success(latency=0.1)
+        self.assertEqual(self.throttle.rate, 11)
+
+    def test_rate_decreases_multiplicatively_at_most_once_per_second(self):
+        self.throttle.on_failure()
+        self.throttle.on_failure()
+        self.assertEqual(self.throttle.rate, 5)
+        self.clock.now = 1
+        self.throttle.on_success(latency=10)
+        self.assertEqual(self.throttle.rate, 2.5)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        for _ in range(3):
+            self.throttle.on_failure()
+        self.assertEqual(self.throttle._reserve(), 30)
+
+        self.clock.now = 30
+        self.assertEqual(self.throttle._reserve(), 0)
+        self.assertEqual(self.throttle.rate, 1)
+
+    def test_fetch_data_reports_to_the_throttle(self):
+        session = mock.Mock()
+        session.get.side_effect = kernel.requests.exceptions.ConnectionError()
+        throttle = mock.Mock()
+        with mock.patch.object(kernel.time, "sleep"):
+            self.assertRaises(
+                kernel.exceptions.RetryableError,
+                kernel.fetch_data,
+                "http://kernel/",
+                session=session,
+                throttle=throttle,
+            )
+        self.assertEqual(throttle.acquire.call_count, kernel.MAX_RETRIES + 1)
+        self.assertEqual(throttle.on_failure.call_count, kernel.MAX_RETRIES + 1)
@@ -0,0 +1,353 @@
+import os
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+from oaipmhserver.adapters import mongodb
+
+
+class MongoDBTests(unittest.TestCase):
+    def setUp(self):
+        self.mongoclient = mock.MagicMock()
+        self.mongo = mongodb.MongoDB(
+            "mongodb://db:27017",
+            "oaipmh",
+            mongoclient=self.mongoclient,
+            options={"replicaSet": "rs0", "ssl": None},
+        )
+
+    def test_client_is_created_once_with_the_given_options(self):
+        self.mongo.documents, self.mongo.sets, self.mongo.variables
+        self.mongoclient.assert_called_once_with("mongodb://db:27017", replicaSet="rs0")
+
+    def test_collections_are_cached(self):
+        self.assertIs(self.mongo.documents, self.mongo.documents)
+        db = self.mongoclient.return_value.__getitem__.return_value
+        db.__getitem__.assert_called_once_with("documents")
+
+    def test_documents_collection_is_honored(self):
+        mongo = mongodb.MongoDB(
+            "mongodb://db:27017",
+            "oaipmh",
+            mongoclient=self.mongoclient,
+            documents_collection="documents_rebuild",
+        )
+        mongo.documents
+        self.mongoclient.return_value.__getitem__.assert_called_once_with("oaipmh")
+        db = self.mongoclient.return_value.__getitem__.return_value
+        db.__getitem__.assert_called_once_with("documents_rebuild")
+
+
+class SessionTests(unittest.TestCase):
+    def test_stores_are_cached(self):
+        mongo = mock.MagicMock()
+        session = mongodb.Session(mongo)
+
+        self.assertIs(session.documents, session.documents)
+        self.assertIs(session.retries, session.retries)
+        self.assertIs(session.documents._collection, mongo.documents)
+        self.assertIsNot(session.sets, session.variables)
+
+
+class OAIRecordTests(unittest.TestCase):
+    def make_record(self, **data):
+        data.setdefault("doc_id", "rgTRVDFHk5GyfDgwNjKbQCJ")
+        data.setdefault("timestamp", datetime(2020, 5, 14))
+        data.setdefault("sets", [{"set_spec": "rsp", "set_name": "Rev. Saúde Pública"}])
+        return mongodb.OAIRecord(data, context={})
+
+    def test_header_of_a_deleted_record(self):
+        header = self.make_record(deleted=True).header()
+        self.assertTrue(header.isDeleted())
+        self.assertEqual(header.setSpec(), ["rsp"])
+
+    def test_records_are_not_deleted_by_default(self):
+        self.assertFalse(self.make_record().header().isDeleted())
+
+    def test_stored_xml_is_decompressed(self):
+        record = self.make_record(xml=mongodb.zlib.compress(b"<article/>"))
+        self.assertEqual(record.xml(), b"<article/>")
+
+    def test_records_without_stored_xml(self):
+        self.assertIsNone(self.make_record().xml())
+
+
+class DocumentStoreFilterTests(unittest.TestCase):
+    def test_header_projection_is_enough_to_build_headers(self):
+        collection = mock.MagicMock()
+        collection.find.return_value.sort.return_value = [
+            {
+                "doc_id": "rgTRVDFHk5GyfDgwNjKbQCJ",
+                "timestamp": datetime(2020, 5, 14),
+                "sets": [{"set_spec": "rsp"}],
+            }
+        ]
+        store = mongodb.DocumentStore(collection, context={})
+
+        records = list(store.filter(projection=mongodb.HEADER_PROJECTION))
+
+        self.assertEqual(collection.find.call_args[0][1], mongodb.HEADER_PROJECTION)
+        header = records[0].header()
+        self.assertEqual(header.identifier(), "oai:scielo.org:rgTRVDFHk5GyfDgwNjKbQCJ")
+        self.assertEqual(header.setSpec(), ["rsp"])
+
+
+class DocumentStoreFilterQueryTests(unittest.TestCase):
+    def test_only_records_with_xml_are_required(self):
+        store = mongodb.DocumentStore(mock.MagicMock(), context={})
+        query = store._filter_query(None, None, None, None, True, require_xml=True)
+        self.assertEqual(
+            query,
+            {"$nor": [{"deleted": {"$ne": True}, "xml": {"$exists": False}}]},
+        )
+
+
+class DateRangeTests(unittest.TestCase):
+    def test_both_bounds_are_kept(self):
+        store = mongodb.DocumentStore(mock.MagicMock(), context={})
+        query = store._filter_query(
+            None, datetime(2020, 5, 1), datetime(2020, 5, 14), None, True
+        )
+        self.assertEqual(
+            query,
+            {
+                "timestamp": {
+                    "$gte": datetime(2020, 5, 1),
+                    "$lt": datetime(2020, 5, 14, 0, 0, 1),
+                }
+            },
+        )
+
+    def test_until_spans_the_whole_second(self):
+        self.assertEqual(
+            mongodb.date_range(until=datetime(2020, 5, 14, 10, 30, 15, 500000)),
+            {"$lt": datetime(2020, 5, 14, 10, 30, 16)},
+        )
+
+    def test_upper_bound_is_kept_after_the_seek_key(self):
+        store = mongodb.DocumentStore(mock.MagicMock(), context={})
+        after = (datetime(2020, 5, 3), "b")
+        query = store._filter_query(
+            None, datetime(2020, 5, 1), datetime(2020, 5, 14), after, True
+        )
+        self.assertEqual(
+            query["$or"],
+            [
+                {
+                    "timestamp": {
+                        "$gt": datetime(2020, 5, 3),
+                        "$lt": datetime(2020, 5, 14, 0, 0, 1),
+                    }
+                },
+                {"timestamp": datetime(2020, 5, 3), "doc_id": {"$gt": "b"}},
+            ],
+        )
+        self.assertNotIn("timestamp", query)
+
+
+@unittest.skipUnless(
+    os.environ.get("OAIPMH_TEST_MONGODB_URI"),
+    "set OAIPMH_TEST_MONGODB_URI to run tests against a MongoDB server",
+)
+class DocumentStoreFilterQueryPlanTests(unittest.TestCase):
+    def setUp(self):
+        self.mongo = mongodb.MongoDB(
+            os.environ["OAIPMH_TEST_MONGODB_URI"],
+            "oaipmh_tests",
+            documents_collection="documents_query_plan",
+        )
+        self.mongo.documents.drop()
+        self.mongo.create_indexes()
+        self.started = datetime(2020, 5, 14)
+        self.mongo.documents.insert_many(
+            [
+                {
+                    "doc_id": "doc-%03d" % i,
+                    "timestamp": self.started + timedelta(minutes=i, milliseconds=250),
+                    "sets": [{"set_spec": "rsp"}],
+                }
+                for i in range(100)
+            ]
+        )
+        self.store = mongodb.Session(self.mongo).documents
+
+    def tearDown(self):
+        self.mongo.documents.drop()
+
+    def test_only_keys_in_range_are_examined(self):
+        from_ = self.started + timedelta(minutes=10)
+        until = self.started + timedelta(minutes=19)
+        query = self.store._filter_query(None, from_, until, None, False)
+        cursor = self.store._collection.find(query).sort(mongodb.DOCUMENTS_SORT)
+
+        stats = cursor.explain()["executionStats"]
+
+        self.assertEqual(stats["nReturned"], 10)
+        self.assertLessEqual(stats["totalKeysExamined"], 11)
+        self.assertEqual(stats["totalDocsExamined"], 10)
+
+
+class WinningPlanStagesTests(unittest.TestCase):
+    def test_stages_of_nested_plans(self):
+        explain = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "FETCH",
+                    "inputStage": {
+                        "stage": "SORT_MERGE",
+                        "inputStages": [{"stage": "IXSCAN"}, {"stage": "IXSCAN"}],
+                    },
+                }
+            }
+        }
+        self.assertEqual(
+            mongodb.winning_plan_stages(explain),
+            ["FETCH", "SORT_MERGE", "IXSCAN", "IXSCAN"],
+        )
+
+
+class ContentHashTests(unittest.TestCase):
+    def test_non_content_fields_are_ignored(self):
+        self.assertEqual(
+            mongodb.content_hash(
+                {"doc_id": "doc", "titles": ["a"], "timestamp": datetime(2020, 1, 1)}
+            ),
+            mongodb.content_hash(
+                {
+                    "titles": ["a"],
+                    "doc_id": "doc",
+                    "timestamp": datetime(2020, 5, 14),
+                    "rendered": {"oai_dc": {}},
+                }
+            ),
+        )
+
+    def test_content_changes_are_detected(self):
+        self.assertNotEqual(
+            mongodb.content_hash({"doc_id": "doc", "titles": ["a"]}),
+            mongodb.content_hash({"doc_id": "doc", "titles": ["b"]}),
+        )
+
+
+class DocumentStoreUpsertManyTests(unittest.TestCase):
+    def test_unchanged_docs_are_not_written(self):
+        unchanged = {"doc_id": "doc1", "titles": ["a"]}
+        changed = {"doc_id": "doc2", "titles": ["b"]}
+        collection = mock.MagicMock()
+        collection.find.return_value = [
+            {"doc_id": "doc1", "content_hash": mongodb.content_hash(unchanged)},
+            {"doc_id": "doc2", "content_hash": "outdated"},
+        ]
+        store = mongodb.DocumentStore(collection, context={})
+
+        self.assertEqual(store.upsert_many([unchanged, changed]), ([], 1))
+
+        (requests,), _ = collection.bulk_write.call_args
+        self.assertEqual([r._filter for r in requests], [{"doc_id": "doc2"}])
+
+    def test_nothing_is_written_when_all_docs_are_unchanged(self):
+        doc = {"doc_id": "doc1", "titles": ["a"]}
+        collection = mock.MagicMock()
+        collection.find.return_value = [
+            {"doc_id": "doc1", "content_hash": mongodb.content_hash(doc)}
+        ]
+        mongodb.DocumentStore(collection, context={}).upsert_many([doc])
+        collection.bulk_write.assert_not_called()
+
+
+class DocumentStoreKeepXMLTests(unittest.TestCase):
+    def setUp(self):
+        self.collection = mock.MagicMock()
+        stored = {"doc_id": "doc1", "titles": ["a"], "xml": b"..."}
+        self.collection.find.side_effect = [
+            [{"doc_id": "doc1", "xml": b"..."}],
+            [{"doc_id": "doc1", "content_hash": mongodb.content_hash(stored)}],
+        ]
+        self.store = mongodb.DocumentStore(self.collection, context={})
+
+    def test_docs_are_unchanged_when_only_the_xml_is_missing(self):
+        self.assertEqual(
+            self.store.upsert_many(
+                [{"doc_id": "doc1", "titles": ["a"]}], keep_xml=["doc1"]
+            ),
+            ([], 1),
+        )
+        self.collection.bulk_write.assert_not_called()
+
+    def test_stored_xml_is_kept_when_the_content_changes(self):
+        self.store.upsert_many([{"doc_id": "doc1", "titles": ["b"]}], keep_xml=["doc1"])
+
+        (requests,), _ = self.collection.bulk_write.call_args
+        self.assertEqual(requests[0]._doc["xml"], b"...")
+
+
+class DocumentStoreMarkDeletedManyTests(unittest.TestCase):
+    def test_deleted_docs_are_not_marked_again(self):
+        collection = mock.MagicMock()
+        mongodb.DocumentStore(collection, context={}).mark_deleted_many(["doc1"])
+
+        (requests,), _ = collection.bulk_write.call_args
+        self.assertEqual(
+            [r._filter for r in requests],
+            [{"doc_id": "doc1", "deleted": {"$ne": True}}],
+        )
+
+
+class DocumentStoreTombstonesTests(unittest.TestCase):
+    def test_live_docs_become_tombstones(self):
+        timestamp = datetime(2020, 5, 1)
+        collection = mock.MagicMock()
+        collection.find.return_value = [
+            {"doc_id": "doc1", "timestamp": datetime(2020, 1, 1), "xml": b"..."},
+            {"doc_id": "doc2", "timestamp": datetime(2020, 2, 1), "deleted": True},
+        ]
+        store = mongodb.DocumentStore(collection, context={})
+
+        self.assertEqual(
+            list(store.tombstones(["doc1", "doc2", "doc3"], timestamp=timestamp)),
+            [
+                {"doc_id": "doc1", "timestamp": timestamp, "deleted": True},
+                {"doc_id": "doc2", "timestamp": datetime(2020, 2, 1), "deleted": True},
+            ],
+        )
+
+
+class DocumentStoreCarryOverTimestampsTests(unittest.TestCase):
+    def test_timestamps_of_unchanged_docs_are_kept(self):
+        previous = mongodb.DocumentStore(mock.MagicMock(), context={})
+        previous._collection.find.return_value = [
+            {"doc_id": "doc%d" % i, "content_hash": "h%d" % i, "timestamp": i}
+            for i in range(3)
+        ]
+        collection = mock.MagicMock()
+        store = mongodb.DocumentStore(collection, context={})
+
+        store.carry_over_timestamps(previous, batch_size=2)
+
+        requests = [
+            r for (batch,), _ in collection.bulk_write.call_args_list for r in batch
+        ]
+        self.assertEqual(collection.bulk_write.call_count, 2)
+        self.assertEqual(
+            [(r._filter["content_hash"], r._doc) for r in requests],
+            [("h%d" % i, {"$set": {"timestamp": i}}) for i in range(3)],
+        )
+
+
+class SetStoreFilterTests(unittest.TestCase):
+    def setUp(self):
+        self.collection = mock.MagicMock()
+        self.store = mongodb.SetStore(self.collection)
+
+    def test_offset_is_skipped_without_key(self):
+        list(self.store.filter(offset=20, limit=10))
+        self.collection.find.assert_called_once_with({}, skip=20, limit=10)
+
+    def test_sets_after_key_are_fetched_without_skipping(self):
+        list(self.store.filter(offset=20, limit=10, after="scl"))
+        self.collection.find.assert_called_once_with(
+            {"_id": {"$gt": "scl"}}, skip=0, limit=10
+        )
+        self.collection.find.return_value.sort.assert_called_once_with(
+            "_id", mongodb.pymongo.ASCENDING
+        )
@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+
+from oaipmhserver import cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.generation = 1
+        self.cache = cache.LRUCache(
+            maxsize=2,
+            ttl=60,
+            generation=lambda: self.generation,
+            poll_interval=5,
+            clock=self.clock,
+        )
+
+    def test_least_recently_used_items_are_evicted(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_items_expire(self):
+        self.cache.set("a", 1)
+        self.clock.now = 61
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_generation_change_clears_the_cache(self):
+        self.cache.get("a")
+        self.cache.set("a", 1)
+        self.generation = 2
+        self.assertEqual(self.cache.get("a"), 1)
+
+        self.clock.now = 5
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_hits_and_misses_are_counted(self):
+        self.cache.get("a")
+        self.cache.set("a", 1)
+        self.cache.get("a")
+        self.assertEqual(
+            self.cache.stats(), {"hits": 1, "misses": 1, "size": 1, "maxsize": 2}
+        )
+
+
+class PeriodicRefreshTests(unittest.TestCase):
+    def test_runs_at_most_once_per_interval(self):
+        clock = FakeClock()
+        calls = []
+        refresh = cache.PeriodicRefresh(
+            lambda: calls.append(clock.now), interval=60, clock=clock
+        )
+        with mock.patch("threading.Thread") as Thread:
+            Thread.return_value.start.side_effect = lambda: refresh._run()
+            refresh()
+            clock.now = 30
+            refresh()
+            clock.now = 60
+            refresh()
+
+        self.assertEqual(calls, [0, 60])
+
+    def test_only_the_first_call_waits(self):
+        refresh = cache.PeriodicRefresh(mock.Mock(), interval=0, timeout=0.5)
+        with mock.patch("threading.Thread") as Thread:
+            refresh()
+            refresh._running = False
+            refresh()
+
+        Thread.return_value.join.assert_called_once_with(0.5)
+
+    def test_failures_are_logged(self):
+        def fail():
+            raise ValueError("boom")
+
+        refresh = cache.PeriodicRefresh(fail)
+        with self.assertLogs("oaipmhserver.cache", level="WARNING"):
+            refresh._run()
+        self.assertFalse(refresh._running)
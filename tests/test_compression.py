@@ -0,0 +1,50 @@
+import gzip
+import zlib
+import unittest
+
+from webob import Request
+
+from oaipmhserver import compression
+
+
+class NegotiateTests(unittest.TestCase):
+    def negotiate(self, level=6, **headers):
+        return compression.negotiate(Request.blank("/", headers=headers), level)
+
+    def test_responses_are_not_compressed_by_default(self):
+        self.assertIsNone(self.negotiate())
+
+    def test_preferred_encoding_is_chosen(self):
+        self.assertEqual(
+            self.negotiate(**{"Accept-Encoding": "deflate;q=0.5, gzip"}), "gzip"
+        )
+        self.assertEqual(
+            self.negotiate(**{"Accept-Encoding": "br, deflate"}), "deflate"
+        )
+
+    def test_unsupported_encodings_are_ignored(self):
+        self.assertIsNone(self.negotiate(**{"Accept-Encoding": "br, identity"}))
+
+    def test_compression_can_be_disabled(self):
+        self.assertIsNone(self.negotiate(level=0, **{"Accept-Encoding": "gzip"}))
+        self.assertEqual(compression.supported_encodings(0), [])
+
+
+class CompressTests(unittest.TestCase):
+    chunks = [b"<OAI-PMH>", b"<record/>" * 100, b"</OAI-PMH>"]
+
+    def test_gzip(self):
+        body = b"".join(compression.compress(self.chunks, "gzip", 6))
+        self.assertEqual(gzip.decompress(body), b"".join(self.chunks))
+
+    def test_deflate(self):
+        body = b"".join(compression.compress(self.chunks, "deflate", 6))
+        self.assertEqual(zlib.decompress(body), b"".join(self.chunks))
+
+    def test_chunks_are_consumed_lazily(self):
+        def chunks():
+            yield b"<OAI-PMH>"
+            raise AssertionError("the body was read before it was requested")
+
+        compressed = compression.compress(chunks(), "gzip", 6)
+        self.assertRaises(AssertionError, b"".join, compressed)
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from oaipmhserver import metrics
+
+
+class MetricsRenderTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counters_are_rendered_per_label(self):
+        counter = metrics.Counter(
+            "docs_total", "Documents.", ["result"], registry=self.registry
+        )
+        counter.inc(result="fetched")
+        counter.inc(2, result="fetched")
+        counter.inc(result='a "b"\n')
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP docs_total Documents.\n"
+            "# TYPE docs_total counter\n"
+            'docs_total{result="a \\"b\\"\\n"} 1.0\n'
+            'docs_total{result="fetched"} 3.0\n',
+        )
+
+    def test_unexpected_labels_are_rejected(self):
+        counter = metrics.Counter(
+            "docs_total", "Documents.", ["result"], registry=self.registry
+        )
+        self.assertRaises(ValueError, counter.inc, verb="ListRecords")
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram(
+            "duration_seconds", "Duration.", buckets=(0.1, 1), registry=self.registry
+        )
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(
+            self.registry.render().splitlines()[2:],
+            [
+                'duration_seconds_bucket{le="0.1"} 1.0',
+                'duration_seconds_bucket{le="1.0"} 2.0',
+                'duration_seconds_bucket{le="+Inf"} 3.0',
+                "duration_seconds_sum 5.55",
+                "duration_seconds_count 3.0",
+            ],
+        )
+
+    def test_callbacks_are_evaluated_on_render(self):
+        values = iter([1, 2])
+        metrics.Callback("size", "Size.", lambda: next(values), registry=self.registry)
+        self.assertIn("size 1.0\n", self.registry.render())
+        self.assertIn("size 2.0\n", self.registry.render())
+
+    def test_callbacks_can_be_rebound(self):
+        callback = metrics.Callback("size", "Size.", registry=self.registry)
+        self.assertNotIn("\nsize ", self.registry.render())
+        callback.bind(lambda: 3)
+        self.assertIn("size 3.0\n", self.registry.render())
+
+    def test_counters_from_other_processes_are_merged(self):
+        counter = metrics.Counter(
+            "docs_total", "Documents.", ["result"], registry=self.registry
+        )
+        counter.inc(result="fetched")
+        self.registry.merge({"docs_total": {("fetched",): 2, ("failed",): 1}})
+        self.assertEqual(counter.values(), {("fetched",): 3, ("failed",): 1})
+
+
+class MetricsExportTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        metrics.Gauge("pending", "Pending.", registry=self.registry).set(7)
+
+    def test_textfile_is_replaced_atomically(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "sync.prom")
+            metrics.write_textfile(path, registry=self.registry)
+            metrics.write_textfile(path, registry=self.registry)
+            self.assertEqual(os.listdir(tmpdir), ["sync.prom"])
+            with open(path) as f:
+                self.assertIn("pending 7.0\n", f.read())
+
+    def test_metrics_are_pushed_to_the_job_url(self):
+        session = mock.Mock()
+        metrics.push(
+            "http://pushgateway:9091/", "sync", registry=self.registry, session=session
+        )
+        session.put.assert_called_once_with(
+            "http://pushgateway:9091/metrics/job/sync",
+            data=self.registry.render().encode("utf-8"),
+            headers={"Content-Type": metrics.CONTENT_TYPE},
+            timeout=10,
+        )
@@ -0,0 +1,630 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from oaipmhserver import oaipmhctl
+from oaipmhserver.adapters import kernel
+
+
+class SynchronizerUpdateSetsTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.synchronizer = oaipmhctl.Synchronizer(
+            source=mock.Mock(), dest=self.session, reader=mock.Mock()
+        )
+
+    def test_unknown_sets_are_stored(self):
+        self.synchronizer._update_sets(
+            {"sets": [{"set_spec": "rsp", "set_name": "Revista de Saúde Pública"}]}
+        )
+        self.session.sets.upsert.assert_called_once_with(
+            "rsp", "Revista de Saúde Pública"
+        )
+
+    def test_known_sets_are_stored_once(self):
+        doc = {"sets": [{"set_spec": "rsp", "set_name": "Revista de Saúde Pública"}]}
+        self.synchronizer._update_sets(doc)
+        self.synchronizer._update_sets(doc)
+        self.assertEqual(self.session.sets.upsert.call_count, 1)
+
+    def test_renamed_sets_are_stored_again(self):
+        self.synchronizer._update_sets(
+            {"sets": [{"set_spec": "rsp", "set_name": "Rev. Saúde Pública"}]}
+        )
+        self.synchronizer._update_sets(
+            {"sets": [{"set_spec": "rsp", "set_name": "Revista de Saúde Pública"}]}
+        )
+        self.assertEqual(self.session.sets.upsert.call_count, 2)
+
+    def test_sets_without_spec_are_ignored(self):
+        self.synchronizer._update_sets({"sets": [{"set_spec": "", "set_name": ""}]})
+        self.session.sets.upsert.assert_not_called()
+
+
+class WriteBufferTests(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.now = 0.0
+        self.buffer = oaipmhctl.WriteBuffer(
+            self.written.append, batch_size=3, flush_interval=10, clock=self.clock
+        )
+
+    def clock(self):
+        return self.now
+
+    def test_flushes_when_batch_is_full(self):
+        for i in range(4):
+            self.buffer.add(i)
+        self.assertEqual(self.written, [[0, 1, 2]])
+
+    def test_flushes_when_interval_has_elapsed(self):
+        self.buffer.add(0)
+        self.now = 11.0
+        self.buffer.add(1)
+        self.assertEqual(self.written, [[0, 1]])
+
+    def test_pending_docs_are_due_after_the_interval(self):
+        self.assertIsNone(self.buffer.timeout())
+        self.buffer.add(0)
+        self.now = 4.0
+        self.assertEqual(self.buffer.timeout(), 6.0)
+        self.buffer.flush_if_due()
+        self.now = 10.0
+        self.buffer.flush_if_due()
+        self.assertEqual(self.written, [[0]])
+
+    def test_explicit_flush_writes_pending_docs(self):
+        self.buffer.add(0)
+        self.buffer.flush()
+        self.buffer.flush()
+        self.assertEqual(self.written, [[0]])
+
+
+class SynchronizerWriteDocsTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.synchronizer = oaipmhctl.Synchronizer(
+            source=mock.Mock(), dest=self.session, reader=mock.Mock()
+        )
+
+    def test_failures_are_logged_per_document(self):
+        docs = [
+            {"doc_id": "a", "sets": [{"set_spec": "x", "set_name": "X"}]},
+            {"doc_id": "b", "sets": [{"set_spec": "y", "set_name": "Y"}]},
+        ]
+        self.session.documents.upsert_many.return_value = [(docs[1], "boom")], 0
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR") as logs:
+            self.synchronizer._write_docs(docs)
+        self.assertIn('could not store "b": boom', logs.output[0])
+        self.session.sets.upsert.assert_called_once_with("x", "X")
+
+    def test_unchanged_docs_are_counted(self):
+        before = oaipmhctl.DOCUMENTS.values()
+        self.session.documents.upsert_many.return_value = [], 2
+        self.synchronizer._write_docs([{"doc_id": id} for id in "abc"])
+
+        after = oaipmhctl.DOCUMENTS.values()
+        self.assertEqual(
+            {
+                result: after[(result,)] - before.get((result,), 0)
+                for result in ("upserted", "unchanged")
+            },
+            {"upserted": 1, "unchanged": 2},
+        )
+
+    def test_failures_are_queued(self):
+        docs = [{"doc_id": "a"}, {"doc_id": "b"}]
+        self.session.documents.upsert_many.return_value = [(docs[1], "boom")], 0
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR"):
+            self.synchronizer._write_docs(docs)
+        self.session.retries.add.assert_called_once_with("/documents/b", "boom")
+
+    def test_docs_without_xml_are_stored_and_queued(self):
+        self.session.documents.upsert_many.return_value = [], 0
+        self.synchronizer._write_docs([{"doc_id": "a", "xml_error": "503"}])
+        self.session.documents.upsert_many.assert_called_once_with(
+            [{"doc_id": "a"}], keep_xml=["a"]
+        )
+        self.session.retries.add.assert_called_once_with("/documents/a", "503")
+
+
+class SynchronizerGetDocsTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.documents.upsert_many.side_effect = self.upsert_many
+        self.stored = []
+        self.source = mock.Mock()
+        self.source.doc_metadata.side_effect = lambda url: {"doc_id": url}
+        self.synchronizer = oaipmhctl.Synchronizer(
+            source=self.source,
+            dest=self.session,
+            reader=mock.Mock(),
+            max_concurrency=2,
+            batch_size=1,
+            max_pending=3,
+        )
+
+    def upsert_many(self, docs, keep_xml=()):
+        self.stored.extend(doc["doc_id"] for doc in docs)
+        return [], 0
+
+    def test_all_docs_are_stored(self):
+        self.synchronizer.get_docs({"id": str(i)} for i in range(20))
+        self.assertEqual(sorted(self.stored, key=int), [str(i) for i in range(20)])
+
+    def test_docs_are_flushed_while_fetches_are_pending(self):
+        written = threading.Event()
+        self.session.documents.upsert_many.side_effect = (
+            lambda docs, keep_xml: written.set() or self.upsert_many(docs)
+        )
+
+        def doc_metadata(url):
+            if url == "1":
+                self.assertTrue(written.wait(5))
+            return {"doc_id": url}
+
+        self.source.doc_metadata.side_effect = doc_metadata
+        self.synchronizer.batch_size = 10
+        self.synchronizer.flush_interval = 0.01
+        self.synchronizer.get_docs({"id": str(i)} for i in range(2))
+        self.assertEqual(self.stored, ["0", "1"])
+
+    def test_tasks_are_consumed_lazily(self):
+        def tasks():
+            for i in range(20):
+                self.assertLessEqual(i - len(self.stored), 3)
+                yield {"id": str(i)}
+
+        self.synchronizer.get_docs(tasks())
+        self.assertEqual(len(self.stored), 20)
+
+    def test_failures_do_not_stop_the_sync(self):
+        def doc_metadata(url):
+            if url == "3":
+                raise ValueError("boom")
+            return {"doc_id": url}
+
+        self.source.doc_metadata.side_effect = doc_metadata
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR"):
+            self.synchronizer.get_docs({"id": str(i)} for i in range(5))
+        self.assertEqual(sorted(self.stored), ["0", "1", "2", "4"])
+
+    def test_retryable_failures_are_queued(self):
+        def doc_metadata(url):
+            if url in ("3", "4"):
+                raise (kernel.exceptions.RetryableError if url == "3" else ValueError)()
+            return {"doc_id": url}
+
+        self.source.doc_metadata.side_effect = doc_metadata
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR"):
+            self.synchronizer.get_docs({"id": str(i)} for i in range(5))
+        self.session.retries.add.assert_called_once_with("3", mock.ANY)
+
+    def test_results_are_counted(self):
+        def doc_metadata(url):
+            if url == "3":
+                raise ValueError("boom")
+            return {"doc_id": url}
+
+        before = oaipmhctl.DOCUMENTS.values()
+        self.source.doc_metadata.side_effect = doc_metadata
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR"):
+            self.synchronizer.get_docs({"id": str(i)} for i in range(5))
+
+        after = oaipmhctl.DOCUMENTS.values()
+        self.assertEqual(
+            {
+                result: after[(result,)] - before.get((result,), 0)
+                for result in ("fetched", "failed", "upserted")
+            },
+            {"fetched": 4, "failed": 1, "upserted": 4},
+        )
+        self.assertEqual(oaipmhctl.PENDING_DOCUMENTS.values(), {(): 0})
+
+    def test_queued_docs_are_retried(self):
+        self.session.retries.ids.return_value = iter(["7", "8"])
+        self.session.retries.count.return_value = 1
+        self.synchronizer.retry_failed()
+
+        self.assertEqual(sorted(self.stored), ["7", "8"])
+        self.session.retries.remove_many.assert_called_once_with(
+            ["7", "8"], failed_before=mock.ANY
+        )
+        self.assertEqual(oaipmhctl.RETRY_QUEUE.values(), {(): 1})
+
+
+class FakeAsyncDataConnector:
+    def __init__(self):
+        self.opened = False
+
+    async def __aenter__(self):
+        self.opened = True
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.opened = False
+
+    async def doc_metadata_async(self, url):
+        if url == "3":
+            raise ValueError("boom")
+        return {"doc_id": url}
+
+
+class AsyncSynchronizerGetDocsTests(unittest.TestCase):
+    def test_all_docs_are_stored(self):
+        stored = []
+        session = mock.Mock()
+        session.documents.upsert_many.side_effect = (
+            lambda docs, keep_xml: stored.extend(d["doc_id"] for d in docs) or ([], 0)
+        )
+        source = FakeAsyncDataConnector()
+        synchronizer = oaipmhctl.AsyncSynchronizer(
+            source=source, dest=session, reader=mock.Mock(), batch_size=2
+        )
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR"):
+            synchronizer.get_docs({"id": str(i)} for i in range(10))
+        self.assertEqual(sorted(stored, key=int), [str(i) for i in range(10) if i != 3])
+        self.assertFalse(source.opened)
+
+    def test_fetched_docs_are_stored_on_cancel(self):
+        stored = []
+        session = mock.Mock()
+        session.documents.upsert_many.side_effect = (
+            lambda docs, keep_xml: stored.extend(d["doc_id"] for d in docs) or ([], 0)
+        )
+        source = FakeAsyncDataConnector()
+        fetched = mock.Mock()
+
+        async def doc_metadata_async(url):
+            if url != "0":
+                await asyncio.Event().wait()
+            fetched()
+            return {"doc_id": url}
+
+        source.doc_metadata_async = doc_metadata_async
+        synchronizer = oaipmhctl.AsyncSynchronizer(
+            source=source, dest=session, reader=mock.Mock(), batch_size=10
+        )
+
+        async def cancel_after_first_fetch():
+            task = asyncio.ensure_future(
+                synchronizer._get_docs({"id": str(i)} for i in range(3))
+            )
+            while not fetched.called:
+                await asyncio.sleep(0)
+            # o documento obtido é entregue ao `WriteBuffer`.
+            for _ in range(5):
+                await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_after_first_fetch())
+        self.assertEqual(stored, ["0"])
+        self.assertFalse(source.opened)
+
+
+class PrefetchTests(unittest.TestCase):
+    def test_items_are_yielded_in_order(self):
+        self.assertEqual(list(oaipmhctl.prefetch(range(10))), list(range(10)))
+
+    def test_exceptions_are_raised_in_the_consumer(self):
+        def items():
+            yield 1
+            raise ValueError("boom")
+
+        consumer = oaipmhctl.prefetch(items())
+        self.assertEqual(next(consumer), 1)
+        self.assertRaises(ValueError, next, consumer)
+
+
+class SynchronizerSyncTests(unittest.TestCase):
+    def test_chunks_are_synced_in_order(self):
+        changelog = [
+            {"timestamp": str(i), "id": "/documents/doc%s" % i} for i in range(5)
+        ]
+        source = mock.Mock()
+        source.changes.return_value = changelog
+        synchronizer = oaipmhctl.Synchronizer(
+            source=source,
+            dest=mock.Mock(
+                **{"retries.ids.return_value": [], "retries.count.return_value": 0}
+            ),
+            reader=kernel.TasksReader(),
+            chunk_size=2,
+        )
+        with mock.patch.object(synchronizer, "get_docs") as get_docs:
+            self.assertEqual(synchronizer.sync(), "4")
+        self.assertEqual(
+            [[t["id"] for t in call.args[0]] for call in get_docs.call_args_list],
+            [
+                ["/documents/doc0", "/documents/doc1"],
+                ["/documents/doc2", "/documents/doc3"],
+                ["/documents/doc4"],
+            ],
+        )
+
+    def test_remaining_tasks_of_each_window_are_measured(self):
+        changelog = [
+            {"timestamp": "0", "id": "/documents/doc0"},
+            {"timestamp": "1", "id": "/documents/doc1"},
+            {"timestamp": "2", "id": "/documents/doc2", "deleted": True},
+        ]
+        source = mock.Mock()
+        source.changes.return_value = changelog
+        synchronizer = oaipmhctl.Synchronizer(
+            source=source,
+            dest=mock.Mock(
+                **{"retries.ids.return_value": [], "retries.count.return_value": 2}
+            ),
+            reader=kernel.TasksReader(),
+            chunk_size=3,
+        )
+        remaining = []
+
+        def get_docs(tasks):
+            for _ in tasks:
+                remaining.append(oaipmhctl.WINDOW_TASKS.values()[()])
+
+        with mock.patch.object(
+            synchronizer, "get_docs", side_effect=get_docs
+        ), mock.patch.object(
+            synchronizer, "del_docs", side_effect=lambda tasks: sum(0 for _ in tasks)
+        ):
+            synchronizer.sync()
+
+        self.assertEqual(remaining, [2, 1])
+        self.assertEqual(oaipmhctl.WINDOW_TASKS.values(), {(): 0})
+        self.assertEqual(oaipmhctl.RETRY_QUEUE.values(), {(): 2})
+
+    def test_checkpoints_follow_completed_chunks(self):
+        changelog = [
+            {"timestamp": str(i), "id": "/documents/doc%s" % i} for i in range(5)
+        ]
+        source = mock.Mock()
+        source.changes.return_value = changelog
+        synchronizer = oaipmhctl.Synchronizer(
+            source=source,
+            dest=mock.Mock(
+                **{"retries.ids.return_value": [], "retries.count.return_value": 0}
+            ),
+            reader=kernel.TasksReader(),
+            chunk_size=2,
+        )
+        checkpoint = mock.Mock()
+        with mock.patch.object(
+            synchronizer, "get_docs", side_effect=[None, KeyboardInterrupt]
+        ):
+            self.assertRaises(
+                KeyboardInterrupt, synchronizer.sync, checkpoint=checkpoint
+            )
+        checkpoint.assert_called_once_with("1")
+
+    def test_checkpoints_are_held_after_failed_deletions(self):
+        changelog = [
+            {"timestamp": str(i), "id": "/documents/doc%s" % i} for i in range(5)
+        ]
+        source = mock.Mock()
+        source.changes.return_value = changelog
+        synchronizer = oaipmhctl.Synchronizer(
+            source=source,
+            dest=mock.Mock(
+                **{"retries.ids.return_value": [], "retries.count.return_value": 0}
+            ),
+            reader=kernel.TasksReader(),
+            chunk_size=2,
+        )
+        checkpoint = mock.Mock()
+        with mock.patch.object(synchronizer, "get_docs"), mock.patch.object(
+            synchronizer, "del_docs", side_effect=[0, 1, 0]
+        ):
+            with self.assertLogs(oaipmhctl.LOGGER, level="ERROR"):
+                self.assertEqual(synchronizer.sync(checkpoint=checkpoint), "4")
+        checkpoint.assert_called_once_with("1")
+        # os caches continuam sendo invalidados após cada janela.
+        self.assertEqual(
+            synchronizer.dest.variables.increment.call_args_list,
+            [mock.call("sync_generation")] * 3,
+        )
+
+
+class SynchronizerDelDocsTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.documents.mark_deleted_many.return_value = []
+        self.synchronizer = oaipmhctl.Synchronizer(
+            source=mock.Mock(), dest=self.session, reader=mock.Mock(), batch_size=2
+        )
+
+    def test_docs_are_marked_as_deleted_in_batches(self):
+        self.synchronizer.del_docs(
+            {"id": "/documents/%s" % id, "task": "delete"} for id in "abc"
+        )
+        self.assertEqual(
+            self.session.documents.mark_deleted_many.call_args_list,
+            [mock.call(["a", "b"]), mock.call(["c"])],
+        )
+
+    def test_failures_are_logged_per_document(self):
+        self.session.documents.mark_deleted_many.return_value = [("a", "boom")]
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR") as logs:
+            self.synchronizer.del_docs([{"id": "/documents/a", "task": "delete"}])
+        self.assertIn('could not delete "a": boom', logs.output[0])
+
+    def test_failures_are_counted(self):
+        self.session.documents.mark_deleted_many.side_effect = [[("a", "boom")], []]
+        with self.assertLogs(oaipmhctl.LOGGER, level="ERROR"):
+            failed = self.synchronizer.del_docs(
+                {"id": "/documents/%s" % id, "task": "delete"} for id in "abc"
+            )
+        self.assertEqual(failed, 1)
+
+
+class CheckIndexesTests(unittest.TestCase):
+    def make_mongo(self, winning_plan):
+        mongo = mock.MagicMock()
+        cursor = mongo.documents.find.return_value
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = cursor
+        cursor.explain.return_value = {"queryPlanner": {"winningPlan": winning_plan}}
+        return mongo
+
+    @mock.patch("builtins.print")
+    def test_index_scans_pass(self, _):
+        mongo = self.make_mongo({"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}})
+        self.assertIsNone(oaipmhctl.check_indexes(mongo))
+
+    @mock.patch("builtins.print")
+    def test_collection_scans_fail(self, _):
+        mongo = self.make_mongo({"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}})
+        self.assertIn("collection scans found", oaipmhctl.check_indexes(mongo))
+
+
+class PartitionTests(unittest.TestCase):
+    def test_partitions_are_stable(self):
+        self.assertEqual(
+            oaipmhctl.partition("/documents/rgTRVDFHk5GyfDgwNjKbQCJ", 4),
+            oaipmhctl.partition("/documents/rgTRVDFHk5GyfDgwNjKbQCJ", 4),
+        )
+
+    def test_ids_are_spread_over_all_partitions(self):
+        partitions = {
+            oaipmhctl.partition("/documents/doc%d" % i, 4) for i in range(100)
+        }
+        self.assertEqual(partitions, {0, 1, 2, 3})
+
+
+class FakeProcessPoolExecutor:
+    def __init__(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+
+@mock.patch.object(
+    oaipmhctl.concurrent.futures, "ProcessPoolExecutor", FakeProcessPoolExecutor
+)
+class RebuildTests(unittest.TestCase):
+    def setUp(self):
+        self.args = mock.Mock(source="http://kernel", workers=2, batch_size=10)
+        self.mongo = mock.Mock()
+        self.staging_mongo = mock.Mock()
+        self.tasks = kernel.CompactTasks(
+            states={
+                "/documents/doc1": kernel.TASK_GET,
+                "/documents/doc2": kernel.TASK_GET,
+                "/documents/doc3": kernel.TASK_DELETE,
+            },
+            timestamp="2020-05-01T00:00:00Z",
+        )
+        self.sessions = {self.mongo: mock.Mock(), self.staging_mongo: mock.Mock()}
+        self.sessions[self.mongo].documents.tombstones.return_value = iter(
+            [{"doc_id": "doc3", "deleted": True}]
+        )
+        self.sessions[self.staging_mongo].documents.upsert_many.return_value = [], 0
+        patches = [
+            mock.patch.object(oaipmhctl, "_mongodb", return_value=self.staging_mongo),
+            mock.patch.object(
+                kernel,
+                "TasksReader",
+                return_value=mock.Mock(**{"read.return_value": self.tasks}),
+            ),
+            mock.patch.object(kernel, "DataConnector"),
+            mock.patch(
+                "oaipmhserver.adapters.mongodb.Session", side_effect=self.sessions.get
+            ),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_collection_is_replaced_after_copying_tombstones(self):
+        with mock.patch.object(
+            oaipmhctl, "_rebuild_partition", return_value=(1, 0, {})
+        ):
+            timestamp = oaipmhctl.rebuild(self.args, self.mongo)
+
+        documents = self.sessions[self.mongo].documents
+        staging = self.sessions[self.staging_mongo].documents
+        staging.carry_over_timestamps.assert_called_once_with(documents, batch_size=10)
+        documents.tombstones.assert_called_once_with(["doc3"])
+        staging.upsert_many.assert_called_once_with(
+            [{"doc_id": "doc3", "deleted": True}]
+        )
+        self.mongo.replace_documents.assert_called_once_with(
+            oaipmhctl.REBUILD_COLLECTION
+        )
+        self.assertEqual(timestamp, "2020-05-01T00:00:00Z")
+
+    def test_collection_is_kept_when_documents_are_missing(self):
+        with mock.patch.object(
+            oaipmhctl, "_rebuild_partition", side_effect=[(1, 0, {}), (1, 1, {})]
+        ):
+            with self.assertRaises(oaipmhctl.exceptions.IncompleteRebuildError):
+                oaipmhctl.rebuild(self.args, self.mongo)
+
+        self.mongo.replace_documents.assert_not_called()
+
+
+class RebuildPartitionTests(unittest.TestCase):
+    @mock.patch("oaipmhserver.adapters.mongodb.Session")
+    @mock.patch.object(oaipmhctl, "_mongodb")
+    @mock.patch.object(oaipmhctl, "_synchronizer")
+    def test_failed_docs_are_retried(self, synchronizer, *_):
+        sync = synchronizer.return_value
+        sync.failed_ids = set()
+        attempts = []
+
+        def get_docs(tasks):
+            ids = [task["id"] for task in tasks]
+            attempts.append(ids)
+            if len(attempts) < 3:
+                sync.failed_ids = {ids[-1]}
+
+        sync.get_docs.side_effect = get_docs
+        args = mock.Mock(max_rate=10.0, workers=1)
+        count, failed, _ = oaipmhctl._rebuild_partition(args, ["a", "b"])
+
+        self.assertEqual(attempts, [["a", "b"], ["b"], ["b"]])
+        self.assertEqual((count, failed), (2, 0))
+
+    @mock.patch("oaipmhserver.adapters.mongodb.Session")
+    @mock.patch.object(oaipmhctl, "_mongodb")
+    @mock.patch.object(oaipmhctl, "_synchronizer")
+    def test_max_rate_is_shared_among_workers(self, synchronizer, *_):
+        synchronizer.return_value.failed_ids = set()
+        args = mock.Mock(max_rate=100.0, workers=4)
+        oaipmhctl._rebuild_partition(args, ["a"])
+
+        self.assertEqual(synchronizer.call_args.kwargs["max_rate"], 25.0)
+
+
+class SynchronizerFactoryTests(unittest.TestCase):
+    def test_request_rate_follows_the_latest_throttle(self):
+        args = mock.Mock(
+            source="http://kernel",
+            engine="thread",
+            concurrency=2,
+            max_rate=10.0,
+            formats="oai_dc",
+            chunk_size=10,
+            batch_size=10,
+            flush_interval=5.0,
+        )
+        oaipmhctl._synchronizer(args, mock.Mock())
+        synchronizer = oaipmhctl._synchronizer(args, mock.Mock())
+        synchronizer.source.throttle.rate = 7.0
+
+        self.assertIs(
+            oaipmhctl.metrics.REGISTRY._metrics["oaipmh_sync_request_rate"],
+            oaipmhctl.REQUEST_RATE,
+        )
+        self.assertEqual(oaipmhctl.REQUEST_RATE.values(), {(): 7.0})
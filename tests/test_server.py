@@ -0,0 +1,562 @@
+import gzip
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+from lxml import etree
+from pyramid.request import Request
+from oaipmh import common, error, metadata
+
+from oaipmhserver import server, cache, jats
+from oaipmhserver.adapters import mongodb, kernel
+
+
+class SeekKeyTests(unittest.TestCase):
+    def test_roundtrip(self):
+        header = common.Header(
+            element=None,
+            identifier="oai:scielo.org:rgTRVDFHk5GyfDgwNjKbQCJ",
+            datestamp=datetime(2020, 5, 14, 19, 48, 2, 123000),
+            setspec=["abc"],
+            deleted=False,
+        )
+        self.assertEqual(
+            server.parse_seek_key(server.seek_key(header)),
+            (datetime(2020, 5, 14, 19, 48, 2, 123000), "rgTRVDFHk5GyfDgwNjKbQCJ"),
+        )
+
+    def test_malformed_key_raises_bad_resumption_token(self):
+        self.assertRaises(
+            error.BadResumptionTokenError, server.parse_seek_key, "2020-05-14"
+        )
+
+
+class FakeDocumentStore:
+    """Reproduz a paginação de `mongodb.DocumentStore.filter` sobre uma lista
+    de documentos.
+    """
+
+    def __init__(self, docs):
+        self.docs = sorted(docs, key=lambda doc: (doc["timestamp"], doc["doc_id"]))
+        self.calls = []
+
+    def filter(self, offset=0, limit=10, after=None, **kwargs):
+        self.calls.append({"offset": offset, "after": after})
+        if after:
+            docs = [d for d in self.docs if (d["timestamp"], d["doc_id"]) > after]
+        else:
+            docs = self.docs[offset:]
+        return (mongodb.OAIRecord(doc, context={}) for doc in docs[:limit])
+
+
+class KeysetBatchingResumptionTests(unittest.TestCase):
+    def setUp(self):
+        started = datetime(2020, 5, 14, 19, 48, 2, 123000)
+        # os documentos 2 a 6 têm o mesmo `timestamp` e ocupam o fim da
+        # primeira página e toda a segunda.
+        timestamps = [0, 1, 2, 2, 2, 2, 2, 3, 4]
+        self.store = FakeDocumentStore(
+            {"doc_id": "doc%d" % i, "timestamp": started + timedelta(seconds=t)}
+            for i, t in enumerate(timestamps)
+        )
+        session = mock.Mock()
+        session.documents = self.store
+        self.oaiserver = server.OAIServer(
+            session,
+            meta=server.server_identity(
+                server.parse_settings({}), earliest_datestamp=datetime(1998, 1, 1)
+            ),
+            formats=server.METADATA_FORMATS,
+        )
+        self.resumption = server.KeysetBatchingResumption(self.oaiserver, 3)
+
+    def walk(self, kw):
+        identifiers = []
+        while True:
+            headers, token = self.resumption.handleVerb("ListIdentifiers", kw)
+            identifiers.extend(h.identifier().rsplit(":")[-1] for h in headers)
+            if token is None:
+                return identifiers
+            kw = {"resumptionToken": token}
+
+    def test_runs_of_equal_timestamps_are_neither_repeated_nor_skipped(self):
+        self.assertEqual(
+            self.walk({"metadataPrefix": "oai_dc"}), ["doc%d" % i for i in range(9)]
+        )
+        self.assertEqual(
+            [call["after"] is not None for call in self.store.calls],
+            [False, True, True],
+        )
+
+    def test_legacy_tokens_are_resumed_from_the_cursor(self):
+        token = server.server.encodeResumptionToken(
+            {"metadataPrefix": "oai_dc", "batch_size": "4"}, 3
+        )
+        self.assertEqual(
+            self.walk({"resumptionToken": token}), ["doc%d" % i for i in range(3, 9)]
+        )
+        self.assertEqual(self.store.calls[0], {"offset": 3, "after": None})
+
+
+    def test_resumed_responses_are_produced(self):
+        oaiserver = server.KeysetBatchingServer(self.oaiserver, resumption_batch_size=3)
+        namespaces = {"oai": "http://www.openarchives.org/OAI/2.0/"}
+        kw = {"verb": "ListIdentifiers", "metadataPrefix": "oai_dc"}
+        identifiers = []
+        while True:
+            tree = etree.fromstring(oaiserver.handleRequest(kw))
+            identifiers.extend(
+                tree.xpath("//oai:identifier/text()", namespaces=namespaces)
+            )
+            token = tree.xpath("//oai:resumptionToken/text()", namespaces=namespaces)
+            if not token:
+                break
+            kw = {"verb": "ListIdentifiers", "resumptionToken": token[0]}
+
+        self.assertEqual(
+            [i.rsplit(":")[-1] for i in identifiers], ["doc%d" % i for i in range(9)]
+        )
+
+    def test_tokens_are_decoded_without_cgi(self):
+        token = server.server.encodeResumptionToken(
+            {"metadataPrefix": "oai_dc", "from_": datetime(2020, 5, 1), "set": ""}, 3
+        )
+        self.assertEqual(
+            server.decode_resumption_token(token),
+            ({"metadataPrefix": "oai_dc", "from_": datetime(2020, 5, 1), "set": ""}, 3),
+        )
+
+    def test_bad_tokens_are_rejected(self):
+        for token in ["metadataPrefix=oai_dc", "cursor=3&from_=may", "foo"]:
+            with self.subTest(token=token):
+                self.assertRaises(
+                    error.BadResumptionTokenError,
+                    server.decode_resumption_token,
+                    token,
+                )
+
+
+class CachingWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.record = mock.Mock()
+        self.record.metadata.return_value = common.Metadata(
+            None, {"title": [{"text": "Título", "lang": "pt"}]}
+        )
+        self.writer = server.caching_writer(server.lang_aware_oai_dc_writer)
+
+    def test_rendering_is_stored_when_absent(self):
+        self.record.rendered.return_value = None
+        element = etree.Element("metadata")
+        self.writer(element, server.CachedMetadata(self.record, "oai_dc"))
+        metadata_prefix, xml = self.record.store_rendered.call_args.args
+        self.assertEqual(metadata_prefix, "oai_dc")
+        self.assertEqual(xml, etree.tostring(element[0]))
+
+    def test_stored_rendering_is_reused(self):
+        self.record.rendered.return_value = b'<dc xmlns="urn:x"><title>T</title></dc>'
+        element = etree.Element("metadata")
+        self.writer(element, server.CachedMetadata(self.record, "oai_dc"))
+        self.assertEqual(
+            etree.tostring(element[0]), b'<dc xmlns="urn:x"><title>T</title></dc>'
+        )
+        self.record.metadata.assert_not_called()
+        self.record.store_rendered.assert_not_called()
+
+
+class StreamingServerTests(unittest.TestCase):
+    def setUp(self):
+        self.headers = [
+            common.Header(
+                element=None,
+                identifier="oai:scielo.org:doc%d" % i,
+                datestamp=datetime(2020, 5, 14, 19, 48, i),
+                setspec=["abc"],
+                deleted=False,
+            )
+            for i in range(3)
+        ]
+        self.oaiserver = mock.Mock()
+        self.oaiserver.identify.return_value = common.Identify(
+            repositoryName="SciELO",
+            baseURL="http://www.scielo.br/oai/scielo-oai.php",
+            protocolVersion="2.0",
+            adminEmails=["scielo@scielo.org"],
+            earliestDatestamp=datetime(1998, 1, 1),
+            deletedRecord="no",
+            granularity="YYYY-MM-DDThh:mm:ssZ",
+            compression=["identity"],
+        )
+        self.server = server.StreamingServer(self.oaiserver, resumption_batch_size=2)
+
+    def test_list_identifiers_is_streamed(self):
+        self.oaiserver.listIdentifiers.return_value = iter(self.headers)
+
+        body = self.server.handleRequest(
+            {"verb": "ListIdentifiers", "metadataPrefix": "oai_dc"}
+        )
+
+        self.assertNotIsInstance(body, bytes)
+        tree = etree.fromstring(b"".join(body))
+        namespaces = {"oai": "http://www.openarchives.org/OAI/2.0/"}
+        self.assertEqual(
+            tree.xpath("//oai:header/oai:identifier/text()", namespaces=namespaces),
+            ["oai:scielo.org:doc0", "oai:scielo.org:doc1"],
+        )
+        self.assertEqual(
+            len(tree.xpath("//oai:resumptionToken", namespaces=namespaces)), 1
+        )
+        self.oaiserver.listIdentifiers.assert_called_once_with(
+            cursor=0, batch_size=3, metadataPrefix="oai_dc"
+        )
+
+    def test_empty_list_is_an_error(self):
+        self.oaiserver.listIdentifiers.return_value = iter([])
+
+        body = self.server.handleRequest(
+            {"verb": "ListIdentifiers", "metadataPrefix": "oai_dc"}
+        )
+
+        self.assertIsInstance(body, bytes)
+        self.assertIn(b'code="noRecordsMatch"', body)
+
+
+class GetRecordCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.documents.fetch.return_value.deleted = False
+        self.oaiserver = server.OAIServer(
+            self.session,
+            meta=mock.Mock(**{"deletedRecord.return_value": "persistent"}),
+            formats=server.METADATA_FORMATS,
+            cache_rendered=True,
+            records_cache=cache.LRUCache(),
+        )
+
+    def test_records_are_fetched_once(self):
+        first = self.oaiserver.getRecord("oai_dc", "oai:scielo.org:doc")
+        second = self.oaiserver.getRecord("oai_dc", "oai:scielo.org:doc")
+
+        self.assertIs(first, second)
+        self.session.documents.fetch.assert_called_once()
+
+    def test_renderings_are_kept_in_cache(self):
+        header, metadata, _ = self.oaiserver.getRecord("oai_dc", "oai:scielo.org:doc")
+        metadata.store(b"<oai_dc:dc/>")
+
+        _, metadata, _ = self.oaiserver.getRecord("oai_dc", "oai:scielo.org:doc")
+        self.assertEqual(metadata.xml, b"<oai_dc:dc/>")
+
+
+class MetadataFormatsTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.oaiserver = server.OAIServer(
+            self.session,
+            meta=mock.Mock(**{"deletedRecord.return_value": "persistent"}),
+            formats=server.METADATA_FORMATS,
+            cache_rendered=True,
+        )
+        self.record = mongodb.OAIRecord(
+            {
+                "doc_id": "doc",
+                "timestamp": datetime(2020, 5, 14),
+                "journal_acron": "rsp",
+                "doi": "10.1590/doc",
+                "publisher": "FSP-USP",
+                "language": "pt",
+                "xml": mongodb.zlib.compress(b"<article/>"),
+            },
+            context={"url_for_html": lambda acron, doc_id: "http://x/" + doc_id},
+        )
+        self.session.documents.fetch.return_value = self.record
+
+    def test_jats_is_served_from_the_stored_xml(self):
+        _, metadata, _ = self.oaiserver.getRecord("jats", "oai:scielo.org:doc")
+        self.assertEqual(metadata.xml, b"<article/>")
+        # apenas o XML comprimido é mantido no *cache* de GetRecord.
+        self.assertEqual(metadata.compressed_xml, self.record.data["xml"])
+        self.assertNotIn("xml", vars(metadata))
+        self.assertEqual(
+            self.session.documents.fetch.call_args.kwargs["projection"],
+            mongodb.XML_PROJECTION,
+        )
+
+    def test_records_without_stored_xml_cannot_be_disseminated_as_jats(self):
+        del self.record.data["xml"]
+        self.assertRaises(
+            error.CannotDisseminateFormatError,
+            self.oaiserver.getRecord,
+            "jats",
+            "oai:scielo.org:doc",
+        )
+
+    def test_stored_xml_is_not_fetched_for_dublin_core(self):
+        self.oaiserver.getRecord("oai_dc", "oai:scielo.org:doc")
+        self.assertEqual(
+            self.session.documents.fetch.call_args.kwargs["projection"],
+            mongodb.DESCRIPTIVE_PROJECTION,
+        )
+
+    def test_jats_schema_is_served_relative_to_the_base_url(self):
+        settings = {
+            "oaipmh.repo.baseurl": "http://www.scielo.br/oai/scielo-oai.php",
+            "oaipmh.formats": "oai_dc jats",
+        }
+        with mock.patch.object(server.mongodb, "MongoDB"):
+            app = server.main({}, **settings)
+
+        response = Request.blank("/?verb=ListMetadataFormats").get_response(app)
+        schemas = etree.fromstring(response.body).xpath(
+            "//oai:schema/text()",
+            namespaces={"oai": "http://www.openarchives.org/OAI/2.0/"},
+        )
+        self.assertEqual(
+            schemas,
+            [
+                "http://www.openarchives.org/OAI/2.0/oai_dc.xsd",
+                "http://www.scielo.br/oai/scielo-oai.php/schemas/jats.xsd",
+            ],
+        )
+
+        response = Request.blank("/schemas/jats.xsd").get_response(app)
+        schema = etree.fromstring(response.body)
+        self.assertEqual(schema.get("targetNamespace"), jats.NAMESPACE)
+        self.assertEqual(schema[0].get("schemaLocation"), jats.JATS_SCHEMA_LOCATION)
+
+    def test_openaire_dublin_core(self):
+        map = server.openaire_metadata(self.record).getMap()
+        self.assertIn("info:eu-repo/semantics/publishedVersion", map["type"])
+        self.assertEqual(
+            map["relation"], ["info:eu-repo/semantics/altIdentifier/doi/10.1590/doc"]
+        )
+
+
+class IdentifyTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.oaiserver = server.OAIServer(
+            self.session,
+            meta=server.server_identity(
+                server.parse_settings({}), earliest_datestamp=datetime(1998, 1, 1)
+            ),
+            formats=server.METADATA_FORMATS,
+        )
+
+    def test_earliest_datestamp_is_updated(self):
+        self.session.variables.fetch.return_value = datetime(2000, 1, 1)
+        self.oaiserver.update_earliest_datestamp()
+        self.assertEqual(
+            self.oaiserver.identify().earliestDatestamp(), datetime(2000, 1, 1)
+        )
+
+    def test_first_identify_answers_the_refreshed_datestamp(self):
+        self.session.variables.fetch.return_value = datetime(2000, 1, 1)
+        self.oaiserver.refresh_meta = cache.PeriodicRefresh(
+            self.oaiserver.update_earliest_datestamp, timeout=5.0
+        )
+        self.assertEqual(
+            self.oaiserver.identify().earliestDatestamp(), datetime(2000, 1, 1)
+        )
+
+    def test_earliest_datestamp_falls_back_to_the_documents(self):
+        self.session.variables.fetch.return_value = None
+        self.session.documents.earliest_datestamp.return_value = datetime(2001, 1, 1)
+        self.oaiserver.update_earliest_datestamp()
+        self.assertEqual(
+            self.oaiserver.identify().earliestDatestamp(), datetime(2001, 1, 1)
+        )
+
+    def test_identify_response_is_serialized_once(self):
+        oaiserver = server.KeysetBatchingServer(self.oaiserver)
+        oaiserver.handleRequest({"verb": "Identify"})
+        with mock.patch.object(oaiserver._tree_server, "identify") as identify:
+            body = oaiserver.handleRequest({"verb": "Identify"})
+
+        identify.assert_not_called()
+        self.assertIn(
+            b"<earliestDatestamp>1998-01-01T00:00:00Z</earliestDatestamp>", body
+        )
+        self.assertEqual(
+            len(etree.fromstring(body).xpath("//*[local-name()='responseDate']")), 1
+        )
+
+    def test_identify_response_follows_the_updates(self):
+        oaiserver = server.KeysetBatchingServer(self.oaiserver)
+        oaiserver.handleRequest({"verb": "Identify"})
+        self.session.variables.fetch.return_value = datetime(2000, 1, 1)
+        self.oaiserver.update_earliest_datestamp()
+
+        body = oaiserver.handleRequest({"verb": "Identify"})
+        self.assertIn(
+            b"<earliestDatestamp>2000-01-01T00:00:00Z</earliestDatestamp>", body
+        )
+
+    def test_supported_encodings_are_advertised(self):
+        self.assertEqual(self.oaiserver.identify().compression(), ["gzip", "deflate"])
+
+
+class RootViewTests(unittest.TestCase):
+    def make_request(self, body, **headers):
+        request = Request.blank("/?verb=ListRecords", headers=headers)
+        request.registry = mock.Mock(
+            settings={
+                "oaipmh.response.compressionlevel": 6,
+                "oaipmh.formats": ["oai_dc"],
+            }
+        )
+        request.oaiserver = mock.Mock(**{"handleRequest.return_value": body})
+        return request
+
+    def test_responses_are_compressed_on_demand(self):
+        response = server.root(
+            self.make_request(b"<OAI-PMH/>", **{"Accept-Encoding": "gzip"})
+        )
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertEqual(response.vary, ("Accept-Encoding",))
+        self.assertEqual(gzip.decompress(response.body), b"<OAI-PMH/>")
+
+    def test_streamed_responses_are_compressed(self):
+        response = server.root(
+            self.make_request(
+                iter([b"<OAI-PMH>", b"</OAI-PMH>"]), **{"Accept-Encoding": "gzip"}
+            )
+        )
+        self.assertEqual(
+            gzip.decompress(b"".join(response.app_iter)), b"<OAI-PMH></OAI-PMH>"
+        )
+
+    def test_responses_are_not_compressed_by_default(self):
+        response = server.root(self.make_request(b"<OAI-PMH/>"))
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.body, b"<OAI-PMH/>")
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.documents.filter.return_value = [
+            mock.Mock(**{"header.return_value": "header%d" % i}) for i in range(3)
+        ]
+        self.oaiserver = server.OAIServer(
+            self.session,
+            meta=mock.Mock(**{"deletedRecord.return_value": "persistent"}),
+            formats=server.METADATA_FORMATS,
+        )
+        self.items = server.ITEMS.values().get(("ListIdentifiers", "oai_dc"), 0)
+        self.observations = self.database_observations()
+
+    def database_observations(self):
+        counts, _ = server.DATABASE_DURATION.values().get(
+            ("ListIdentifiers", "oai_dc"), ([0], 0.0)
+        )
+        return sum(counts)
+
+    def test_items_are_counted_as_they_are_consumed(self):
+        headers = self.oaiserver.listIdentifiers(metadataPrefix="oai_dc")
+        self.assertEqual(next(headers), "header0")
+        self.assertEqual(list(headers), ["header1", "header2"])
+
+        self.assertEqual(
+            server.ITEMS.values()[("ListIdentifiers", "oai_dc")], self.items + 3
+        )
+        self.assertEqual(self.database_observations(), self.observations + 1)
+
+    def test_resumed_requests_are_labeled_by_metadata_prefix(self):
+        token = server.server.encodeResumptionToken({"metadataPrefix": "oai_dc"}, 10)
+        self.assertEqual(
+            server.request_labels(
+                {"verb": "ListRecords", "resumptionToken": token}, ["oai_dc"]
+            ),
+            {"verb": "ListRecords", "metadata_prefix": "oai_dc"},
+        )
+
+    def test_arbitrary_values_are_not_used_as_labels(self):
+        self.assertEqual(
+            server.request_labels(
+                {"verb": "DeleteAll", "metadataPrefix": "marc21"}, ["oai_dc"]
+            ),
+            {"verb": "invalid", "metadata_prefix": "unknown"},
+        )
+
+    def test_metrics_are_exposed(self):
+        response = server.metrics_view(Request.blank("/metrics"))
+        self.assertEqual(response.content_type, "text/plain")
+        self.assertIn(
+            b"# TYPE oaipmh_request_duration_seconds histogram", response.body
+        )
+
+
+class JATSEnvelopeTests(unittest.TestCase):
+    xml = (
+        b'<?xml version="1.0" encoding="utf-8"?>\n'
+        b'<!DOCTYPE article PUBLIC "-//NLM//DTD JATS (Z39.96) Journal Publishing '
+        b'DTD v1.1 20151215//EN" "JATS-journalpublishing1.dtd">\n'
+        b'<article xmlns:xlink="http://www.w3.org/1999/xlink"><front>'
+        b'<ext-link xlink:href="http://x">x</ext-link></front></article>'
+    )
+    namespaces = {"oai": "http://www.openarchives.org/OAI/2.0/"}
+
+    def setUp(self):
+        def record(doc_id, **data):
+            return mongodb.OAIRecord(
+                dict(doc_id=doc_id, timestamp=datetime(2020, 5, 14), **data),
+                context={},
+            )
+
+        self.session = session = mock.Mock()
+        session.documents.filter.return_value = [
+            record("doc1", xml=kernel.compress_xml(self.xml)),
+            record("doc2", deleted=True),
+        ]
+        self.oaiserver = server.OAIServer(
+            session,
+            meta=common.Identify(
+                repositoryName="SciELO",
+                baseURL="http://www.scielo.br/oai/scielo-oai.php",
+                protocolVersion="2.0",
+                adminEmails=["scielo@scielo.org"],
+                earliestDatestamp=datetime(1998, 1, 1),
+                deletedRecord="persistent",
+                granularity="YYYY-MM-DDThh:mm:ssZ",
+                compression=["identity"],
+            ),
+            formats=server.METADATA_FORMATS,
+        )
+        self.metadata_registry = metadata.MetadataRegistry()
+        for fmt in server.METADATA_FORMATS:
+            self.metadata_registry.registerWriter(
+                fmt.prefix, server.caching_writer(fmt.writer)
+            )
+
+    def list_records(self, Server):
+        body = Server(
+            self.oaiserver, metadata_registry=self.metadata_registry
+        ).handleRequest({"verb": "ListRecords", "metadataPrefix": "jats"})
+        if not isinstance(body, bytes):
+            body = b"".join(body)
+        return etree.fromstring(body).xpath(
+            "//oai:record", namespaces=self.namespaces
+        )
+
+    def assert_envelope(self, records):
+        first, second = [
+            r.xpath("oai:metadata/*", namespaces=self.namespaces) for r in records
+        ]
+        self.assertEqual(
+            [e.tag for e in first], ["{%s}article" % jats.NAMESPACE]
+        )
+        self.assertEqual(
+            first[0][0][0].get("{http://www.w3.org/1999/xlink}href"), "http://x"
+        )
+        # os registros removidos são listados, sem `metadata`.
+        self.assertEqual(
+            records[1].xpath("oai:metadata", namespaces=self.namespaces), []
+        )
+        # os demais registros sem XML armazenado são omitidos pela consulta.
+        self.assertTrue(self.session.documents.filter.call_args.kwargs["require_xml"])
+
+    def test_stored_xml_keeps_its_namespace(self):
+        self.assert_envelope(self.list_records(server.KeysetBatchingServer))
+
+    def test_streamed_xml_keeps_its_namespace(self):
+        self.assert_envelope(self.list_records(server.StreamingServer))